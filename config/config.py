@@ -20,6 +20,7 @@ class Config:
     MAX_CONTEXT_LENGTH = 2000
     MAX_TURNS_PER_TOPIC = 5
     EMOTION_THRESHOLD = 0.8
+    MAX_RECENT_ENTITIES = 10
     
     # 每个主题的必要元素
     TOPIC_ELEMENTS = {
@@ -60,4 +61,220 @@ class Config:
             "required_aspects": ["基本信息"]
         }
         # ... 其他主题
-    }
\ No newline at end of file
+    }
+    
+    # 对话启发式的关键词表（构建一次多模式匹配自动机，每段回答只扫描一遍）
+    KEYWORDS = {
+        "TOPIC_SWITCH": ["换个话题", "换一个话题", "聊点别的", "说点别的", "不想聊这个"],
+        "NEGATION": ["没有", "不知道", "不记得", "记不清", "忘了"],
+        # 回答中提到这些词时优先切换到对应话题
+        "TOPICS": {
+            "家庭": ["家人", "家里", "父母", "爸爸", "妈妈", "兄弟姐妹", "老伴", "孩子"],
+            "早年生活": ["童年", "小时候", "学生时代", "上学", "年少"],
+            "友谊": ["朋友", "友谊", "同学", "伙伴", "知己"],
+            "影响": ["影响", "启发", "榜样", "改变了我", "教会我"],
+            "成就": ["成就", "获奖", "得奖", "荣誉", "骄傲", "成功"],
+            "职业生涯": ["工作", "职业", "事业", "公司", "单位", "上班", "退休"],
+            "兴趣": ["兴趣", "爱好", "喜欢", "热爱"],
+            "信仰": ["信仰", "宗教", "信念", "人生观", "价值观"],
+            "关键事件": ["转折", "变故", "大事", "那一年", "从那以后"],
+            "旅行": ["旅行", "旅游", "出游", "出国", "去过"],
+            "其他": []
+        },
+        # 新建子主题时按这些词命名（未命中时使用片段中的实体）
+        "SUB_THEMES": {
+            "家庭": {
+                "家庭成员": ["成员", "父母", "姐姐", "哥哥", "弟弟", "妹妹"],
+                "家庭传统": ["传统", "节日", "习俗", "过年", "春节"],
+                "家庭氛围": ["氛围", "关系", "和睦", "吵架"]
+            },
+            "兴趣": {
+                "兴趣起源": ["开始", "第一次", "接触"],
+                "兴趣发展": ["坚持", "练习", "进步"]
+            }
+        }
+    }
+    
+    # 实体词典配置（本地快速抽取）
+    GAZETTEER = {
+        "STORAGE_PATH": "./data/gazetteer.json",
+        "MIN_COVERAGE": 0.6,         # 词典覆盖率达到该值时跳过LLM抽取
+        "ASYNC_REFINE": True,        # 覆盖率不足时先返回词典结果，后台用LLM补全
+        "REFINE_RELATIONS": False,   # 词典覆盖充分但有多个实体时，后台用LLM只抽取实体间的关系（每轮多一次调用）
+        "SEED_CONFIDENCE": 0.95,     # 预置词条的置信度
+        "MAX_ENTITY_LENGTH": 12,     # 可学习的实体最大长度
+        "NON_KEYWORD_TYPES": ["人物"],  # 不作为关键词的实体类型
+        "STOP_CHARS": "的了和在是也都就很又还着过把被给与跟们吧呢啊吗呀个一",
+        "SEED_ENTITIES": {
+            "人物": [
+                "我", "我们", "父母", "父亲", "母亲", "爸爸", "妈妈", "姐姐", "哥哥",
+                "弟弟", "妹妹", "爷爷", "奶奶", "外公", "外婆", "丈夫", "妻子",
+                "孩子", "儿子", "女儿", "朋友", "同学", "老师", "同事", "家人"
+            ],
+            "时间": [
+                "从小", "小时候", "童年", "上学时", "大学时", "去年", "今年", "前年",
+                "春节", "去年春节", "中秋", "国庆", "周末", "暑假", "寒假", "每年", "后来"
+            ],
+            "地点": [
+                "北京", "上海", "广州", "深圳", "家里", "老家", "家乡", "学校",
+                "大学", "公司", "农村", "城市"
+            ],
+            "事件": [
+                "团聚", "包饺子", "教育", "学习", "毕业", "结婚", "旅行", "工作",
+                "搬家", "考试", "出差", "聚会", "看春晚", "聊天"
+            ]
+        }
+    }
+    
+    # 知识图谱配置
+    KNOWLEDGE_GRAPH = {
+        "STORAGE_PATH": "./data/knowledge_graph.jsonl",
+        "EVENT_TYPE": "事件"
+    }
+    
+    # 词法检索配置（二元组倒排索引 + BM25）
+    LEXICAL_INDEX = {
+        "STORAGE_PATH": "./data/lexical_index.jsonl",  # 分租户之前的共用索引（启动时迁移）
+        "TENANT_DIR": "./data/lexical_index",         # 每个租户一个索引文件
+        "K1": 1.5,
+        "B": 0.75,
+        "CANDIDATE_MULTIPLIER": 4,   # 融合/过滤前每路召回 k * 该倍数个候选
+        "MAX_DF_RATIO": 0.5,         # 文档频率超过该比例的词项在查询时跳过
+        "HYBRID_ALPHA": 0.5          # 混合检索中向量分数的权重
+    }
+    
+    # 向量库配置
+    VECTOR_STORE = {
+        "BACKEND": "chroma",         # 向量库后端：chroma / local（进程内NumPy/HNSW索引）
+        "PERSIST_DIRECTORY": "./chroma_db",
+        "LOCAL_DIRECTORY": "./data/vectors",  # local后端的数据目录
+        "HNSW_THRESHOLD": 20000,     # local后端：有效向量数达到该值后改用HNSW近似检索
+        "HNSW_M": 16,
+        "HNSW_EF_CONSTRUCTION": 200,
+        "HNSW_EF_SEARCH": 64,
+        "QUANTIZATION": "none",      # local后端精确检索使用的量化向量：none / float16 / int8
+        "RERANK_FACTOR": 4,          # 量化粗排选出k*该倍数个候选，再用全精度向量重排
+        "MAX_CONCURRENCY": 4,        # 同时进行的嵌入请求和索引读写数（在专用线程池中执行）
+        "MAX_OPEN_COLLECTIONS": 8,   # 同时打开的租户集合（及词法索引）数
+        "MIGRATE_LEGACY": True,      # 启动时将分租户之前的共用集合按会话拆分
+        "RECENT_EMBEDDINGS": 256     # 保留最近写入记忆的向量数（供子主题聚类复用，不重复嵌入）
+    }
+    
+    # 子主题在线聚类配置（按内容片段的嵌入向量形成子主题）
+    SUB_THEMES = {
+        "ENABLED": True,
+        "STORAGE_PATH": "./data/sub_theme_clusters.json",
+        "ASSIGN_THRESHOLD": 0.75,    # 与最相近子主题中心的余弦相似度达到该值时归入，否则新建子主题
+        "MERGE_THRESHOLD": 0.9,      # 两个子主题中心的相似度达到该值时合并
+        "MAX_CLUSTERS": 8            # 每个主题的子主题数上限
+    }
+    
+    # 分层对话记忆（短期环形缓冲、按话题的长期记忆、话题兴趣与情绪的滚动统计）
+    ATTENTION_MEMORY = {
+        "SPILL_DIR": "./data/attention",
+        "SHORT_TERM_SIZE": 20,       # 短期记忆保留的最近轮次，更早的轮次移入长期记忆
+        "LONG_TERM_SIZE": 50,        # 每个话题在内存中保留的长期记忆轮次，其余只保存在磁盘
+        "SPILL_BATCH": 50,           # 待写入磁盘的轮次达到该数时立即写入（否则随自动保存写入）
+        "INTEREST_ALPHA": 0.3,       # 话题兴趣度滑动平均的权重
+        "UNVISITED_PRIOR": 0.8,      # 选择新话题时未聊过的话题的兴趣度
+        "EMOTION_WINDOW": 10         # 每个话题保留的最近情绪分数
+    }
+    
+    # 子主题摘要配置（生成主题内容时，较长的子主题以缓存的摘要代替原始片段）
+    SUMMARY = {
+        "ENABLED": True,
+        "STORAGE_PATH": "./data/summaries.json",
+        "MIN_CHARS": 600,            # 子主题原始片段合计超过该字数时使用摘要
+        "CHUNK_CHARS": 3000          # 每次并入摘要的片段合计字数上限
+    }
+    
+    # 主题生成结果缓存（输入指纹相同时不再调用LLM）
+    GENERATION_CACHE = {
+        "STORAGE_PATH": "./data/generation_cache.json",
+        "MAX_PER_THEME": 5           # 每个主题保留的生成结果数
+    }
+    
+    # 全书汇编配置（各主题章节并发生成，过长的主题先分块摘要再合并）
+    BIOGRAPHY = {
+        "MAX_CONCURRENCY": 4,        # 同时进行的生成请求数（仍受API限流约束）
+        "CHUNK_CHARS": 3000,         # 主题内容超过该字数时分块摘要
+        "MAX_REDUCE_ROUNDS": 3,      # 摘要仍过长时最多再汇总的轮数
+        "TRANSITION_CONTEXT": 200,   # 生成过渡句时参考的上一章结尾/下一章开头字数
+        "TRANSITIONS": True          # 是否为相邻章节生成过渡
+    }
+    
+    # 相关记忆预取配置
+    PREFETCH = {
+        "ENABLED": True,
+        "K": 3,                  # 预取的记忆条数
+        "MODE": "hybrid",        # 检索模式：hybrid / lexical / vector
+        "MAX_ENTITIES": 5        # 参与检索的最近实体数
+    }
+    
+    # 问题预生成配置（预生成的问题不包含对用户回答的回应）
+    SPECULATION = {
+        "ENABLED": False,
+        "BRANCHES": 2,           # 每次空闲时预生成的策略分支数
+        "MAX_CALLS": 20,         # 每个会话预生成调用次数上限
+        "MAX_CACHE": 8           # 缓存的候选问题数上限
+    }
+    
+    # 本地存储与会话恢复配置
+    STORAGE = {
+        "DIR": "./data",
+        "RECENT_TURNS": 20,          # 会话文件中保留的最近对话轮次
+        "THEME_CACHE_SIZE": 4,       # 内存中保留的完整主题数
+        "CONTENT_CACHE_SIZE": 4,     # 内存中保留的生成内容数
+        "SEGMENT_CACHE_SIZE": 2000,  # 内存中保留的已解析内容片段数
+        "TURN_CACHE_SIZE": 2000,     # 内存中保留的已解析对话轮次数
+        "FORMAT": "json",            # 主题和记录表的编码格式：json/msgpack（切换格式不迁移已有数据）
+        "FAST_LOAD": True,           # 当前版本写入的本地数据跳过pydantic校验直接构建
+        "AUTOSAVE_DEBOUNCE": 2.0,    # 最后一次修改后安静多少秒再保存
+        "AUTOSAVE_MAX_DELAY": 30.0,  # 修改最多延迟多少秒保存（持续修改时）
+        "AUTOSAVE_MAX_FAILURES": 5,  # 连续保存失败该次数后暂停自动重试，有新的修改时再尝试
+        "IO_WORKERS": 4              # 磁盘读写线程池大小
+    }
+    
+    # API调用重试、熔断与对冲请求配置（ROLES中按调用角色覆盖DEFAULT）
+    API_RETRY = {
+        "DEFAULT": {
+            "MAX_RETRIES": 3,            # 最多尝试次数
+            "BASE_DELAY": 2.0,           # 指数退避的基础延迟（秒），实际延迟在[0, 上限]内随机
+            "MAX_DELAY": 30.0,           # 单次退避延迟上限（秒）
+            "MAX_RETRY_AFTER": 60.0,     # 服务端Retry-After的最长等待（秒）
+            "BREAKER_THRESHOLD": 5,      # 连续临时性失败达到该次数后熔断
+            "BREAKER_COOLDOWN": 30.0,    # 熔断后多久放行一次探测请求（秒）
+            "HEDGE_AFTER": None          # 超过该秒数未返回时发出对冲请求，None表示不对冲
+        },
+        "ROLES": {
+            "question": {"MAX_RETRIES": 2, "HEDGE_AFTER": 8.0},  # 用户在等待下一个问题
+            "extract": {},
+            "refine": {},                                        # 后台补全抽取
+            "identify": {},
+            "generate": {"MAX_RETRIES": 4, "MAX_DELAY": 60.0},
+            "summarize": {"MAX_RETRIES": 4, "MAX_DELAY": 60.0},  # 汇编全书时的分块摘要
+            "transition": {"MAX_RETRIES": 2},                     # 汇编全书时的章节过渡
+            "speculate": {"MAX_RETRIES": 1}                      # 后台预生成，失败即放弃
+        }
+    }
+    
+    # token用量、费用统计与会话预算（价格单位：元/千token）
+    USAGE = {
+        "PRICES": {
+            "glm-4": {"INPUT": 0.1, "OUTPUT": 0.1},
+            "glm-4-plus": {"INPUT": 0.05, "OUTPUT": 0.05},
+            "glm-4-air": {"INPUT": 0.001, "OUTPUT": 0.001},
+            "glm-4-flash": {"INPUT": 0.0, "OUTPUT": 0.0},
+            "embedding-2": {"INPUT": 0.0005, "OUTPUT": 0.0},
+            "embedding-3": {"INPUT": 0.0005, "OUTPUT": 0.0}
+        },
+        "DEFAULT_PRICE": {"INPUT": 0.05, "OUTPUT": 0.05},  # 未列出的模型按该价格估算
+        "CHARS_PER_TOKEN": 1.5,      # 响应未提供用量时按字符数估算token数
+        "SESSION_BUDGET": {
+            "TOKENS": None,          # 每个会话的token上限，None表示不限
+            "COST": None             # 每个会话的费用上限（元），None表示不限
+        },
+        "DEGRADE_AT": 0.8,           # 已用预算达到该比例后降级
+        "OPTIONAL_ROLES": ["speculate", "refine", "transition"],  # 降级时跳过的调用角色
+        "FALLBACK_MODEL": "glm-4-flash"             # 降级时其余角色改用的低价模型
+    }
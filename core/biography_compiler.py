@@ -0,0 +1,141 @@
+import asyncio
+import time
+from typing import Any, Dict, List, Optional
+from models.content_manager import ThematicContent
+from core.content_generator import ContentGenerator, chunk_texts
+from config.config import Config
+
+class BiographyCompiler:
+    """汇编完整传记（map-reduce）
+
+    map：各主题的章节并发生成（同时进行的请求数受MAX_CONCURRENCY限制，并仍经过API限流）；
+    较长的子主题使用生成器缓存的摘要，内容仍超过CHUNK_CHARS的主题再分块摘要，
+    摘要合计仍过长时逐轮再汇总，最后由摘要生成章节。
+    reduce：按Config.TOPICS的顺序拼接章节，并为相邻章节生成过渡句。
+    """
+
+    def __init__(self, generator: ContentGenerator, config: Optional[Dict] = None):
+        self.generator = generator
+        self.config = config or Config.BIOGRAPHY
+
+    async def compile(self, themes: Dict[str, ThematicContent]) -> Dict[str, Any]:
+        """生成全书，返回各章节、过渡句、全文和耗时报告"""
+        start = time.perf_counter()
+        # 每次汇编的并发限制和报告只属于本次调用，同一编译器可同时汇编多次
+        report: Dict[str, Any] = {
+            "themes": len(themes),
+            "llm_calls": 0,
+            "chunked": {},
+            "cached": [],
+            "failed": [],
+            "chapter_seconds": {}
+        }
+        run = {"semaphore": asyncio.Semaphore(self.config["MAX_CONCURRENCY"]), "report": report}
+
+        # map：各章节并发生成
+        order = [t for t in Config.TOPICS if t in themes] + [t for t in themes if t not in Config.TOPICS]
+        results = await asyncio.gather(*[self._chapter(run, themes[theme]) for theme in order])
+        chapters = {theme: text for theme, text in zip(order, results) if text}
+        report["map_seconds"] = time.perf_counter() - start
+
+        # reduce：相邻章节之间的过渡
+        transition_start = time.perf_counter()
+        transitions = await self._transitions(run, chapters) if self.config["TRANSITIONS"] else {}
+        report["transition_seconds"] = time.perf_counter() - transition_start
+
+        parts = []
+        for theme, text in chapters.items():
+            parts.append(f"## {theme}\n\n{text}")
+            if transitions.get(theme):
+                parts.append(transitions[theme])
+        report["chapters"] = len(chapters)
+        report["total_seconds"] = time.perf_counter() - start
+        return {
+            "chapters": chapters,
+            "transitions": transitions,
+            "text": "\n\n".join(parts),
+            "report": report
+        }
+
+    async def _call(self, run: Dict, coroutine_function, *args) -> str:
+        async with run["semaphore"]:
+            run["report"]["llm_calls"] += 1
+            return await coroutine_function(*args)
+
+    async def _chapter(self, run: Dict, theme_content: ThematicContent) -> Optional[str]:
+        """生成一个主题的章节，失败时返回None（不影响其他章节）"""
+        theme = theme_content.main_theme
+        report = run["report"]
+        start = time.perf_counter()
+        try:
+            # 输入未变化的章节直接使用已生成的内容
+            fingerprint = self.generator.fingerprint(theme_content)
+            cached = self.generator.cached_content(fingerprint)
+            if cached is not None:
+                report["cached"].append(theme)
+                return cached
+            # 子主题摘要请求同样受本次汇编的并发限制并计入调用次数
+            organized = await self.generator.prepare_content(
+                theme_content, call=lambda *args: self._call(run, *args)
+            )
+            texts = [
+                f"[{sub_name}] {segment}"
+                for sub_name, sub_content in organized["sub_themes"].items()
+                for segment in sub_content["segments"]
+            ]
+            chunked = sum(map(len, texts)) > self.config["CHUNK_CHARS"]
+            if chunked:
+                summaries = await self._condense(run, theme, texts)
+                organized = {
+                    **organized,
+                    "sub_themes": {
+                        f"第{i + 1}部分": {"segments": [summary]}
+                        for i, summary in enumerate(summaries)
+                    }
+                }
+            chapter = await self._call(run, self.generator.write_chapter, theme, organized)
+            if not chunked:
+                # 分块汇总后生成的章节与单次生成的提示不同，不作为该指纹的结果
+                await self.generator.remember(fingerprint, theme, chapter)
+            return chapter
+        except Exception as e:
+            print(f"生成章节失败 [{theme}]: {e}")
+            report["failed"].append(theme)
+            return None
+        finally:
+            report["chapter_seconds"][theme] = time.perf_counter() - start
+
+    async def _condense(self, run: Dict, theme: str, texts: List[str]) -> List[str]:
+        """分块并发摘要，合计长度仍超过CHUNK_CHARS时对摘要再汇总"""
+        limit = self.config["CHUNK_CHARS"]
+        for _ in range(self.config["MAX_REDUCE_ROUNDS"]):
+            if len(texts) <= 1 or sum(map(len, texts)) <= limit:
+                break
+            chunks = chunk_texts(texts, limit)
+            chunked = run["report"]["chunked"]
+            chunked[theme] = chunked.get(theme, 0) + len(chunks)
+            texts = list(await asyncio.gather(*[
+                self._call(run, self.generator.summarize_chunk, theme, chunk) for chunk in chunks
+            ]))
+        return texts
+
+    async def _transitions(self, run: Dict, chapters: Dict[str, str]) -> Dict[str, str]:
+        """并发为相邻章节生成过渡句，键为上一章的主题；失败或被预算跳过的过渡留空"""
+        context = self.config["TRANSITION_CONTEXT"]
+        themes = list(chapters)
+
+        async def transition(previous: str, following: str) -> str:
+            try:
+                return await self._call(
+                    run, self.generator.write_transition,
+                    previous, chapters[previous][-context:],
+                    following, chapters[following][:context]
+                )
+            except Exception as e:
+                print(f"生成过渡失败 [{previous} -> {following}]: {e}")
+                return ""
+
+        results = await asyncio.gather(*[
+            transition(previous, following) for previous, following in zip(themes, themes[1:])
+        ])
+        return {previous: text for previous, text in zip(themes, results) if text}
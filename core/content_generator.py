@@ -1,25 +1,161 @@
-from typing import List, Dict
+import asyncio
+import hashlib
+from collections import Counter
+from typing import List, Dict, Optional, TYPE_CHECKING
 from datetime import datetime
-from langchain_community.chat_models import ChatZhipuAI
-from langchain_core.messages import SystemMessage, HumanMessage
 from models.content_manager import ThematicContent, SubTheme, ContentSegment
+from core.knowledge_graph import KnowledgeGraph
+from core.summary_cache import SummaryCache
+from core.generation_cache import GenerationCache
+from utils.api_manager import api_manager
+from utils.io_pool import run_io
+from config.config import Config
+
+if TYPE_CHECKING:
+    from langchain_community.chat_models import ChatZhipuAI
+
+# 生成提示词模板的版本，修改提示词或提示内容的组织方式时递增，使缓存的生成结果失效
+PROMPT_VERSION = 2
+
+def chunk_texts(texts: List[str], limit: int) -> List[List[str]]:
+    """按顺序把文本分成合计长度不超过limit的块（单条超长的文本单独成块）"""
+    chunks: List[List[str]] = []
+    size = 0
+    for text in texts:
+        if not chunks or size + len(text) > limit:
+            chunks.append([])
+            size = 0
+        chunks[-1].append(text)
+        size += len(text)
+    return chunks
 
 class ContentGenerator:
-    def __init__(self, llm: ChatZhipuAI):
+    def __init__(self,
+                 llm: 'ChatZhipuAI',
+                 knowledge_graph: Optional[KnowledgeGraph] = None,
+                 summary_cache: Optional[SummaryCache] = None,
+                 generation_cache: Optional[GenerationCache] = None):
         self.llm = llm
+        self.knowledge_graph = knowledge_graph
+        # 按输入指纹缓存的生成结果，未提供时每次都调用LLM
+        self.generation_cache = generation_cache
+        # 子主题摘要缓存，未提供时提示中使用全部原始片段
+        self.summary_cache = summary_cache
+        self.summary_config = Config.SUMMARY
+        self.summary_stats: Counter = Counter()
+        self.generation_stats: Counter = Counter()
         
     async def generate_theme_content(self, 
                                    theme_content: ThematicContent) -> str:
-        """为主题生成内容"""
+        """为主题生成内容（输入指纹与已有结果相同时直接返回，不调用LLM）"""
+        fingerprint = self.fingerprint(theme_content)
+        cached = self.cached_content(fingerprint)
+        if cached is not None:
+            return cached
         
-        # 1. 整理子主题内容
-        organized_content = self._organize_content(theme_content)
+        # 1. 整理子主题内容（较长的子主题使用缓存的摘要）
+        organized_content = await self.prepare_content(theme_content)
         
         # 2. 生成内容
-        return await self._generate_content(
+        content = await self.write_chapter(
             theme_content.main_theme,
             organized_content
         )
+        await self.remember(fingerprint, theme_content.main_theme, content)
+        return content
+        
+    def fingerprint(self, theme_content: ThematicContent) -> str:
+        """生成输入的指纹：主题、各子主题的内容片段ID、提示词模板版本和模型"""
+        parts = [
+            theme_content.main_theme,
+            f"prompt-v{PROMPT_VERSION}",
+            api_manager.model_of(self.llm.ainvoke)
+        ]
+        for sub_name in sorted(theme_content.sub_themes):
+            segment_ids = sorted(seg.id for seg in theme_content.sub_themes[sub_name].content_segments)
+            parts.append(f"{sub_name}:{','.join(segment_ids)}")
+        return hashlib.sha1("\n".join(parts).encode('utf-8')).hexdigest()
+        
+    def cached_content(self, fingerprint: str) -> Optional[str]:
+        """指纹相同的已生成内容，没有时返回None"""
+        if self.generation_cache is None:
+            return None
+        content = self.generation_cache.get(fingerprint)
+        self.generation_stats["hits" if content is not None else "misses"] += 1
+        return content
+        
+    async def remember(self, fingerprint: str, theme: str, content: str):
+        """记录生成结果
+        
+        预算接近上限时生成请求可能已改用低价模型，其结果不能记在主模型的指纹下。
+        用量只增不减，调用后状态仍为normal说明本次使用的是主模型。
+        """
+        if self.generation_cache is None:
+            return
+        if api_manager.usage.status() != "normal":
+            self.generation_stats["skipped_degraded"] += 1
+            return
+        self.generation_cache.put(fingerprint, theme, content)
+        await run_io(self.generation_cache.save)
+        
+    async def prepare_content(self, theme_content: ThematicContent, call=None) -> Dict:
+        """整理主题内容，篇幅超过MIN_CHARS的子主题以摘要代替原始片段
+        
+        各子主题的摘要并发更新：片段未变的子主题直接使用缓存，只新增片段的子主题把新片段并入原摘要。
+        提供call(函数, *参数)时摘要请求经由它发出（如全书汇编的并发限制和调用计数）。
+        """
+        organized = self._organize_content(theme_content)
+        if self.summary_cache is None or not self.summary_config["ENABLED"]:
+            return organized
+        
+        theme = theme_content.main_theme
+        names = list(theme_content.sub_themes)
+        summaries = await asyncio.gather(*[
+            self._sub_theme_summary(theme, name, theme_content.sub_themes[name].content_segments, call)
+            for name in names
+        ])
+        for name, summary in zip(names, summaries):
+            if summary is not None:
+                organized["sub_themes"][name] = {**organized["sub_themes"][name], "segments": [summary]}
+        await run_io(self.summary_cache.save)
+        return organized
+        
+    async def _sub_theme_summary(self,
+                                 theme: str,
+                                 sub_theme: str,
+                                 segments: List[ContentSegment],
+                                 call=None) -> Optional[str]:
+        """子主题的摘要；篇幅较短无需摘要或摘要失败时返回None（使用原始片段）"""
+        segment_ids = [segment.id for segment in segments]
+        texts = [segment.content for segment in segments]
+        if sum(map(len, texts)) <= self.summary_config["MIN_CHARS"]:
+            return None
+            
+        cached = self.summary_cache.get(theme, sub_theme)
+        if cached and cached["segment_ids"] == segment_ids:
+            self.summary_stats["hits"] += 1
+            return cached["summary"]
+            
+        summary = None
+        if cached and segment_ids[:len(cached["segment_ids"])] == cached["segment_ids"]:
+            # 只新增了片段：把新片段并入原摘要
+            summary = cached["summary"]
+            texts = texts[len(cached["segment_ids"]):]
+            self.summary_stats["updates"] += 1
+        else:
+            self.summary_stats["rebuilds"] += 1
+        try:
+            # 篇幅过长时分块依次并入摘要
+            for chunk in chunk_texts(texts, self.summary_config["CHUNK_CHARS"]):
+                if call is None:
+                    summary = await self.summarize_chunk(theme, chunk, summary)
+                else:
+                    summary = await call(self.summarize_chunk, theme, chunk, summary)
+        except Exception as e:
+            print(f"子主题摘要失败 [{theme}/{sub_theme}]: {e}")
+            return None
+        self.summary_cache.put(theme, sub_theme, segment_ids, summary)
+        return summary
         
     def _organize_content(self, theme_content: ThematicContent) -> Dict:
         """整理主题内容，按子主题组织"""
@@ -27,8 +163,10 @@ class ContentGenerator:
             "main_theme": theme_content.main_theme,
             "sub_themes": {},
             "timeline": [],
-            "key_entities": {}
+            "key_entities": {},
+            "relations": []
         }
+        segment_ids = []
         
         # 处理每个子��题
         for sub_name, sub_theme in theme_content.sub_themes.items():
@@ -49,6 +187,7 @@ class ContentGenerator:
             }
             
             organized["sub_themes"][sub_name] = sub_content
+            segment_ids.extend(seg.id for seg in sub_theme.content_segments)
             
             # 添加到时间线
             organized["timeline"].append({
@@ -56,21 +195,28 @@ class ContentGenerator:
                 "event": sub_name
             })
             
-            # 收集关键实体
-            for entity_type, entities in sub_theme.related_entities.items():
-                if entity_type not in organized["key_entities"]:
-                    organized["key_entities"][entity_type] = set()
-                organized["key_entities"][entity_type].update(entities)
+            # 没有知识图谱时，从子主题汇总关键实体
+            if not self.knowledge_graph:
+                for entity_type, entities in sub_theme.related_entities.items():
+                    if entity_type not in organized["key_entities"]:
+                        organized["key_entities"][entity_type] = set()
+                    organized["key_entities"][entity_type].update(entities)
+        
+        # 从知识图谱获取关键实体和关系
+        if self.knowledge_graph:
+            organized["key_entities"] = self.knowledge_graph.entities_for_segments(segment_ids)
+            organized["relations"] = self.knowledge_graph.relations_for_segments(segment_ids)
         
         # 按时间排序
         organized["timeline"].sort(key=lambda x: x["time"])
         
         return organized
         
-    async def _generate_content(self, 
-                              theme: str, 
-                              organized_content: Dict) -> str:
-        """生成最终内容"""
+    async def write_chapter(self, 
+                            theme: str, 
+                            organized_content: Dict) -> str:
+        """由整理好的主题内容（prepare_content的结果）生成叙述"""
+        from langchain_core.messages import SystemMessage, HumanMessage
         system_message = SystemMessage(content="""
             你是一个专业的传记作家。请根据提供的信息，生成一段连贯、生动的叙述。
             要求：
@@ -95,16 +241,79 @@ class ContentGenerator:
         关键实体：
         {self._format_entities(organized_content['key_entities'])}
         
+        实体关系：
+        {self._format_relations(organized_content['relations'])}
+        
         请生成一段完整的叙述。
         """
         
         human_message = HumanMessage(content=content_prompt)
         
         # 生成��容
-        response = await self.llm.ainvoke([system_message, human_message])
+        response = await api_manager.execute_with_retry(
+            self.llm.ainvoke,
+            [system_message, human_message],
+            role="generate",
+            theme=theme
+        )
         
         return response.content
         
+    async def summarize_chunk(self,
+                              theme: str,
+                              texts: List[str],
+                              previous: Optional[str] = None) -> str:
+        """将回忆片段压缩为摘要；提供previous时把片段并入已有摘要"""
+        from langchain_core.messages import SystemMessage, HumanMessage
+        system_message = SystemMessage(content="""
+            你是一个专业的传记作家助手。请将下面的回忆片段压缩为一段简洁的摘要，
+            如果提供了已有摘要，请把新的片段并入已有摘要。
+            要求：
+            1. 保留所有人物、时间、地点和事件
+            2. 保持原有的时间顺序和情感
+            3. 不要添加原文没有的内容
+            只返回摘要本身。
+        """)
+        fragments = "\n".join(f"- {text}" for text in texts)
+        existing = f"已有摘要：{previous}" if previous else ""
+        human_message = HumanMessage(content=f"""
+            主题：{theme}
+            {existing}
+            回忆片段：
+            {fragments}
+        """)
+        response = await api_manager.execute_with_retry(
+            self.llm.ainvoke,
+            [system_message, human_message],
+            role="summarize",
+            theme=theme
+        )
+        return response.content
+        
+    async def write_transition(self,
+                               previous_theme: str,
+                               previous_ending: str,
+                               next_theme: str,
+                               next_opening: str) -> str:
+        """为相邻两章生成承上启下的过渡句"""
+        from langchain_core.messages import SystemMessage, HumanMessage
+        system_message = SystemMessage(content="""
+            你是一个专业的传记作家。请为传记中相邻的两章写一到两句自然的过渡，
+            承接上一章的结尾，引出下一章的内容。只返回过渡句本身。
+        """)
+        human_message = HumanMessage(content=f"""
+            上一章（{previous_theme}）结尾：{previous_ending}
+            
+            下一章（{next_theme}）开头：{next_opening}
+        """)
+        response = await api_manager.execute_with_retry(
+            self.llm.ainvoke,
+            [system_message, human_message],
+            role="transition",
+            theme=next_theme
+        )
+        return response.content
+        
     def _format_content_for_prompt(self, organized_content: Dict) -> str:
         """格式化内容用于提示"""
         formatted = []
@@ -129,4 +338,11 @@ class ContentGenerator:
             formatted.append(f"\n{entity_type}:")
             for entity in entity_set:
                 formatted.append(f"- {entity}")
-        return "\n".join(formatted) 
\ No newline at end of file
+        return "\n".join(formatted)
+        
+    def _format_relations(self, relations: List) -> str:
+        """格式化实体关系"""
+        return "\n".join([
+            f"- {source} --{label}--> {target}"
+            for source, label, target in relations
+        ]) 
\ No newline at end of file
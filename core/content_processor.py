@@ -1,23 +1,37 @@
 import uuid
 from datetime import datetime
 import asyncio
-from typing import List, Dict, Optional
-from langchain_community.chat_models import ChatZhipuAI
-from langchain_core.messages import SystemMessage, HumanMessage
+from typing import Awaitable, Callable, List, Dict, Optional, TYPE_CHECKING
 from models.schemas import DialogueTurn
 from models.content_manager import ContentSegment
 from core.vector_store import VectorStoreManager
+from core.gazetteer import EntityGazetteer
+from core.knowledge_graph import KnowledgeGraph
 from utils.api_manager import api_manager
+from utils.io_pool import run_io
 from config.config import Config
 
+if TYPE_CHECKING:
+    from langchain_community.chat_models import ChatZhipuAI
+
 class ContentProcessor:
     def __init__(self, 
-                 extract_llm: ChatZhipuAI, 
-                 identify_llm: ChatZhipuAI,
-                 vector_store: VectorStoreManager):
+                 extract_llm: 'ChatZhipuAI', 
+                 identify_llm: 'ChatZhipuAI',
+                 vector_store: VectorStoreManager,
+                 gazetteer: Optional[EntityGazetteer] = None,
+                 knowledge_graph: Optional[KnowledgeGraph] = None,
+                 session_id: Optional[str] = None,
+                 on_refined: Optional[Callable[[ContentSegment, List[str]], Awaitable]] = None):
+        """on_refined在后台补全完成后以(内容片段, 新增的主题)调用"""
         self.extract_llm = extract_llm
         self.identify_llm = identify_llm
         self.vector_store = vector_store
+        self.gazetteer = gazetteer or EntityGazetteer()
+        self.knowledge_graph = knowledge_graph
+        self.session_id = session_id
+        self.on_refined = on_refined
+        self._refine_tasks = set()  # 后台LLM补全任务
         
     async def process_dialogue(self, 
                              dialogue_turn: DialogueTurn,
@@ -42,23 +56,21 @@ class ContentProcessor:
                 timestamp=datetime.now(),
                 dialogue_context=dialogue_context[-3:],
                 entities=entities_and_keywords['entities'],
+                relations=entities_and_keywords.get('relations', []),
                 themes=themes,
                 keywords=entities_and_keywords['keywords']
             )
             
+            await self._add_to_graph(segment)
+            
             # 4. 存储到向量数据库
-            metadata = {
-                "id": segment.id,
-                "dialogue_id": dialogue_turn.id,
-                "question": dialogue_turn.question,
-                "timestamp": segment.timestamp.isoformat(),
-                "themes": segment.themes,
-                "entities": segment.entities,
-                "relations": segment.relations,
-                "keywords": segment.keywords
-            }
+            await self._store_segment(segment, dialogue_turn)
             
-            await self._store_segment(segment, metadata)
+            # 词典未能覆盖的内容和关系，后台调用LLM补全（存储之后再开始，补全结果不会被初次存储覆盖）
+            if entities_and_keywords.get('needs_refinement'):
+                self._schedule_refinement(self._refine_segment(segment, dialogue_turn))
+            elif entities_and_keywords.get('needs_relations'):
+                self._schedule_refinement(self._refine_relations(segment))
             
             return segment
             
@@ -75,7 +87,130 @@ class ContentProcessor:
             )
             
     async def _extract_entities_and_keywords(self, text: str) -> Dict:
-        """使用LLM提取实体和关键词"""
+        """提取实体和关键词：优先使用本地词典，仅在包含未知内容时调用LLM
+
+        词典完全覆盖时不抽取关系；启用REFINE_RELATIONS时，含多个实体（不计"我"等单字代词）的内容
+        由后台只抽取关系。
+        """
+        local_result = self.gazetteer.extract(text)
+        if local_result['coverage'] >= Config.GAZETTEER['MIN_COVERAGE']:
+            entity_count = sum(
+                1 for entities in local_result['entities'].values() if isinstance(entities, list)
+                for entity in entities if isinstance(entity, str) and len(entity) >= 2
+            )
+            if Config.GAZETTEER['REFINE_RELATIONS'] and entity_count >= 2:
+                local_result['needs_relations'] = True
+            return local_result
+            
+        if Config.GAZETTEER['ASYNC_REFINE']:
+            # 先返回词典结果，由process_dialogue安排后台补全
+            local_result['needs_refinement'] = True
+            return local_result
+            
+        result = await self._extract_with_llm(text)
+        await self._learn(result)
+        return result
+        
+    async def _learn(self, result: Dict):
+        """将LLM抽取结果加入本地词典（新词条在I/O线程中追加保存）"""
+        if result['entities']:
+            self.gazetteer.learn(result['entities'])
+            try:
+                await run_io(self.gazetteer.save)
+            except OSError as e:
+                print(f"实体词典保存失败: {e}")
+            
+    async def _add_to_graph(self, segment: ContentSegment):
+        """将片段加入知识图谱，新记录在I/O线程中追加保存"""
+        if not self.knowledge_graph:
+            return
+        self.knowledge_graph.add_segment(segment)
+        try:
+            await run_io(self.knowledge_graph.save)
+        except OSError as e:
+            print(f"图谱保存失败: {e}")
+            
+    def _schedule_refinement(self, refinement):
+        """安排后台LLM补全任务（会话预算接近上限时只保留词典结果）"""
+        if not api_manager.usage.allows_optional():
+            refinement.close()
+            return
+        task = asyncio.create_task(refinement)
+        self._refine_tasks.add(task)
+        task.add_done_callback(self._refine_tasks.discard)
+        
+    async def _refine_segment(self, segment: ContentSegment, dialogue_turn: DialogueTurn):
+        """使用LLM抽取结果补全内容片段中的实体、关系和关键词
+
+        补全后按完整的实体重新识别主题（只增加新主题），并更新向量库和词法索引中的元数据。
+        """
+        result = await self._extract_with_llm(segment.content, role="refine")
+        if not any(result.values()):
+            return
+        await self._learn(result)
+        
+        for entity_type, entities in result['entities'].items():
+            if not isinstance(entities, list):
+                continue
+            merged = segment.entities.setdefault(entity_type, [])
+            merged.extend(e for e in entities if e not in merged)
+        segment.keywords.extend(
+            k for k in result['keywords'] if k not in segment.keywords
+        )
+        segment.relations.extend(
+            r for r in result['relations'] if r not in segment.relations
+        )
+        
+        themes = await self._identify_themes(segment.content, {
+            "entities": segment.entities,
+            "keywords": segment.keywords
+        }, role="refine")
+        new_themes = [t for t in themes if t not in segment.themes and t != "其他"]
+        segment.themes.extend(new_themes)
+        
+        await self._add_to_graph(segment)
+        
+        # 内容未变，复用写入时计算的向量
+        embedding = await self.vector_store.embedding_for(segment.content, segment.id)
+        await self._store_segment(segment, dialogue_turn, embedding)
+        if self.on_refined:
+            await self.on_refined(segment, new_themes)
+            
+    async def _refine_relations(self, segment: ContentSegment):
+        """词典已覆盖全部实体时，只用LLM补全实体间的关系（不重新识别主题）"""
+        from langchain_core.messages import SystemMessage, HumanMessage
+        system_message = SystemMessage(content="""
+            你是一个关系抽取助手。只抽取给定实体之间的关系，不要抽取新的实体。
+            返回格式：[{"from": "实体1", "relation": "关系", "to": "实体2"}]，没有关系时返回[]
+        """)
+        human_message = HumanMessage(content=f"""
+            文本内容：{segment.content}
+            实体：{segment.entities}
+        """)
+        try:
+            response = await api_manager.execute_with_retry(
+                self.extract_llm.ainvoke,
+                [system_message, human_message],
+                role="refine"
+            )
+            from utils.json_parser import ResponseParser
+            relations = self._parse_relations(ResponseParser.parse_llm_response(
+                response.content, schema=[dict], prompt="relations", default=[]
+            ))
+        except Exception as e:
+            print(f"关系抽取失败: {e}")
+            return
+        new_relations = [r for r in relations if r not in segment.relations]
+        if not new_relations:
+            return
+        segment.relations.extend(new_relations)
+        await self._add_to_graph(segment)
+        if self.on_refined:
+            await self.on_refined(segment, [])
+            
+    async def _extract_with_llm(self, text: str, role: str = "extract") -> Dict:
+        """使用LLM提取实体和关键词（后台补全时role为refine，预算紧张时可跳过）"""
+        from langchain_core.messages import SystemMessage, HumanMessage
         system_message = SystemMessage(content="""
             你是一个专业的信息提取助手。请仔细分析文本并提取以下信息：
             
@@ -114,30 +249,49 @@ class ContentProcessor:
         try:
             response = await api_manager.execute_with_retry(
                 self.extract_llm.ainvoke,  # 使用专门的extract_llm
-                [system_message, human_message]
+                [system_message, human_message],
+                role=role
             )
             return self._parse_response(response.content)
         except Exception as e:
             print(f"API调用失败: {e}")
-            return {"entities": {}, "keywords": []}
+            return {"entities": {}, "relations": [], "keywords": []}
             
     def _parse_response(self, response_text: str) -> Dict:
         """解析LLM响应"""
         try:
             from utils.json_parser import ResponseParser
-            result = ResponseParser.parse_llm_response(response_text)
-            if not isinstance(result, dict):
-                return {"entities": {}, "keywords": []}
+            result = ResponseParser.parse_llm_response(
+                response_text,
+                schema={"entities": dict},
+                prompt="extract"
+            )
             return {
                 "entities": result.get("entities", {}),
+                "relations": self._parse_relations(result.get("relations", [])),
                 "keywords": result.get("keywords", [])
             }
         except Exception as e:
             print(f"响应解析失败: {e}")
-            return {"entities": {}, "keywords": []}
+            return {"entities": {}, "relations": [], "keywords": []}
+            
+    def _parse_relations(self, relations) -> List[Dict[str, str]]:
+        """保留格式完整的关系：{"from", "relation", "to"}"""
+        if not isinstance(relations, list):
+            return []
+        return [
+            {
+                "from": str(r["from"]),
+                "relation": str(r.get("relation", "")),
+                "to": str(r["to"])
+            }
+            for r in relations
+            if isinstance(r, dict) and r.get("from") and r.get("to")
+        ]
         
-    async def _identify_themes(self, text: str, entities_and_keywords: Dict) -> List[str]:
-        """识别文本可能属于的主题"""
+    async def _identify_themes(self, text: str, entities_and_keywords: Dict, role: str = "identify") -> List[str]:
+        """识别文本可能属于的主题（后台补全时role为refine）"""
+        from langchain_core.messages import SystemMessage, HumanMessage
         system_message = SystemMessage(content=f"""
             你是一个专业的主题分析助手。请仔细分析用户回答涉及的主题。
             
@@ -187,7 +341,8 @@ class ContentProcessor:
         try:
             response = await api_manager.execute_with_retry(
                 self.identify_llm.ainvoke,
-                [system_message, human_message]
+                [system_message, human_message],
+                role=role
             )
             themes = self._parse_themes(response.content)
             # 确保返回的主题在预定义列表中
@@ -197,21 +352,41 @@ class ContentProcessor:
             print(f"主题识别失败: {e}")
             return ["其他"]
         
-    async def _store_segment(self, segment: ContentSegment, metadata: Dict):
-        """将内容片段存储到向量数据库"""
+    async def _store_segment(self, segment: ContentSegment, dialogue_turn: DialogueTurn,
+                             embedding: Optional[List[float]] = None):
+        """将内容片段存储到向量数据库（已存储的片段按ID覆盖）"""
+        metadata = {
+            "id": segment.id,
+            "dialogue_id": dialogue_turn.id,
+            "session_id": self.session_id,
+            "question": dialogue_turn.question,
+            "timestamp": segment.timestamp.isoformat(),
+            "themes": segment.themes,
+            "entities": segment.entities,
+            "relations": segment.relations,
+            "keywords": segment.keywords
+        }
         await self.vector_store.add_memory(
             text=segment.content,
-            metadata=metadata
+            metadata=metadata,
+            embedding=embedding
         )
         
     def _parse_themes(self, response_text: str) -> List[str]:
         """解析主题识别响应"""
         try:
             from utils.json_parser import ResponseParser
-            result = ResponseParser.parse_llm_response(response_text)
-            if isinstance(result, list):
-                return result
-            return list(result.values()) if isinstance(result, dict) else ["其他"]
+            themes = ResponseParser.parse_llm_response(
+                response_text,
+                schema=[str],
+                prompt="identify_themes",
+                default=[]
+            )
+            if not themes:
+                # 无法解析时，按出现顺序取响应中提到的预定义主题
+                mentioned = [topic for topic in Config.TOPICS if topic in response_text]
+                themes = sorted(mentioned, key=response_text.find)
+            return themes or ["其他"]
         except Exception as e:
             print(f"主题解析失败: {e}")
             return ["其他"]
\ No newline at end of file
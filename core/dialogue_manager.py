@@ -1,21 +1,28 @@
-from typing import Dict, List, Optional
-from langchain_community.chat_models import ChatZhipuAI
-from langchain.prompts import PromptTemplate
-from langchain_core.messages import SystemMessage, HumanMessage
-from models.schemas import DialogueTurn, AttentionMemory, DialogueContext, TopicCompletion
+from typing import Dict, List, Optional, TYPE_CHECKING
+from models.schemas import DialogueTurn, DialogueContext, TopicCompletion
 from config.config import Config
 import random
 from utils.api_manager import api_manager
+from core.question_speculator import QuestionSpeculator
+from core.dialogue_memory import DialogueMemory
+from core.keyword_matcher import KeywordMatcher
+
+if TYPE_CHECKING:
+    from langchain_community.chat_models import ChatZhipuAI
+
+# 关键词匹配中切换请求和否定回答的分类名（话题关键词以话题名为分类）
+SWITCH_REQUEST = "切换请求"
+NEGATION = "否定"
 
 class DialogueManager:
-    def __init__(self, llm: ChatZhipuAI):
+    def __init__(self, llm: 'ChatZhipuAI'):
         self.llm = llm
-        self.attention_memory = AttentionMemory(
-            short_term=[],
-            long_term={},
-            topic_weights={},
-            emotion_history={}
-        )
+        self.attention_memory = DialogueMemory()
+        self.keyword_matcher = KeywordMatcher({
+            SWITCH_REQUEST: Config.KEYWORDS["TOPIC_SWITCH"],
+            NEGATION: Config.KEYWORDS["NEGATION"],
+            **Config.KEYWORDS["TOPICS"]
+        })
         self.current_context = DialogueContext(
             current_topic="家庭",
             depth_level=0,
@@ -24,6 +31,7 @@ class DialogueManager:
             interest_level=0.5,
             pending_questions=[]
         )
+        self.speculator = QuestionSpeculator(self)
         
     async def generate_next_question(self, 
                                    metrics: Dict[str, float],
@@ -33,9 +41,15 @@ class DialogueManager:
         # 基于综合指标决定策略
         strategy = self._determine_question_strategy(metrics, context)
         
+        # 命中预生成的候选问题时直接返回
+        speculative_question = self.speculator.lookup(strategy, context)
+        if speculative_question:
+            return speculative_question
+        
         # 生成问题
         prompt = self._create_question_prompt(strategy, context)
         
+        from langchain_core.messages import SystemMessage, HumanMessage
         system_message = SystemMessage(content="""
             你是一个专业的传记作家助手，负责通过对话的方式收集用户的生平故事。
             你的回复应该包含两个部分：
@@ -55,7 +69,9 @@ class DialogueManager:
         try:
             response = await api_manager.execute_with_retry(
                 self.llm.ainvoke,
-                [system_message, human_message]
+                [system_message, human_message],
+                role="question",
+                theme=context.current_topic
             )
             return response.content
         except Exception as e:
@@ -80,12 +96,13 @@ class DialogueManager:
             'new_topic': None
         }
         
+        # 一次扫描得到回答中的切换请求、否定词和各话题关键词
+        hits = self.keyword_matcher.match(context.last_response)
+        
         # 话题切换条件判断
         should_switch_topic = (
             # 1. 明确的切换请求
-            any(keyword in context.last_response.lower() for keyword in [
-                "换个话题", "换一个话题", "聊点别的"
-            ]) or
+            SWITCH_REQUEST in hits or
             # 2. 情感指标
             abs(emotion_score) > Config.EMOTION_THRESHOLD or
             # 3. 兴趣度过低
@@ -93,14 +110,13 @@ class DialogueManager:
             # 4. 话题完整度高且兴趣度一般
             (completion_score > 0.8 and interest_score < 0.6) or
             # 5. 简短否定回答模式
-            (len(context.last_response) < 10 and 
-             any(word in context.last_response.lower() for word in ["没有", "不知道", "不记得"]))
+            (len(context.last_response) < 10 and NEGATION in hits)
         )
         
         if should_switch_topic:
             strategy['action'] = 'switch'
             strategy['new_topic'] = self._select_new_topic(
-                context, metrics, current_topic=context.current_topic
+                context, metrics, current_topic=context.current_topic, hits=hits
             )
             return strategy
             
@@ -129,6 +145,8 @@ class DialogueManager:
         最近提到的实体: {entities}
         对话���略: {strategy}
         用户最后的回答: {last_response}
+        相关的早期记忆:
+        {memories}
         
         要求：
         1. 先对用户的回答做出温暖的回应
@@ -137,6 +155,7 @@ class DialogueManager:
         4. 符合当前深度级别
         5. 注意情感适当性
         6. 如果用户要求换话题，必须切换到新话题
+        7. 可以自然地关联相关的早期记忆，但不要重复提问已经讲过的内容
         """
         
         if strategy['action'] == 'switch':
@@ -147,9 +166,10 @@ class DialogueManager:
             """
         
         # 填充模板
+        from langchain.prompts import PromptTemplate
         prompt = PromptTemplate(
             template=base_prompt,
-            input_variables=["current_topic", "depth_level", "entities", "strategy", "last_response"]
+            input_variables=["current_topic", "depth_level", "entities", "strategy", "last_response", "memories"]
         )
         
         return prompt.format(
@@ -157,7 +177,10 @@ class DialogueManager:
             depth_level=context.depth_level,
             entities=", ".join(context.recent_entities),
             strategy=strategy['action'],
-            last_response=context.last_response
+            last_response=context.last_response,
+            memories="\n".join(
+                f"- {memory['content']}" for memory in context.related_memories
+            ) or "无"
         )
     
     def _get_missing_aspects(self, topic: str) -> List[str]:
@@ -168,46 +191,37 @@ class DialogueManager:
     def _select_new_topic(self, 
                          context: DialogueContext, 
                          metrics: Dict[str, float],
-                         current_topic: str) -> str:
-        """智能选择新话题"""
-        
-        # 1. 从用户回答中提取可能的话题偏好
-        response = context.last_response.lower()
-        explicit_topic = None
-        
-        topic_keywords = {
-            "兴趣": ["兴趣", "爱好", "喜欢", "热爱"],
-            "职业生涯": ["工作", "职业", "事业", "公司"],
-            "早年生活": ["童年", "小时候", "学生时代"],
-            # ... 其他话题关键词映射
-        }
-        
-        # 检查是否有明确提到的话题
-        for topic, keywords in topic_keywords.items():
-            if any(keyword in response for keyword in keywords):
-                explicit_topic = topic
-                break
-        
-        if explicit_topic:
-            return explicit_topic
+                         current_topic: str,
+                         hits: Optional[Dict[str, List[str]]] = None) -> str:
+        """智能选择新话题（hits为已扫描的关键词命中，未提供时重新扫描回答）"""
+        
+        # 1. 从用户回答中提取可能的话题偏好：选择关键词命中最多的话题
+        if hits is None:
+            hits = self.keyword_matcher.match(context.last_response)
+        mentioned = [
+            topic for topic in Config.TOPICS
+            if topic != current_topic and hits.get(topic)
+        ]
+        if mentioned:
+            return max(mentioned, key=lambda topic: len(hits[topic]))
             
-        # 2. 如果没有明确话题，基于历史兴趣度选择
+        # 2. 如果没有明确话题，基于历史兴趣度选择：未聊过的话题按较高的先验兴趣度计，
+        #    使对话先覆盖新话题，只有兴趣度明显更高的旧话题才会被再次选中
         available_topics = [
             topic for topic in Config.TOPICS 
             if topic != current_topic
         ]
-        
-        # 获取历史兴趣度数据
         topic_interests = self.attention_memory.topic_weights
-        
-        # 如果有历史数据，选择历史兴趣度最高的话题
-        if topic_interests:
-            sorted_topics = sorted(
-                available_topics,
-                key=lambda t: topic_interests.get(t, 0.5),
-                reverse=True
-            )
-            return sorted_topics[0]
+        prior = Config.ATTENTION_MEMORY["UNVISITED_PRIOR"]
+        scores = {topic: topic_interests.get(topic, prior) for topic in available_topics}
+        best = max(scores.values())
+        candidates = [topic for topic in available_topics if scores[topic] == best]
             
-        # 3. 如果没有历史数据，随机选择
-        return random.choice(available_topics)
\ No newline at end of file
+        # 3. 兴趣度相同的话题中，优先选择已有预生成问题的话题，否则随机选择
+        preferred = [
+            topic for topic in self.speculator.preferred_topics(context)
+            if topic in candidates
+        ]
+        if preferred:
+            return preferred[0]
+        return random.choice(candidates)
\ No newline at end of file
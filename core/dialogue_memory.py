@@ -0,0 +1,162 @@
+import json
+import os
+from collections import deque
+from typing import Dict, List, Optional
+from urllib.parse import quote
+from models.schemas import DialogueTurn, AttentionMemory
+from config.config import Config
+from utils.io_pool import run_io
+
+class DialogueMemory:
+    """分层对话记忆，填充DialogueManager的AttentionMemory
+
+    短期记忆是固定长度的环形缓冲；从中移出的轮次按话题进入长期记忆，
+    每个话题在内存中只保留最近LONG_TERM_SIZE轮，全部轮次追加写入磁盘（每个话题一个JSONL文件）。
+    topic_weights是各话题兴趣度的滑动平均，emotion_history只保留每个话题最近的情绪分数，
+    另以emotion_stats记录轮次数和平均值。内存占用与会话长度无关。
+    """
+
+    def __init__(self, config: Optional[Dict] = None):
+        self.config = config or Config.ATTENTION_MEMORY
+        self.reset()
+
+    def reset(self, session_id: str = None, spill_dir: str = None):
+        """清空记忆，长期记忆写入该会话的目录"""
+        self.memory = AttentionMemory.model_construct(
+            short_term=deque(maxlen=self.config["SHORT_TERM_SIZE"]),
+            long_term={},
+            topic_weights={},
+            emotion_history={}
+        )
+        # {话题: {"count": int, "mean": float}}
+        self.emotion_stats: Dict[str, Dict] = {}
+        # 已移入长期记忆、尚未写入磁盘的轮次
+        self._pending: Dict[str, List[DialogueTurn]] = {}
+        self.spill_dir = spill_dir or os.path.join(self.config["SPILL_DIR"], session_id or "default")
+
+    @property
+    def short_term(self) -> deque:
+        return self.memory.short_term
+
+    @property
+    def long_term(self) -> Dict[str, List[DialogueTurn]]:
+        return self.memory.long_term
+
+    @property
+    def topic_weights(self) -> Dict[str, float]:
+        return self.memory.topic_weights
+
+    @property
+    def emotion_history(self) -> Dict[str, List[float]]:
+        return self.memory.emotion_history
+
+    def recent(self, count: int = None) -> List[DialogueTurn]:
+        """最近的若干轮对话（最多为短期记忆的长度）"""
+        turns = list(self.short_term)
+        return turns[-count:] if count else turns
+
+    async def add(self, turn: DialogueTurn):
+        """记录一轮对话并更新滚动统计，待写入的轮次较多时立即写入磁盘"""
+        if len(self.short_term) == self.short_term.maxlen:
+            self._to_long_term(self.short_term[0])
+        self.short_term.append(turn)
+        self._update_statistics(turn)
+        if sum(map(len, self._pending.values())) >= self.config["SPILL_BATCH"]:
+            await self.flush()
+
+    def _to_long_term(self, turn: DialogueTurn):
+        turns = self.long_term.setdefault(turn.topic, [])
+        turns.append(turn)
+        del turns[:-self.config["LONG_TERM_SIZE"]]
+        self._pending.setdefault(turn.topic, []).append(turn)
+
+    def _update_statistics(self, turn: DialogueTurn):
+        alpha = self.config["INTEREST_ALPHA"]
+        previous = self.topic_weights.get(turn.topic)
+        self.topic_weights[turn.topic] = (
+            turn.interest_score if previous is None
+            else (1 - alpha) * previous + alpha * turn.interest_score
+        )
+
+        history = self.emotion_history.setdefault(turn.topic, [])
+        history.append(turn.emotion_score)
+        del history[:-self.config["EMOTION_WINDOW"]]
+
+        stats = self.emotion_stats.setdefault(turn.topic, {"count": 0, "mean": 0.0})
+        stats["count"] += 1
+        stats["mean"] += (turn.emotion_score - stats["mean"]) / stats["count"]
+
+    async def flush(self):
+        """把移入长期记忆的轮次追加写入磁盘"""
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        try:
+            await run_io(self.write_pending, pending)
+        except OSError as e:
+            print(f"写入长期记忆失败: {e}")
+            for topic, turns in pending.items():
+                self._pending[topic] = turns + self._pending.get(topic, [])
+
+    def write_pending(self, pending: Dict[str, List[DialogueTurn]]):
+        os.makedirs(self.spill_dir, exist_ok=True)
+        for topic, turns in pending.items():
+            with open(self._topic_path(topic), 'a', encoding='utf-8') as f:
+                for turn in turns:
+                    f.write(json.dumps(turn.model_dump(), ensure_ascii=False) + "\n")
+
+    def _topic_path(self, topic: str) -> str:
+        return os.path.join(self.spill_dir, f"{quote(topic, safe='')}.jsonl")
+
+    async def recall(self, topic: str, limit: int = None) -> List[DialogueTurn]:
+        """读取某个话题的长期记忆（按时间顺序，limit为最近的轮数），超出内存部分从磁盘读取"""
+        in_memory = self.long_term.get(topic, [])
+        if limit is not None and len(in_memory) >= limit:
+            return in_memory[-limit:]
+        await self.flush()
+        return await run_io(self.read_topic, topic, limit)
+
+    def read_topic(self, topic: str, limit: int = None) -> List[DialogueTurn]:
+        return self.read_topic_file(self._topic_path(topic), limit)
+
+    def state(self) -> Dict:
+        """滚动统计（随会话状态保存；短期记忆以最近轮次保存，长期记忆已在磁盘上）"""
+        return {
+            "topic_weights": dict(self.topic_weights),
+            "emotion_history": {topic: list(scores) for topic, scores in self.emotion_history.items()},
+            "emotion_stats": {topic: dict(stats) for topic, stats in self.emotion_stats.items()}
+        }
+
+    async def restore(self, session_id: str, recent_turns: List[DialogueTurn], state: Optional[Dict] = None):
+        """恢复会话：短期记忆取最近轮次，长期记忆从磁盘读取各话题最近的轮次"""
+        self.reset(session_id)
+        self.short_term.extend(recent_turns)
+        state = state or {}
+        self.topic_weights.update(state.get("topic_weights", {}))
+        self.emotion_history.update(state.get("emotion_history", {}))
+        self.emotion_stats.update(state.get("emotion_stats", {}))
+        self.long_term.update(await run_io(self.read_long_term))
+
+    def read_long_term(self) -> Dict[str, List[DialogueTurn]]:
+        if not os.path.isdir(self.spill_dir):
+            return {}
+        long_term = {}
+        for filename in os.listdir(self.spill_dir):
+            if not filename.endswith(".jsonl"):
+                continue
+            turns = self.read_topic_file(os.path.join(self.spill_dir, filename), self.config["LONG_TERM_SIZE"])
+            if turns:
+                long_term[turns[-1].topic] = turns
+        return long_term
+
+    def read_topic_file(self, path: str, limit: int = None) -> List[DialogueTurn]:
+        if not os.path.exists(path):
+            return []
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                # 只保留文件末尾的limit行，不把整个文件读入内存
+                lines = deque(f, maxlen=limit)
+            return [DialogueTurn(**json.loads(line)) for line in lines if line.strip()]
+        except (json.JSONDecodeError, OSError) as e:
+            print(f"长期记忆加载失败: {e}")
+            return []
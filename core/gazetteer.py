@@ -0,0 +1,172 @@
+import json
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+from config.config import Config
+
+class _TrieNode:
+    __slots__ = ("children", "entry")
+
+    def __init__(self):
+        self.children: Dict[str, "_TrieNode"] = {}
+        self.entry: Optional[Dict] = None   # {"types": {实体类型: 次数}, "seed": bool}
+
+class EntityGazetteer:
+    """基于词典前缀树的本地实体抽取器，可从LLM抽取结果中持续学习
+
+    学习到的词条以增量方式追加保存：每次保存写入一行{表层形式: {实体类型: 次数}}，
+    加载时累加各行的次数（旧版整体保存的词典作为第一条记录读取）。
+    """
+
+    def __init__(self,
+                 seed_entities: Dict[str, List[str]] = None,
+                 storage_path: str = None):
+        self.config = Config.GAZETTEER
+        self.storage_path = storage_path or self.config["STORAGE_PATH"]
+        self.stop_chars = set(self.config["STOP_CHARS"])
+        self.root = _TrieNode()
+        self.size = 0
+        # 学习后尚未保存的次数增量 {表层形式: {实体类型: 次数}}
+        self._pending: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+        seeds = seed_entities if seed_entities is not None else self.config["SEED_ENTITIES"]
+        for entity_type, surfaces in seeds.items():
+            for surface in surfaces:
+                self._insert(surface, entity_type, seed=True)
+
+        self.load()
+
+    def _insert(self, surface: str, entity_type: str, count: int = 1, seed: bool = False):
+        """插入或累加一个实体表层形式"""
+        node = self.root
+        for char in surface:
+            node = node.children.setdefault(char, _TrieNode())
+        if node.entry is None:
+            node.entry = {"types": {}, "seed": False}
+            self.size += 1
+        node.entry["types"][entity_type] = node.entry["types"].get(entity_type, 0) + count
+        node.entry["seed"] = node.entry["seed"] or seed
+
+    def _longest_match(self, text: str, start: int) -> Tuple[int, Optional[Dict]]:
+        """从start位置开始查找最长匹配，返回(结束位置, 词条)"""
+        node = self.root
+        end, entry = start, None
+        for i in range(start, len(text)):
+            node = node.children.get(text[i])
+            if node is None:
+                break
+            if node.entry is not None:
+                end, entry = i + 1, node.entry
+        return end, entry
+
+    def _confidence(self, entry: Dict) -> Tuple[str, float]:
+        """计算词条的主类型及置信度"""
+        types = entry["types"]
+        entity_type = max(types, key=types.get)
+        total = sum(types.values())
+        type_share = types[entity_type] / total
+        if entry["seed"]:
+            base = self.config["SEED_CONFIDENCE"]
+        else:
+            # 学习得到的词条，被LLM确认的次数越多越可信
+            base = 1 - 1 / (total + 1)
+        return entity_type, round(base * type_share, 3)
+
+    def _is_content_char(self, char: str) -> bool:
+        return char.isalnum() and char not in self.stop_chars
+
+    def extract(self, text: str) -> Dict:
+        """正向最大匹配抽取实体，返回实体、关键词、置信度和覆盖率"""
+        entities: Dict[str, List[str]] = {}
+        keywords: List[str] = []
+        confidence: Dict[str, float] = {}
+        covered = 0
+
+        i = 0
+        while i < len(text):
+            end, entry = self._longest_match(text, i)
+            if entry is None:
+                i += 1
+                continue
+
+            surface = text[i:end]
+            entity_type, score = self._confidence(entry)
+            if surface not in confidence:
+                entities.setdefault(entity_type, []).append(surface)
+                if entity_type not in self.config["NON_KEYWORD_TYPES"]:
+                    keywords.append(surface)
+            confidence[surface] = max(score, confidence.get(surface, 0.0))
+            covered += sum(1 for char in surface if self._is_content_char(char))
+            i = end
+
+        content_chars = sum(1 for char in text if self._is_content_char(char))
+        coverage = covered / content_chars if content_chars else 1.0
+
+        return {
+            "entities": entities,
+            "keywords": keywords,
+            "confidence": confidence,
+            "coverage": round(coverage, 3)
+        }
+
+    def is_known(self, text: str) -> bool:
+        """文本内容是否基本被词典覆盖（无需LLM抽取）"""
+        return self.extract(text)["coverage"] >= self.config["MIN_COVERAGE"]
+
+    def learn(self, entities: Dict[str, List[str]]):
+        """从LLM抽取结果中学习新的实体表层形式"""
+        max_length = self.config["MAX_ENTITY_LENGTH"]
+        for entity_type, surfaces in entities.items():
+            if not isinstance(surfaces, list):
+                continue
+            for surface in surfaces:
+                if not isinstance(surface, str):
+                    continue
+                surface = surface.strip()
+                if 0 < len(surface) <= max_length:
+                    self._insert(surface, entity_type)
+                    with self._lock:
+                        types = self._pending.setdefault(surface, {})
+                        types[entity_type] = types.get(entity_type, 0) + 1
+
+    def save(self):
+        """追加保存上次保存以来学习到的词条（可在I/O线程中调用）"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        directory = os.path.dirname(self.storage_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.storage_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(pending, ensure_ascii=False) + "\n")
+
+    def load(self):
+        """加载已学习的词条"""
+        if not os.path.exists(self.storage_path):
+            return
+        try:
+            with open(self.storage_path, 'r', encoding='utf-8') as f:
+                text = f.read()
+            # 依次解析文件中的各个JSON对象（旧版的整体词典可能跨多行）
+            decoder = json.JSONDecoder()
+            batches, position = [], 0
+            while True:
+                while position < len(text) and text[position].isspace():
+                    position += 1
+                if position >= len(text):
+                    break
+                try:
+                    learned, position = decoder.raw_decode(text, position)
+                except json.JSONDecodeError as e:
+                    # 最后一行可能因异常退出而不完整
+                    print(f"实体词典记录解析失败: {e}")
+                    break
+                batches.append(learned)
+            for learned in batches:
+                for surface, types in learned.items():
+                    for entity_type, count in types.items():
+                        self._insert(surface, entity_type, count=count)
+        except (OSError, AttributeError) as e:
+            print(f"实体词典加载失败: {e}")
@@ -0,0 +1,47 @@
+from datetime import datetime
+from typing import Dict, Optional
+from utils.json_store import JsonFileStore
+from config.config import Config
+
+class GenerationCache:
+    """按输入指纹缓存的主题生成结果
+
+    指纹由生成器根据内容片段ID、提示词模板版本和模型计算；同一指纹的请求直接返回已生成的叙述。
+    每个主题只保留最近MAX_PER_THEME个结果。
+    """
+
+    def __init__(self, storage_path: str = None, max_per_theme: int = None):
+        self.config = Config.GENERATION_CACHE
+        self.storage_path = storage_path or self.config["STORAGE_PATH"]
+        self.max_per_theme = max_per_theme or self.config["MAX_PER_THEME"]
+        # {指纹: {"theme": str, "content": str, "created_at": str}}，按写入顺序排列
+        self.entries: Dict[str, Dict] = {}
+        # store.lock保护entries（可能与I/O线程中的save同时访问）
+        self._store = JsonFileStore(self.storage_path, "生成结果缓存")
+        self.load()
+
+    def get(self, fingerprint: str) -> Optional[str]:
+        entry = self.entries.get(fingerprint)
+        return entry["content"] if entry else None
+
+    def put(self, fingerprint: str, theme: str, content: str):
+        """记录生成结果，超出主题的保留数时淘汰最早的结果（可能与I/O线程中的save同时进行，需持锁）"""
+        with self._store.lock:
+            self.entries.pop(fingerprint, None)
+            self.entries[fingerprint] = {
+                "theme": theme,
+                "content": content,
+                "created_at": datetime.now().isoformat()
+            }
+            same_theme = [key for key, entry in self.entries.items() if entry["theme"] == theme]
+            for key in same_theme[:-self.max_per_theme]:
+                del self.entries[key]
+            self._store.dirty = True
+
+    def save(self):
+        """有修改时写入磁盘（可在I/O线程中调用）"""
+        self._store.save(lambda: dict(self.entries))
+
+    def load(self):
+        """加载已保存的生成结果"""
+        self.entries = self._store.load() or {}
@@ -0,0 +1,66 @@
+from collections import deque
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+class _Node:
+    __slots__ = ("children", "fail", "outputs")
+
+    def __init__(self):
+        self.children: Dict[str, "_Node"] = {}
+        self.fail: Optional["_Node"] = None
+        self.outputs: List[Tuple[str, str]] = []   # [(分类, 关键词)]，包含失败链上的输出
+
+class KeywordMatcher:
+    """Aho-Corasick多模式匹配器
+
+    由{分类: 关键词列表}构建一次自动机，之后对任意文本只需扫描一遍，
+    即可得到所有分类命中的关键词（与关键词数量无关）。同一关键词可以属于多个分类。
+    """
+
+    def __init__(self, tables: Dict[str, Iterable[str]]):
+        self.root = _Node()
+        self.categories = list(tables)
+        for category, keywords in tables.items():
+            for keyword in keywords:
+                if keyword:
+                    self._insert(keyword.lower(), category)
+        self._build_failure_links()
+
+    def _insert(self, keyword: str, category: str):
+        node = self.root
+        for char in keyword:
+            node = node.children.setdefault(char, _Node())
+        if (category, keyword) not in node.outputs:
+            node.outputs.append((category, keyword))
+
+    def _build_failure_links(self):
+        """按层次遍历设置失败指针，并把失败链上的输出并入各节点"""
+        queue = deque()
+        for child in self.root.children.values():
+            child.fail = self.root
+            queue.append(child)
+        while queue:
+            node = queue.popleft()
+            for char, child in node.children.items():
+                fail = node.fail
+                while fail is not None and char not in fail.children:
+                    fail = fail.fail
+                child.fail = fail.children[char] if fail is not None else self.root
+                child.outputs = child.outputs + child.fail.outputs
+                queue.append(child)
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, str, str]]:
+        """逐个返回命中(起始位置, 分类, 关键词)，按关键词结束位置排序"""
+        node = self.root
+        for i, char in enumerate(text.lower()):
+            while node is not self.root and char not in node.children:
+                node = node.fail
+            node = node.children.get(char, self.root)
+            for category, keyword in node.outputs:
+                yield i - len(keyword) + 1, category, keyword
+
+    def match(self, text: str) -> Dict[str, List[str]]:
+        """一次扫描返回{分类: 命中的关键词（按出现顺序，重复出现会重复列出）}，未命中的分类不出现"""
+        hits: Dict[str, List[str]] = {}
+        for _, category, keyword in self.iter_matches(text):
+            hits.setdefault(category, []).append(keyword)
+        return hits
@@ -0,0 +1,194 @@
+import json
+import os
+import threading
+from collections import defaultdict, deque
+from typing import Dict, List, Set, Tuple
+from models.content_manager import ContentSegment
+from config.config import Config
+
+class KnowledgeGraph:
+    """实体关系图谱：邻接表索引、实体到内容片段的倒排表，增量持久化"""
+
+    def __init__(self, storage_path: str = None):
+        self.config = Config.KNOWLEDGE_GRAPH
+        self.storage_path = storage_path or self.config["STORAGE_PATH"]
+        self.event_type = self.config["EVENT_TYPE"]
+
+        self.entity_types: Dict[str, str] = {}
+        # 邻接表：实体 -> 相邻实体 -> 关系集合
+        self.out_edges: Dict[str, Dict[str, Set[str]]] = defaultdict(lambda: defaultdict(set))
+        self.in_edges: Dict[str, Dict[str, Set[str]]] = defaultdict(lambda: defaultdict(set))
+        # 实体 -> 内容片段ID
+        self.postings: Dict[str, Set[str]] = defaultdict(set)
+        # 实体 -> 同一片段中出现的事件
+        self.co_events: Dict[str, Set[str]] = defaultdict(set)
+        # 内容片段ID -> 片段中的实体和关系
+        self.segments: Dict[str, Dict] = {}
+        # 已加入图谱、尚未写入磁盘的记录
+        self._pending: List[Dict] = []
+        self._lock = threading.Lock()
+
+        self.load()
+
+    def add_segment(self, segment: ContentSegment):
+        """将内容片段的实体和关系加入图谱（可重复调用，结果合并），记录由save写入磁盘"""
+        record = {
+            "id": segment.id,
+            "themes": segment.themes,
+            "entities": segment.entities,
+            "relations": segment.relations or []
+        }
+        if self._apply(record):
+            with self._lock:
+                self._pending.append(record)
+
+    def _apply(self, record: Dict) -> bool:
+        """应用一条片段记录，返回图谱是否发生变化"""
+        segment_id = record["id"]
+        info = self.segments.setdefault(segment_id, {
+            "themes": [],
+            "entities": {},
+            "relations": []
+        })
+        changed = False
+
+        for theme in record.get("themes", []):
+            if theme not in info["themes"]:
+                info["themes"].append(theme)
+                changed = True
+
+        events = set()
+        for entity_type, names in record.get("entities", {}).items():
+            if not isinstance(names, list):
+                continue
+            known = info["entities"].setdefault(entity_type, [])
+            for name in names:
+                if not isinstance(name, str):
+                    continue
+                if name not in known:
+                    known.append(name)
+                    changed = True
+                self.entity_types.setdefault(name, entity_type)
+                self.postings[name].add(segment_id)
+                if entity_type == self.event_type:
+                    events.add(name)
+
+        all_events = set(info["entities"].get(self.event_type, [])) | events
+        for names in info["entities"].values():
+            for name in names:
+                self.co_events[name].update(e for e in all_events if e != name)
+
+        for relation in record.get("relations", []):
+            edge = self._edge(relation)
+            if edge is None:
+                continue
+            source, label, target = edge
+            self.out_edges[source][target].add(label)
+            self.in_edges[target][source].add(label)
+            self.postings[source].add(segment_id)
+            self.postings[target].add(segment_id)
+            self.entity_types.setdefault(source, "")
+            self.entity_types.setdefault(target, "")
+            if list(edge) not in info["relations"]:
+                info["relations"].append(list(edge))
+                changed = True
+
+        return changed
+
+    @staticmethod
+    def _edge(relation: Dict) -> Tuple[str, str, str]:
+        """校验并规范化关系，返回(起点, 关系, 终点)"""
+        if not isinstance(relation, dict):
+            return None
+        source = relation.get("from")
+        target = relation.get("to")
+        label = relation.get("relation", "")
+        if not isinstance(source, str) or not isinstance(target, str) or not source or not target:
+            return None
+        return source, str(label), target
+
+    def _adjacent(self, entity: str) -> Set[str]:
+        """实体的直接相邻实体（不区分方向）"""
+        adjacent = set(self.out_edges.get(entity, {}))
+        adjacent.update(self.in_edges.get(entity, {}))
+        return adjacent
+
+    def neighbors(self, entity: str, hops: int = 2) -> Dict[str, int]:
+        """返回hops跳以内的相邻实体及其距离"""
+        distances = {entity: 0}
+        queue = deque([entity])
+        while queue:
+            current = queue.popleft()
+            if distances[current] >= hops:
+                continue
+            for neighbor in self._adjacent(current):
+                if neighbor not in distances:
+                    distances[neighbor] = distances[current] + 1
+                    queue.append(neighbor)
+        del distances[entity]
+        return distances
+
+    def events_involving(self, entity: str) -> List[str]:
+        """与实体存在关系或在同一片段中出现的所有事件"""
+        events = set(self.co_events.get(entity, set()))
+        events.update(
+            neighbor for neighbor in self._adjacent(entity)
+            if self.entity_types.get(neighbor) == self.event_type
+        )
+        return sorted(events)
+
+    def segments_for(self, entity: str) -> Set[str]:
+        """提到该实体的内容片段ID"""
+        return set(self.postings.get(entity, set()))
+
+    def entities_for_segments(self, segment_ids: List[str]) -> Dict[str, Set[str]]:
+        """汇总一组内容片段中的实体，按类型组织"""
+        entities: Dict[str, Set[str]] = {}
+        for segment_id in segment_ids:
+            info = self.segments.get(segment_id)
+            if not info:
+                continue
+            for entity_type, names in info["entities"].items():
+                entities.setdefault(entity_type, set()).update(names)
+        return entities
+
+    def relations_for_segments(self, segment_ids: List[str]) -> List[Tuple[str, str, str]]:
+        """汇总一组内容片段中的关系（去重，保持顺序）"""
+        relations = []
+        seen = set()
+        for segment_id in segment_ids:
+            info = self.segments.get(segment_id)
+            if not info:
+                continue
+            for source, label, target in info["relations"]:
+                if (source, label, target) not in seen:
+                    seen.add((source, label, target))
+                    relations.append((source, label, target))
+        return relations
+
+    def save(self):
+        """以追加方式持久化新的记录（可在I/O线程中调用）"""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return
+        directory = os.path.dirname(self.storage_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.storage_path, 'a', encoding='utf-8') as f:
+            f.writelines(json.dumps(record, ensure_ascii=False) + "\n" for record in pending)
+
+    def load(self):
+        """重放持久化的记录，重建索引"""
+        if not os.path.exists(self.storage_path):
+            return
+        with open(self.storage_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    self._apply(json.loads(line))
+                except json.JSONDecodeError as e:
+                    # 最后一行可能因异常退出而不完整
+                    print(f"图谱记录解析失败: {e}")
@@ -0,0 +1,219 @@
+import heapq
+import json
+import math
+import os
+from array import array
+from typing import Callable, Dict, List, Optional, Tuple
+from config.config import Config
+
+def tokenize(text: str) -> List[str]:
+    """将文本切分为中文字符二元组；英文和数字按整词处理"""
+    tokens = []
+    run = []
+
+    def flush_run():
+        if len(run) == 1:
+            tokens.append(run[0])
+        else:
+            tokens.extend(run[i] + run[i + 1] for i in range(len(run) - 1))
+        run.clear()
+
+    word = []
+    for char in text.lower():
+        if '\u4e00' <= char <= '\u9fff':
+            if word:
+                tokens.append("".join(word))
+                word.clear()
+            run.append(char)
+        elif char.isalnum():
+            if run:
+                flush_run()
+            word.append(char)
+        else:
+            if run:
+                flush_run()
+            if word:
+                tokens.append("".join(word))
+                word.clear()
+    if run:
+        flush_run()
+    if word:
+        tokens.append("".join(word))
+    return tokens
+
+class BigramIndex:
+    """基于中文二元组倒排索引的BM25检索"""
+
+    def __init__(self, storage_path: str = None):
+        self.config = Config.LEXICAL_INDEX
+        self.storage_path = storage_path
+        if self.storage_path is None:
+            self.storage_path = self.config["STORAGE_PATH"]
+        self.k1 = self.config["K1"]
+        self.b = self.config["B"]
+
+        # 倒排表：词项 -> (文档序号数组, 词频数组)
+        self.postings: Dict[str, Tuple[array, array]] = {}
+        # 词项 -> 未删除的文档中包含该词项的文档数（倒排表中保留已删除文档的条目）
+        self.doc_freqs: Dict[str, int] = {}
+        self.doc_ids: List[str] = []           # 文档序号 -> 文档ID
+        self.doc_numbers: Dict[str, int] = {}  # 文档ID -> 文档序号
+        self.doc_lengths = array('I')
+        self.documents: List[Optional[Dict]] = []  # {"content", "metadata"}
+        self.deleted = set()
+        self.total_length = 0
+        self._loaded = False
+
+    def __len__(self) -> int:
+        self._ensure_loaded()
+        return len(self.doc_ids) - len(self.deleted)
+
+    def _ensure_loaded(self):
+        """首次使用时才加载持久化的文档，避免拖慢启动"""
+        if self._loaded:
+            return
+        self._loaded = True
+        if not self.storage_path or not os.path.exists(self.storage_path):
+            return
+        with open(self.storage_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError as e:
+                    print(f"倒排索引记录解析失败: {e}")
+                    continue
+                if record.get("deleted"):
+                    self._remove(record["id"])
+                else:
+                    self._add(record["id"], record["content"], record.get("metadata", {}))
+
+    def add(self, doc_id: str, content: str, metadata: Dict = None):
+        """添加文档并持久化"""
+        self._ensure_loaded()
+        metadata = metadata or {}
+        self._add(doc_id, content, metadata)
+        self._append({"id": doc_id, "content": content, "metadata": metadata})
+
+    def remove(self, doc_id: str):
+        """删除文档（标记删除）"""
+        self._ensure_loaded()
+        if self._remove(doc_id):
+            self._append({"id": doc_id, "deleted": True})
+
+    def _add(self, doc_id: str, content: str, metadata: Dict):
+        if doc_id in self.doc_numbers:
+            self._remove(doc_id)
+
+        doc_number = len(self.doc_ids)
+        self.doc_ids.append(doc_id)
+        self.doc_numbers[doc_id] = doc_number
+        self.documents.append({"content": content, "metadata": metadata})
+
+        tokens = tokenize(content)
+        self.doc_lengths.append(len(tokens))
+        self.total_length += len(tokens)
+
+        term_freqs: Dict[str, int] = {}
+        for token in tokens:
+            term_freqs[token] = term_freqs.get(token, 0) + 1
+        for token, tf in term_freqs.items():
+            self.doc_freqs[token] = self.doc_freqs.get(token, 0) + 1
+            posting = self.postings.get(token)
+            if posting is None:
+                posting = self.postings[token] = (array('I'), array('H'))
+            posting[0].append(doc_number)
+            posting[1].append(min(tf, 65535))
+
+    def _remove(self, doc_id: str) -> bool:
+        doc_number = self.doc_numbers.pop(doc_id, None)
+        if doc_number is None:
+            return False
+        self.deleted.add(doc_number)
+        self.total_length -= self.doc_lengths[doc_number]
+        for token in set(tokenize(self.documents[doc_number]["content"])):
+            self.doc_freqs[token] -= 1
+        self.documents[doc_number] = None
+        return True
+
+    def _append(self, record: Dict):
+        if not self.storage_path:
+            return
+        directory = os.path.dirname(self.storage_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.storage_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def search(self,
+               query: str,
+               k: int = 3,
+               predicate: Callable[[Dict], bool] = None) -> List[Dict]:
+        """BM25检索，predicate用于按元数据过滤"""
+        self._ensure_loaded()
+        doc_count = len(self)
+        if doc_count == 0:
+            return []
+        avg_length = self.total_length / doc_count
+
+        query_terms: Dict[str, int] = {}
+        for token in tokenize(query):
+            query_terms[token] = query_terms.get(token, 0) + 1
+
+        # 出现在大多数文档中的词项区分度极低，查询中有更具区分度的词项时跳过
+        max_df = self.config["MAX_DF_RATIO"] * doc_count
+        matched = [
+            (token, query_tf, self.doc_freqs[token], self.postings[token])
+            for token, query_tf in query_terms.items()
+            if self.doc_freqs.get(token)
+        ]
+        selective = [term for term in matched if term[2] <= max_df]
+        if selective:
+            matched = selective
+
+        scores: Dict[int, float] = {}
+        k1, b = self.k1, self.b
+        doc_lengths = self.doc_lengths
+        for token, query_tf, df, (doc_numbers, term_freqs) in matched:
+            idf = math.log(1 + (doc_count - df + 0.5) / (df + 0.5)) * query_tf
+            norm = k1 * (1 - b)
+            scale = k1 * b / avg_length
+            for doc_number, tf in zip(doc_numbers, term_freqs):
+                denominator = tf + norm + scale * doc_lengths[doc_number]
+                scores[doc_number] = scores.get(doc_number, 0.0) + idf * tf * (k1 + 1) / denominator
+
+        # 先取部分候选，过滤后数量不足时再扩大范围
+        limit = max(k, 1) * self.config["CANDIDATE_MULTIPLIER"]
+        while True:
+            ranked = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+            results = []
+            for doc_number, score in ranked:
+                if doc_number in self.deleted:
+                    continue
+                document = self.documents[doc_number]
+                if predicate and not predicate(document["metadata"]):
+                    continue
+                results.append({
+                    'id': self.doc_ids[doc_number],
+                    'content': document["content"],
+                    'score': score,
+                    'metadata': document["metadata"]
+                })
+                if len(results) >= k:
+                    return results
+            if limit >= len(scores):
+                return results
+            limit *= 4
+
+    def memory_usage(self) -> int:
+        """估算索引占用的内存（字节），不含文档原文"""
+        total = 0
+        for token, (doc_numbers, term_freqs) in self.postings.items():
+            total += len(token.encode('utf-8')) + 49
+            total += doc_numbers.itemsize * len(doc_numbers)
+            total += term_freqs.itemsize * len(term_freqs)
+            total += 2 * 64  # array对象自身的开销
+        total += self.doc_lengths.itemsize * len(self.doc_lengths)
+        return total
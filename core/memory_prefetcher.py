@@ -0,0 +1,55 @@
+import asyncio
+from typing import Dict, List, Optional, Tuple
+from models.schemas import DialogueContext
+from core.vector_store import VectorStoreManager
+from config.config import Config
+
+class MemoryPrefetcher:
+    """在用户输入期间后台预取相关记忆，生成问题时直接使用缓存结果"""
+
+    def __init__(self, vector_store: VectorStoreManager):
+        self.vector_store = vector_store
+        self.config = Config.PREFETCH
+        self._task: Optional[asyncio.Task] = None
+        self._task_key: Optional[Tuple] = None
+        self._cached_key: Optional[Tuple] = None
+        self._cached: List[Dict] = []
+
+    def _key(self, context: DialogueContext) -> Tuple:
+        entities = context.recent_entities[-self.config["MAX_ENTITIES"]:]
+        return (context.current_topic, tuple(entities))
+
+    def schedule(self, context: DialogueContext):
+        """为当前话题和最近实体安排一次后台预取（相同条件不重复预取）"""
+        if not self.config["ENABLED"]:
+            return
+        key = self._key(context)
+        if key == self._cached_key or key == self._task_key:
+            return
+        if self._task and not self._task.done():
+            self._task.cancel()
+        self._task_key = key
+        self._task = asyncio.create_task(self._fetch(key))
+
+    async def _fetch(self, key: Tuple) -> List[Dict]:
+        topic, entities = key
+        query = " ".join([topic, *entities])
+        try:
+            return await self.vector_store.search_hybrid(
+                query,
+                k=self.config["K"],
+                mode=self.config["MODE"]
+            )
+        except Exception as e:
+            print(f"记忆预取失败: {e}")
+            return []
+
+    def apply(self, context: DialogueContext):
+        """将已完成的预取结果写入上下文；预取未完成时保留旧结果，从不等待"""
+        if self._task and self._task.done():
+            if not self._task.cancelled() and self._task.exception() is None:
+                self._cached = self._task.result()
+                self._cached_key = self._task_key
+            self._task = None
+            self._task_key = None
+        context.related_memories = self._cached
@@ -0,0 +1,131 @@
+import asyncio
+import hashlib
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional
+from models.schemas import DialogueContext
+from utils.api_manager import api_manager
+from config.config import Config
+
+class QuestionSpeculator:
+    """空闲时为最可能的提问策略预生成候选问题
+
+    候选问题以策略、目标话题和深度为键缓存，用户回答后若实际策略命中缓存分支，则直接返回候选问题。
+    最近提到的实体几乎每轮都会变化，不作为键的一部分（否则几乎不会命中）；每轮查询后清空缓存，
+    候选问题只用于紧接着的一轮，为更早的回答预生成的问题不会在之后的轮次中返回。
+    """
+
+    def __init__(self, dialogue_manager):
+        self.dialogue_manager = dialogue_manager
+        self.config = Config.SPECULATION
+        self.cache: "OrderedDict[str, str]" = OrderedDict()
+        self.action_counts: Counter = Counter()
+        self.calls = 0
+        self.lookups = 0
+        self.hits = 0
+        self._tasks: List[asyncio.Task] = []
+
+    @staticmethod
+    def fingerprint(strategy: Dict, context: DialogueContext) -> str:
+        """候选问题对应的策略分支指纹：策略、目标话题和深度"""
+        topic = strategy.get('new_topic') or context.current_topic
+        depth = context.depth_level + strategy.get('depth_change', 0)
+        key = f"{strategy['action']}|{topic}|{depth}"
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def _likely_strategies(self,
+                           metrics: Dict[str, float],
+                           context: DialogueContext) -> List[Dict]:
+        """按历史频率排序的可能策略分支"""
+        neutral_context = context.model_copy(update={"last_response": ""})
+        branches = [
+            self.dialogue_manager._determine_question_strategy(metrics, neutral_context)
+        ]
+        if branches[0]['action'] != 'switch':
+            branches.append({
+                'action': 'switch',
+                'depth_change': 0,
+                'focus_aspect': None,
+                'new_topic': self.dialogue_manager._select_new_topic(
+                    neutral_context, metrics, current_topic=context.current_topic
+                )
+            })
+        branches.sort(key=lambda s: self.action_counts[s['action']], reverse=True)
+        return branches[:self.config["BRANCHES"]]
+
+    def speculate(self, metrics: Dict[str, float], context: DialogueContext):
+        """在后台为可能的策略分支预生成问题（受调用次数上限约束）"""
+        if not self.config["ENABLED"] or not api_manager.usage.allows_optional():
+            return
+        for strategy in self._likely_strategies(metrics, context):
+            key = self.fingerprint(strategy, context)
+            if key in self.cache:
+                continue
+            if self.calls >= self.config["MAX_CALLS"]:
+                return
+            self.calls += 1
+            task = asyncio.create_task(self._generate(key, strategy, context.model_copy()))
+            self._tasks.append(task)
+
+    async def _generate(self, key: str, strategy: Dict, context: DialogueContext):
+        from langchain_core.messages import SystemMessage, HumanMessage
+        topic = strategy.get('new_topic') or context.current_topic
+        system_message = SystemMessage(content="""
+            你是一个专业的传记作家助手，负责通过对话的方式收集用户的生平故事。
+            请根据话题和策略提出一个自然、友好的问题。
+            只返回问题本身，不要回应用户的回答，不要返回提示词或模板。
+        """)
+        human_message = HumanMessage(content=f"""
+            话题: {topic}
+            对话策略: {strategy['action']}
+            当前深度: {context.depth_level + strategy.get('depth_change', 0)}
+            最近提到的实体: {", ".join(context.recent_entities)}
+        """)
+        try:
+            response = await api_manager.execute_with_retry(
+                self.dialogue_manager.llm.ainvoke,
+                [system_message, human_message],
+                role="speculate",
+                theme=topic
+            )
+        except Exception as e:
+            print(f"预生成问题失败: {e}")
+            return
+        self.cache[key] = response.content
+        while len(self.cache) > self.config["MAX_CACHE"]:
+            self.cache.popitem(last=False)
+
+    def cancel(self):
+        """取消尚未完成的预生成任务，避免占用关键路径的API配额"""
+        for task in self._tasks:
+            if not task.done():
+                task.cancel()
+        self._tasks = []
+
+    def preferred_topics(self, context: DialogueContext) -> List[str]:
+        """已有切换话题候选问题的话题"""
+        return [
+            topic for topic in Config.TOPICS
+            if self.fingerprint({'action': 'switch', 'new_topic': topic}, context) in self.cache
+        ]
+
+    def lookup(self, strategy: Dict, context: DialogueContext) -> Optional[str]:
+        """查询实际策略对应的候选问题，并清空本轮的候选问题"""
+        self.action_counts[strategy['action']] += 1
+        if not self.config["ENABLED"]:
+            return None
+        self.lookups += 1
+        question = self.cache.get(self.fingerprint(strategy, context))
+        self.cache.clear()
+        if question is not None:
+            self.hits += 1
+        return question
+
+    def stats(self) -> Dict:
+        """预生成的命中率和调用成本"""
+        return {
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+            "calls": self.calls,
+            "max_calls": self.config["MAX_CALLS"]
+        }
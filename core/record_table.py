@@ -0,0 +1,90 @@
+import os
+import threading
+from typing import Dict, Iterator, Optional, Tuple
+from utils.codec import JsonCodec
+
+class RecordTable:
+    """追加写入的记录表
+
+    每条记录是带"id"字段的字典，同一ID以最后一次写入为准；记录的编码和分帧由codec决定
+    （默认每行一条JSON）。ID到记录位置（偏移、长度）的索引在首次随机读取时才扫描建立，
+    之后随写入增量维护；随机读取复用同一个只读文件句柄。
+    """
+
+    def __init__(self, path: str, codec=None):
+        self.path = path
+        self.codec = codec or JsonCodec()
+        self._offsets: Optional[Dict[str, Tuple[int, int]]] = None
+        self._reader = None
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _ensure_index(self):
+        if self._offsets is not None:
+            return
+        self._offsets = {}
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as f:
+            while True:
+                raw = self.codec.read_frame(f)
+                if raw is None:
+                    break
+                try:
+                    record_id = self.codec.loads(raw)["id"]
+                    self._offsets[record_id] = (f.tell() - len(raw), len(raw))
+                except (ValueError, KeyError, TypeError):
+                    # 异常退出时最后一条记录可能不完整
+                    pass
+
+    def append(self, record: Dict):
+        """追加一条记录"""
+        self.append_many([record])
+
+    def append_many(self, records):
+        """批量追加记录"""
+        with open(self.path, 'ab') as f:
+            offset = f.tell()
+            for record in records:
+                data = self.codec.frame(record)
+                f.write(data)
+                if self._offsets is not None:
+                    # 帧头之后的部分为记录内容
+                    payload_length = len(data) - self.codec.frame_overhead
+                    self._offsets[record["id"]] = (offset + len(data) - payload_length, payload_length)
+                offset += len(data)
+
+    def get(self, record_id: str) -> Optional[Dict]:
+        """按ID读取记录，不存在时返回None"""
+        self._ensure_index()
+        position = self._offsets.get(record_id)
+        if position is None:
+            return None
+        offset, length = position
+        with self._lock:
+            if self._reader is None:
+                self._reader = open(self.path, 'rb')
+            self._reader.seek(offset)
+            raw = self._reader.read(length)
+        return self.codec.loads(raw)
+
+    def __contains__(self, record_id: str) -> bool:
+        self._ensure_index()
+        return record_id in self._offsets
+
+    def __iter__(self) -> Iterator[Dict]:
+        """按首次写入顺序遍历每个ID的最新记录"""
+        self._ensure_index()
+        for record_id in list(self._offsets):
+            yield self.get(record_id)
+
+    def size_bytes(self) -> int:
+        return os.path.getsize(self.path) if os.path.exists(self.path) else 0
+
+    def close(self):
+        with self._lock:
+            if self._reader is not None:
+                self._reader.close()
+                self._reader = None
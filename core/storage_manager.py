@@ -1,24 +1,57 @@
+import hashlib
 import json
 import os
+import threading
+from collections import OrderedDict
 from typing import Dict, List, Optional
 from datetime import datetime
-from models.content_manager import ThematicContent, ContentSegment
+from models.content_manager import ThematicContent, SubTheme, ContentSegment
 from models.schemas import DialogueTurn
 from core.version_manager import VersionManager
+from core.record_table import RecordTable
+from utils.codec import get_codec, construct_unvalidated
+from utils.io_pool import run_io
+from config.config import Config
+
+# 主题、片段和轮次记录的存储结构版本，记录中以"v"字段保存（缺省视为0）
+SCHEMA_VERSION = 1
 
 class StorageManager:
-    def __init__(self, storage_dir: str = "./data"):
+    def __init__(self, storage_dir: str = "./data", storage_format: Optional[str] = None):
         self.storage_dir = storage_dir
         self.version_manager = VersionManager(storage_dir)
         self.ensure_storage_structure()
         
+        # 主题和记录表的编码格式（json/msgpack）；当前版本写入的数据可跳过校验直接构建模型
+        self.codec = get_codec(storage_format or Config.STORAGE["FORMAT"])
+        self.fast_load = Config.STORAGE["FAST_LOAD"]
+        
+        # 对话轮次和内容片段各只存一份，主题和片段上下文只保存ID
+        self.turn_table = RecordTable(
+            f"{storage_dir}/dialogue_history/turns{self.codec.table_extension}", self.codec
+        )
+        self.segment_table = RecordTable(
+            f"{storage_dir}/segments/segments{self.codec.table_extension}", self.codec
+        )
+        # 已解析对象的缓存，保证同一轮次/片段在多个主题间共享同一对象
+        self._turn_cache: "OrderedDict[str, DialogueTurn]" = OrderedDict()
+        self._segment_cache: "OrderedDict[str, ContentSegment]" = OrderedDict()
+        # 已写入片段表的片段内容摘要，内容未变化时不重复写入
+        self._segment_digests: Dict[str, str] = {}
+        # 读写在I/O线程池中执行，保护上面的记录表和缓存
+        self._lock = threading.RLock()
+        
     def ensure_storage_structure(self):
         """确保存储目录结构存在"""
         directories = [
             self.storage_dir,
             f"{self.storage_dir}/generated_content",
             f"{self.storage_dir}/dialogue_history",
-            f"{self.storage_dir}/themes"
+            f"{self.storage_dir}/themes",
+            f"{self.storage_dir}/segments",
+            f"{self.storage_dir}/session",
+            f"{self.storage_dir}/usage",
+            f"{self.storage_dir}/biography"
         ]
         for directory in directories:
             os.makedirs(directory, exist_ok=True)
@@ -28,6 +61,10 @@ class StorageManager:
                                    content: str, 
                                    version: int = None):
         """保存生成的内容"""
+        await run_io(self.write_generated_content, theme, content, version)
+        
+    def write_generated_content(self, theme: str, content: str, version: int = None):
+        """同步写入生成的内容"""
         theme_dir = f"{self.storage_dir}/generated_content/{theme}"
         os.makedirs(theme_dir, exist_ok=True)
         
@@ -55,6 +92,10 @@ class StorageManager:
                                    theme: str, 
                                    version: int = None) -> Optional[str]:
         """加载生成的内容"""
+        return await run_io(self.read_generated_content, theme, version)
+        
+    def read_generated_content(self, theme: str, version: int = None) -> Optional[str]:
+        """同步读取生成的内容（供按需加载使用）"""
         theme_dir = f"{self.storage_dir}/generated_content/{theme}"
         
         if not os.path.exists(theme_dir):
@@ -79,8 +120,20 @@ class StorageManager:
             data = json.load(f)
             return data["content"]
             
+    def list_generated_themes(self) -> List[str]:
+        """已有生成内容的主题"""
+        content_dir = f"{self.storage_dir}/generated_content"
+        return [
+            theme for theme in os.listdir(content_dir)
+            if os.path.isdir(f"{content_dir}/{theme}")
+        ]
+            
     async def save_dialogue_history(self, dialogue_history: List[DialogueTurn]):
         """保存对话历史"""
+        await run_io(self.write_dialogue_history, list(dialogue_history))
+        
+    def write_dialogue_history(self, dialogue_history: List[DialogueTurn]):
+        """同步写入完整对话历史"""
         filename = f"{self.storage_dir}/dialogue_history/history.json"
         
         # 转换为可序列化的格式
@@ -101,8 +154,23 @@ class StorageManager:
         with open(filename, 'w', encoding='utf-8') as f:
             json.dump(serializable_history, f, ensure_ascii=False, indent=2)
             
+    async def append_dialogue_turns(self, turns: List[DialogueTurn]):
+        """以追加方式将对话轮次写入轮次表，无需重写完整历史"""
+        await run_io(self.write_dialogue_turns, list(turns))
+        
+    def write_dialogue_turns(self, turns: List[DialogueTurn]):
+        with self._lock:
+            self.turn_table.append_many([
+                {**turn.model_dump(), "v": SCHEMA_VERSION} for turn in turns
+            ])
+            for turn in turns:
+                self._cache_put(self._turn_cache, turn.id, turn, Config.STORAGE["TURN_CACHE_SIZE"])
+                
     async def load_dialogue_history(self) -> List[DialogueTurn]:
         """加载对话历史"""
+        return await run_io(self.read_dialogue_history)
+        
+    def read_dialogue_history(self) -> List[DialogueTurn]:
         filename = f"{self.storage_dir}/dialogue_history/history.json"
         
         if not os.path.exists(filename):
@@ -114,54 +182,305 @@ class StorageManager:
             
     async def save_theme_data(self, themes: Dict[str, ThematicContent]):
         """保存主题数据"""
-        theme_dir = f"{self.storage_dir}/themes"
+        # 在事件循环中复制可变容器，序列化和写入在线程中进行，期间主题仍可被修改
+        snapshots = {
+            theme_name: self._snapshot_theme(theme_content)
+            for theme_name, theme_content in themes.items()
+        }
+        # 片段缓存保存原对象（而非副本），重新加载的主题与之后的修改共享同一片段
+        live_segments = {
+            segment.id: segment
+            for theme_content in themes.values()
+            for sub_theme in theme_content.sub_themes.values()
+            for segment in sub_theme.content_segments
+        }
+        await run_io(self.write_themes, snapshots, live_segments)
         
+    def write_themes(self, themes: Dict[str, ThematicContent],
+                     live_segments: Optional[Dict[str, ContentSegment]] = None):
         for theme_name, theme_content in themes.items():
-            filename = f"{theme_dir}/{theme_name}.json"
+            self.write_theme(theme_name, theme_content, live_segments)
             
-            # 转换为可序列化的格式
-            serializable_content = {
-                "main_theme": theme_content.main_theme,
-                "sub_themes": {
-                    name: {
-                        "name": sub_theme.name,
-                        "first_mentioned": sub_theme.first_mentioned.isoformat(),
-                        "last_updated": sub_theme.last_updated.isoformat(),
-                        "related_entities": sub_theme.related_entities,
-                        "content_segments": [
-                            self._serialize_content_segment(seg)
-                            for seg in sub_theme.content_segments
-                        ]
+    @staticmethod
+    def _snapshot_theme(theme_content: ThematicContent) -> ThematicContent:
+        """主题的浅拷贝，子主题的片段列表、各片段的可变字段和实体集合各自复制"""
+        return theme_content.model_copy(update={
+            "sub_themes": {
+                name: sub_theme.model_copy(update={
+                    "content_segments": [
+                        StorageManager._snapshot_segment(segment)
+                        for segment in sub_theme.content_segments
+                    ],
+                    "related_entities": {
+                        entity_type: set(entities)
+                        for entity_type, entities in sub_theme.related_entities.items()
                     }
-                    for name, sub_theme in theme_content.sub_themes.items()
-                }
+                })
+                for name, sub_theme in theme_content.sub_themes.items()
             }
+        })
             
-            with open(filename, 'w', encoding='utf-8') as f:
-                json.dump(serializable_content, f, ensure_ascii=False, indent=2)
-                
+    @staticmethod
+    def _snapshot_segment(segment: ContentSegment) -> ContentSegment:
+        """片段的浅拷贝：后台补全会在事件循环中扩充实体、关键词和关系列表，写入线程只读副本"""
+        return segment.model_copy(update={
+            "entities": {entity_type: list(entities) for entity_type, entities in segment.entities.items()},
+            "keywords": list(segment.keywords),
+            "relations": list(segment.relations or [])
+        })
+            
+    def write_theme(self, theme_name: str, theme_content: ThematicContent,
+                    live_segments: Optional[Dict[str, ContentSegment]] = None):
+        """同步写入单个主题；theme_content为快照时，live_segments为对应的原片段对象"""
+        with self._lock:
+            self._store_segments((
+                segment
+                for sub_theme in theme_content.sub_themes.values()
+                for segment in sub_theme.content_segments
+            ), live_segments)
+            
+            filename = f"{self.storage_dir}/themes/{theme_name}{self.codec.document_extension}"
+            with open(filename, 'wb') as f:
+                f.write(self.codec.dump_document(self._serialize_theme(theme_content)))
+            
+    def list_themes(self) -> List[str]:
+        """已保存的主题名称"""
+        extension = self.codec.document_extension
+        return [
+            filename[:-len(extension)]
+            for filename in os.listdir(f"{self.storage_dir}/themes")
+            if filename.endswith(extension)
+        ]
+        
+    def read_theme(self, theme_name: str) -> Optional[ThematicContent]:
+        """同步读取单个主题（供按需加载使用）"""
+        filename = f"{self.storage_dir}/themes/{theme_name}{self.codec.document_extension}"
+        if not os.path.exists(filename):
+            return None
+        with open(filename, 'rb') as f:
+            data = self._upgrade_record(self.codec.loads(f.read()))
+        with self._lock:
+            return self._build_theme(data)
+            
+    def _build_theme(self, data: Dict) -> ThematicContent:
+        """由主题文档构建ThematicContent，按ID解析其中的片段"""
+        if "last_updated" not in data:
+            data["last_updated"] = max(
+                (sub["last_updated"] for sub in data["sub_themes"].values()),
+                default=datetime.now().isoformat()
+            )
+        for sub in data["sub_themes"].values():
+            # 旧格式直接内嵌片段，新格式只保存片段ID
+            if "content_segment_ids" in sub:
+                segments = [
+                    self._resolve_segment(segment_id)
+                    for segment_id in sub.pop("content_segment_ids")
+                ]
+                sub["content_segments"] = [s for s in segments if s is not None]
+        if self._is_trusted(data):
+            return construct_unvalidated(ThematicContent, {
+                "main_theme": data["main_theme"],
+                "sub_themes": {
+                    name: construct_unvalidated(SubTheme, {
+                        "name": sub["name"],
+                        "content_segments": sub["content_segments"],
+                        "first_mentioned": datetime.fromisoformat(sub["first_mentioned"]),
+                        "last_updated": datetime.fromisoformat(sub["last_updated"]),
+                        "related_entities": {
+                            entity_type: set(entities)
+                            for entity_type, entities in sub["related_entities"].items()
+                        }
+                    })
+                    for name, sub in data["sub_themes"].items()
+                },
+                "last_updated": datetime.fromisoformat(data["last_updated"])
+            })
+        return ThematicContent(**data)
+        
+    @staticmethod
+    def _upgrade_record(record: Dict) -> Dict:
+        """检查记录的存储结构版本；旧版本记录由调用方按兼容方式解析"""
+        version = record.get("v", 0)
+        if version > SCHEMA_VERSION:
+            raise ValueError(f"不支持的存储结构版本: {version}（当前为 {SCHEMA_VERSION}）")
+        return record
+        
+    def _is_trusted(self, record: Dict) -> bool:
+        """当前版本写入的本地数据可跳过pydantic校验"""
+        return self.fast_load and record.get("v", 0) == SCHEMA_VERSION
+        
+    def _store_segments(self, segments, live_segments: Optional[Dict[str, ContentSegment]] = None):
+        """将片段批量写入片段表（内容未变化的片段跳过），缓存中放入原片段对象"""
+        live_segments = live_segments or {}
+        records = []
+        for segment in segments:
+            record = self._serialize_content_segment(segment)
+            digest = self._digest(record)
+            if self._segment_digests.get(segment.id) == digest:
+                continue
+            records.append(record)
+            self._segment_digests[segment.id] = digest
+            self._cache_put(self._segment_cache, segment.id, live_segments.get(segment.id, segment),
+                            Config.STORAGE["SEGMENT_CACHE_SIZE"])
+        if records:
+            self.segment_table.append_many(records)
+            
+    def _digest(self, record: Dict) -> str:
+        # 序列化字段顺序固定，直接对编码结果取摘要
+        return hashlib.sha1(self.codec.dumps(record)).hexdigest()
+        
+    def _resolve_segment(self, segment_id: str) -> Optional[ContentSegment]:
+        """按ID解析片段及其对话上下文"""
+        segment = self._segment_cache.get(segment_id)
+        if segment is not None:
+            self._segment_cache.move_to_end(segment_id)
+            return segment
+            
+        record = self.segment_table.get(segment_id)
+        if record is None:
+            return None
+        digest = self._digest(record)
+        self._upgrade_record(record)
+        turns = [self._resolve_turn(turn_id) for turn_id in record.pop("dialogue_context_ids", [])]
+        record["dialogue_context"] = [turn for turn in turns if turn is not None]
+        if self._is_trusted(record):
+            del record["v"]
+            record["timestamp"] = datetime.fromisoformat(record["timestamp"])
+            segment = construct_unvalidated(ContentSegment, record)
+        else:
+            segment = ContentSegment(**record)
+        
+        self._segment_digests[segment_id] = digest
+        self._cache_put(self._segment_cache, segment_id, segment, Config.STORAGE["SEGMENT_CACHE_SIZE"])
+        return segment
+        
+    def _resolve_turn(self, turn_id: str) -> Optional[DialogueTurn]:
+        """按ID解析对话轮次"""
+        turn = self._turn_cache.get(turn_id)
+        if turn is not None:
+            self._turn_cache.move_to_end(turn_id)
+            return turn
+        record = self.turn_table.get(turn_id)
+        if record is None:
+            return None
+        self._upgrade_record(record)
+        if self._is_trusted(record):
+            del record["v"]
+            turn = construct_unvalidated(DialogueTurn, record)
+        else:
+            turn = DialogueTurn(**record)
+        self._cache_put(self._turn_cache, turn_id, turn, Config.STORAGE["TURN_CACHE_SIZE"])
+        return turn
+        
+    @staticmethod
+    def _cache_put(cache: OrderedDict, key: str, value, capacity: int):
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > capacity:
+            cache.popitem(last=False)
+        
+    def _serialize_theme(self, theme_content: ThematicContent) -> Dict:
+        """将ThematicContent转换为可序列化的格式"""
+        return {
+            "v": SCHEMA_VERSION,
+            "main_theme": theme_content.main_theme,
+            "last_updated": theme_content.last_updated.isoformat(),
+            "sub_themes": {
+                name: {
+                    "name": sub_theme.name,
+                    "first_mentioned": sub_theme.first_mentioned.isoformat(),
+                    "last_updated": sub_theme.last_updated.isoformat(),
+                    "related_entities": {
+                        entity_type: sorted(entities)
+                        for entity_type, entities in sub_theme.related_entities.items()
+                    },
+                    "content_segment_ids": [
+                        seg.id for seg in sub_theme.content_segments
+                    ]
+                }
+                for name, sub_theme in theme_content.sub_themes.items()
+            }
+        }
+        
     def _serialize_content_segment(self, segment: ContentSegment) -> Dict:
-        """将ContentSegment转换为可序列化的格式"""
+        """将ContentSegment转换为片段表记录，对话上下文只保存轮次ID"""
         return {
+            "v": SCHEMA_VERSION,
             "id": segment.id,
             "content": segment.content,
             "timestamp": segment.timestamp.isoformat(),
             "entities": segment.entities,
+            "relations": segment.relations,
             "themes": segment.themes,
             "keywords": segment.keywords,
-            "dialogue_context": [
-                {
-                    "id": turn.id,
-                    "question": turn.question,
-                    "answer": turn.answer,
-                    "topic": turn.topic,
-                    "emotion_score": turn.emotion_score,
-                    "interest_score": turn.interest_score,
-                    "depth_level": turn.depth_level
-                }
-                for turn in segment.dialogue_context
-            ]
-        } 
+            "dialogue_context_ids": [turn.id for turn in segment.dialogue_context]
+        }
+        
+    async def save_session(self, state: Dict):
+        """保存会话状态（上下文、最近轮次、主题汇总），先写临时文件再替换"""
+        await run_io(self.write_session, state)
+        
+    def write_session(self, state: Dict):
+        filename = f"{self.storage_dir}/session/session.json"
+        temp_filename = f"{filename}.tmp"
+        with open(temp_filename, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False, indent=2)
+        os.replace(temp_filename, filename)
+        
+    async def load_session(self) -> Optional[Dict]:
+        """加载会话状态，不存在时返回None"""
+        return await run_io(self.read_session)
+        
+    def read_session(self) -> Optional[Dict]:
+        filename = f"{self.storage_dir}/session/session.json"
+        if not os.path.exists(filename):
+            return None
+        with open(filename, 'r', encoding='utf-8') as f:
+            return json.load(f)
+            
+    async def save_biography(self, text: str, report: Dict):
+        """保存汇编的全书及其生成报告，每次汇编保存为新版本"""
+        await run_io(self.write_biography, text, report)
+        
+    def write_biography(self, text: str, report: Dict):
+        biography_dir = f"{self.storage_dir}/biography"
+        versions = [
+            int(f.split('_')[1].split('.')[0])
+            for f in os.listdir(biography_dir)
+            if f.startswith('version_')
+        ]
+        version = max(versions, default=0) + 1
+        data = {
+            "content": text,
+            "report": report,
+            "timestamp": datetime.now().isoformat(),
+            "version": version
+        }
+        with open(f"{biography_dir}/version_{version}.json", 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+            
+    async def save_usage(self, session_id: str, usage: Dict):
+        """保存会话的token用量和费用统计，每个会话一个文件"""
+        await run_io(self.write_usage, session_id, usage)
+        
+    def write_usage(self, session_id: str, usage: Dict):
+        filename = f"{self.storage_dir}/usage/{session_id}.json"
+        temp_filename = f"{filename}.tmp"
+        with open(temp_filename, 'w', encoding='utf-8') as f:
+            json.dump(usage, f, ensure_ascii=False, indent=2)
+        os.replace(temp_filename, filename)
+        
+    async def load_usage(self, session_id: str) -> Optional[Dict]:
+        """加载会话的用量统计，不存在时返回None"""
+        return await run_io(self.read_usage, session_id)
+        
+    def read_usage(self, session_id: str) -> Optional[Dict]:
+        filename = f"{self.storage_dir}/usage/{session_id}.json"
+        if not os.path.exists(filename):
+            return None
+        with open(filename, 'r', encoding='utf-8') as f:
+            return json.load(f)
+            
     async def create_backup(self, description: str = "") -> str:
         """创建当前状态的备份"""
         # 获取当前状态的序列化数据
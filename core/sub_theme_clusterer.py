@@ -0,0 +1,136 @@
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+import numpy as np
+from models.content_manager import ContentSegment
+from core.keyword_matcher import KeywordMatcher
+from utils.json_store import JsonFileStore
+from config.config import Config
+
+# 命名子主题时优先使用的实体类型（人物多为"我""姐姐"等泛称，不适合作为子主题名）
+NAME_ENTITY_TYPES = ["事件", "地点", "物品", "时间"]
+
+class SubThemeClusterer:
+    """按内容片段的嵌入向量在线聚类，形成各主题的子主题
+
+    每个主题维护若干簇（向量和、片段数）。新片段与各簇中心的余弦相似度达到ASSIGN_THRESHOLD时
+    归入最相近的簇并更新中心，否则新建簇（达到MAX_CLUSTERS后归入最相近的簇）；
+    更新后的簇与其他簇过于相近（MERGE_THRESHOLD）时合并。分配只需与各簇中心比较一次，不调用LLM。
+    """
+
+    def __init__(self,
+                 embed: Callable[[ContentSegment], Awaitable[List[float]]],
+                 storage_path: str = None,
+                 config: Optional[Dict] = None):
+        self.embed = embed
+        self.config = config or Config.SUB_THEMES
+        self.storage_path = storage_path or self.config["STORAGE_PATH"]
+        # {主题: [{"name": str, "sum": np.ndarray, "count": int}]}
+        self.clusters: Dict[str, List[Dict]] = {}
+        # 各主题的子主题命名关键词，构建一次
+        self.name_matchers = {
+            theme: KeywordMatcher(table) for theme, table in Config.KEYWORDS["SUB_THEMES"].items()
+        }
+        # store.lock保护clusters（分配在事件循环中进行，保存在I/O线程中进行）
+        self._store = JsonFileStore(self.storage_path, "子主题聚类", indent=None)
+        self.load()
+
+    async def assign(self, theme: str, segment: ContentSegment) -> Tuple[str, List[Tuple[str, str]]]:
+        """为片段选择子主题，返回(子主题名, [(被合并的子主题, 合并到的子主题)])"""
+        vector = np.asarray(await self.embed(segment), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            raise ValueError("嵌入向量为零向量")
+        vector /= norm
+
+        with self._store.lock:
+            clusters = self.clusters.setdefault(theme, [])
+            if clusters and clusters[0]["sum"].shape != vector.shape:
+                # 嵌入模型变化后旧的簇中心不再可比，重新开始聚类
+                clusters.clear()
+
+            best, similarity = self._nearest(clusters, vector)
+            if best is None or (similarity < self.config["ASSIGN_THRESHOLD"]
+                                and len(clusters) < self.config["MAX_CLUSTERS"]):
+                best = {"name": self._name(theme, clusters, segment), "sum": np.zeros_like(vector), "count": 0}
+                clusters.append(best)
+            best["sum"] += vector
+            best["count"] += 1
+            self._store.dirty = True
+            merges = self._merge(clusters, best)
+            # 更新后的簇较小时会并入另一个簇，片段归入合并后保留的子主题
+            return (merges[-1][1] if merges else best["name"]), merges
+
+    @staticmethod
+    def _centroid(cluster: Dict) -> np.ndarray:
+        norm = np.linalg.norm(cluster["sum"])
+        return cluster["sum"] / norm if norm else cluster["sum"]
+
+    def _nearest(self, clusters: List[Dict], vector: np.ndarray,
+                 exclude: Optional[Dict] = None) -> Tuple[Optional[Dict], float]:
+        best, best_similarity = None, -1.0
+        for cluster in clusters:
+            if cluster is exclude:
+                continue
+            similarity = float(self._centroid(cluster) @ vector)
+            if similarity > best_similarity:
+                best, best_similarity = cluster, similarity
+        return best, best_similarity
+
+    def _merge(self, clusters: List[Dict], updated: Dict) -> List[Tuple[str, str]]:
+        """更新后的簇与最相近的簇中心足够接近时合并（保留片段较多的簇名）"""
+        other, similarity = self._nearest(clusters, self._centroid(updated), exclude=updated)
+        if other is None or similarity < self.config["MERGE_THRESHOLD"]:
+            return []
+        target, source = (other, updated) if other["count"] >= updated["count"] else (updated, other)
+        target["sum"] += source["sum"]
+        target["count"] += source["count"]
+        clusters.remove(source)
+        return [(source["name"], target["name"])]
+
+    def _name(self, theme: str, clusters: List[Dict], segment: ContentSegment) -> str:
+        """命名新的子主题（不与已有子主题重名）：优先使用主题的子主题关键词表中命中最多的名称，
+        其次是片段中的事件、地点等实体或关键词"""
+        used = {cluster["name"] for cluster in clusters}
+        hits = self.name_matchers[theme].match(segment.content) if theme in self.name_matchers else {}
+        candidates = sorted(hits, key=lambda name: len(hits[name]), reverse=True) + [
+            entity
+            for entity_type in NAME_ENTITY_TYPES
+            for entity in segment.entities.get(entity_type, [])
+            if isinstance(entity, str)
+        ] + list(segment.keywords)
+        for candidate in candidates:
+            if candidate and candidate not in used:
+                return candidate
+        index = len(clusters) + 1
+        while f"片段组{index}" in used:
+            index += 1
+        return f"片段组{index}"
+
+    def sub_themes(self, theme: str) -> Dict[str, int]:
+        """主题的各子主题及其片段数"""
+        return {cluster["name"]: cluster["count"] for cluster in self.clusters.get(theme, [])}
+
+    def save(self):
+        """有修改时写入磁盘（可在I/O线程中调用）"""
+        self._store.save(lambda: {
+            theme: [
+                {"name": c["name"], "sum": c["sum"].tolist(), "count": c["count"]}
+                for c in clusters
+            ]
+            for theme, clusters in self.clusters.items()
+        })
+
+    def load(self):
+        """加载已保存的簇"""
+        data = self._store.load()
+        if data is None:
+            return
+        try:
+            self.clusters = {
+                theme: [
+                    {"name": c["name"], "sum": np.asarray(c["sum"], dtype=np.float32), "count": c["count"]}
+                    for c in clusters
+                ]
+                for theme, clusters in data.items()
+            }
+        except (KeyError, TypeError) as e:
+            print(f"子主题聚类加载失败: {e}")
@@ -0,0 +1,38 @@
+from typing import Dict, List, Optional
+from utils.json_store import JsonFileStore
+from config.config import Config
+
+class SummaryCache:
+    """子主题摘要缓存
+
+    每个子主题保存一份LLM摘要及其覆盖的内容片段ID。子主题的片段ID与缓存一致时直接复用摘要；
+    只新增了片段时由生成器把新片段并入原摘要；片段被替换或删除时重新摘要。
+    """
+
+    def __init__(self, storage_path: str = None):
+        self.storage_path = storage_path or Config.SUMMARY["STORAGE_PATH"]
+        # {主题: {子主题: {"segment_ids": [...], "summary": str}}}
+        self.entries: Dict[str, Dict[str, Dict]] = {}
+        # store.lock保护entries（可能与I/O线程中的save同时访问）
+        self._store = JsonFileStore(self.storage_path, "子主题摘要")
+        self.load()
+
+    def get(self, theme: str, sub_theme: str) -> Optional[Dict]:
+        return self.entries.get(theme, {}).get(sub_theme)
+
+    def put(self, theme: str, sub_theme: str, segment_ids: List[str], summary: str):
+        """记录子主题摘要及其覆盖的片段（可能与I/O线程中的save同时进行，需持锁）"""
+        with self._store.lock:
+            self.entries.setdefault(theme, {})[sub_theme] = {
+                "segment_ids": list(segment_ids),
+                "summary": summary
+            }
+            self._store.dirty = True
+
+    def save(self):
+        """有修改时写入磁盘（可在I/O线程中调用）"""
+        self._store.save(lambda: {theme: dict(subs) for theme, subs in self.entries.items()})
+
+    def load(self):
+        """加载已保存的摘要"""
+        self.entries = self._store.load() or {}
@@ -1,14 +1,32 @@
 from typing import Dict, List, Optional
 from datetime import datetime
 from models.content_manager import ContentSegment, ThematicContent, SubTheme
+from core.sub_theme_clusterer import SubThemeClusterer
 from config.config import Config
+from utils.auto_save import ChangeTracker
+from utils.io_pool import run_io
 
 class ThemeManager:
-    def __init__(self):
+    def __init__(self,
+                 tracker: Optional[ChangeTracker] = None,
+                 clusterer: Optional[SubThemeClusterer] = None):
         self.themes: Dict[str, ThematicContent] = {}
+        # 记录修改过的主题，供增量保存使用
+        self.tracker = tracker
+        # 按嵌入向量在线聚类形成子主题，未提供时所有片段归入"general"
+        self.clusterer = clusterer
+        # 主题汇总信息，会话恢复时无需加载完整的内容片段
+        self.theme_stats: Dict[str, Dict] = {}
         self.config = Config.CONTENT_GENERATION
         self.theme_aspects = Config.THEME_STRUCTURE
         
+    async def get_theme(self, theme: str) -> Optional[ThematicContent]:
+        """取出主题内容，按需加载的主题在I/O线程中从磁盘读取，不存在时返回None"""
+        load = getattr(self.themes, "load", None)
+        if load is not None:
+            return await load(theme)
+        return self.themes.get(theme)
+        
     async def process_content(self, segment: ContentSegment) -> List[str]:
         """处理新的内容片段，返回需要生成内容的主题列表"""
         themes_to_generate = []
@@ -31,36 +49,65 @@ class ThemeManager:
         print(f"新内容: {segment.content}")
         
         # 确保主题存在
-        if theme not in self.themes:
-            self.themes[theme] = ThematicContent(
+        theme_content = await self.get_theme(theme)
+        if theme_content is None:
+            theme_content = ThematicContent(
                 main_theme=theme,
                 sub_themes={},
                 last_updated=datetime.now()
             )
+            self.themes[theme] = theme_content
+        # 先标记修改：更新期间（等待聚类等）主题不会被缓存淘汰
+        if self.tracker is not None:
+            self.tracker.mark("themes", theme)
         
         # 识别或创建子主题
-        sub_theme_name = await self._identify_sub_theme(theme, segment)
+        sub_theme_name = await self._identify_sub_theme(theme_content, segment)
         
         # 更新子主题
-        await self._update_sub_theme(theme, sub_theme_name, segment)
-        
-    async def _identify_sub_theme(self, theme: str, segment: ContentSegment) -> str:
-        """识别内容应该属于哪个子主题"""
-        # 使用预定义的主题结构
-        if theme in self.theme_aspects:
-            aspects = self.theme_aspects[theme]["required_aspects"]
-            
-            # 基于内容分析确定属于哪个方面
-            content = segment.content.lower()
-            if "成员" in content or "父母" in content or "姐姐" in content:
-                return "家庭成员"
-            elif "传统" in content or "节日" in content or "习俗" in content:
-                return "家庭传统"
-            elif "氛围" in content or "关系" in content or "和睦" in content:
-                return "家庭氛围"
-            else:
-                return "其他"
-        return "general"
+        await self._update_sub_theme(theme_content, sub_theme_name, segment)
+        theme_content.last_updated = datetime.now()
+        
+        # 更新主题汇总
+        stats = self.theme_stats.setdefault(theme, {"segment_count": 0, "word_count": 0})
+        stats["segment_count"] += 1
+        stats["word_count"] += self._count_chinese_words(segment.content)
+        stats["sub_themes"] = list(theme_content.sub_themes)
+        stats["last_updated"] = theme_content.last_updated.isoformat()
+        if self.tracker is not None:
+            self.tracker.mark("themes", theme)
+        
+    async def _identify_sub_theme(self, theme_content: ThematicContent, segment: ContentSegment) -> str:
+        """识别内容应该属于哪个子主题：归入嵌入向量最相近的子主题簇，必要时新建或合并子主题"""
+        if self.clusterer is None or not Config.SUB_THEMES["ENABLED"]:
+            return "general"
+        try:
+            sub_theme_name, merges = await self.clusterer.assign(theme_content.main_theme, segment)
+        except Exception as e:
+            print(f"子主题聚类失败: {e}")
+            return "general"
+        for source, target in merges:
+            self._merge_sub_themes(theme_content, source, target)
+        await run_io(self.clusterer.save)
+        return sub_theme_name
+        
+    def _merge_sub_themes(self, theme_content: ThematicContent, source: str, target: str):
+        """子主题簇合并后，把源子主题的片段和实体并入目标子主题"""
+        sub_themes = theme_content.sub_themes
+        merged = sub_themes.pop(source, None)
+        if merged is None:
+            return
+        if target not in sub_themes:
+            merged.name = target
+            sub_themes[target] = merged
+            return
+        kept = sub_themes[target]
+        kept.content_segments.extend(merged.content_segments)
+        kept.content_segments.sort(key=lambda seg: seg.timestamp)
+        kept.first_mentioned = min(kept.first_mentioned, merged.first_mentioned)
+        kept.last_updated = max(kept.last_updated, merged.last_updated)
+        for entity_type, entities in merged.related_entities.items():
+            kept.related_entities.setdefault(entity_type, set()).update(entities)
     
     def _count_chinese_words(self, text: str) -> int:
         """统计中文文本的字数"""
@@ -70,28 +117,33 @@ class ThemeManager:
         text = text.replace(' ', '')
         return len(text)
     
-    async def _update_sub_theme(self, theme: str, sub_theme_name: str, segment: ContentSegment):
+    async def _update_sub_theme(self, theme_content: ThematicContent, sub_theme_name: str, segment: ContentSegment):
         """更新子主题内容"""
-        theme_content = self.themes[theme]
         
-        # 第一阶段：简单地将所有内容存储在 "general" 子主题下
-        if "general" not in theme_content.sub_themes:
-            theme_content.sub_themes["general"] = SubTheme(
-                name="general",
+        if sub_theme_name not in theme_content.sub_themes:
+            theme_content.sub_themes[sub_theme_name] = SubTheme(
+                name=sub_theme_name,
                 content_segments=[],
                 first_mentioned=datetime.now(),
                 last_updated=datetime.now(),
-                related_entities={}  # 使用空字典，第二阶段再完善实体关联
+                related_entities={}
             )
         
         # 添加内容片段
-        sub_theme = theme_content.sub_themes["general"]
+        sub_theme = theme_content.sub_themes[sub_theme_name]
         sub_theme.content_segments.append(segment)
         sub_theme.last_updated = datetime.now()
+        
+        # 汇总子主题相关实体
+        for entity_type, entities in segment.entities.items():
+            if isinstance(entities, list):
+                sub_theme.related_entities.setdefault(entity_type, set()).update(entities)
     
     async def _check_generation_trigger(self, theme: str) -> bool:
         """检查是否需要为主题生成内容"""
-        theme_content = self.themes[theme]
+        theme_content = await self.get_theme(theme)
+        if theme_content is None:
+            return False
         
         # 1. 基础条件检查
         all_segments = []
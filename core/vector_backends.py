@@ -0,0 +1,564 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import numpy as np
+from core.record_table import RecordTable
+from config.config import Config
+
+COLLECTION_PREFIX = "memory_lane_"
+LEGACY_COLLECTION = "memory_lane"  # 分租户之前所有记忆共用的集合
+DEFAULT_TENANT = "default"
+
+# 检索结果：(ID, 内容, 元数据, 平方欧氏距离)
+QueryResult = Tuple[str, str, Dict, float]
+
+def collection_name(tenant: str) -> str:
+    """租户对应的集合名；不符合集合命名规则的租户ID取哈希"""
+    if re.fullmatch(r"[A-Za-z0-9]([A-Za-z0-9-]{0,48}[A-Za-z0-9])?", tenant):
+        return f"{COLLECTION_PREFIX}{tenant}"
+    return f"{COLLECTION_PREFIX}{hashlib.sha1(tenant.encode('utf-8')).hexdigest()[:20]}"
+
+def matches_where(where: Optional[Dict], metadata: Dict) -> bool:
+    """在Python中对元数据求值Chroma风格的where条件"""
+    if not where:
+        return True
+    if "$and" in where:
+        return all(matches_where(c, metadata) for c in where["$and"])
+    if "$or" in where:
+        return any(matches_where(c, metadata) for c in where["$or"])
+    for key, expected in where.items():
+        value = metadata.get(key)
+        if isinstance(expected, dict):
+            if "$gte" in expected and (value is None or value < expected["$gte"]):
+                return False
+            if "$lte" in expected and (value is None or value > expected["$lte"]):
+                return False
+        elif value != expected:
+            return False
+    return True
+
+class ChromaCollection:
+    """单个租户的Chroma集合（直接使用chromadb接口，由调用方提供向量）"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def add(self, ids: List[str], embeddings: List[List[float]], documents: List[str], metadatas: List[Dict]):
+        self.collection.upsert(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+
+    def delete(self, ids: List[str]):
+        self.collection.delete(ids=ids)
+
+    def query(self, embedding: List[float], k: int, where: Optional[Dict] = None) -> List[QueryResult]:
+        result = self.collection.query(
+            query_embeddings=[embedding],
+            n_results=k,
+            where=where,
+            include=["documents", "metadatas", "distances"]
+        )
+        return list(zip(result["ids"][0], result["documents"][0],
+                        result["metadatas"][0], result["distances"][0]))
+
+    def records(self) -> List[Dict[str, Any]]:
+        data = self.collection.get(include=["documents", "metadatas"])
+        return [
+            {"id": doc_id, "content": content, "metadata": metadata or {}}
+            for doc_id, content, metadata in zip(data["ids"], data["documents"], data["metadatas"])
+        ]
+
+    def count(self) -> int:
+        return self.collection.count()
+
+    def close(self):
+        pass
+
+class ChromaBackend:
+    """Chroma后端：每个租户一个集合，数据保存在SQLite中"""
+
+    name = "chroma"
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory or Config.VECTOR_STORE["PERSIST_DIRECTORY"]
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        """Chroma客户端，首次使用时才导入并打开"""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    import chromadb
+                    self._client = chromadb.PersistentClient(path=self.directory)
+        return self._client
+
+    def connect(self):
+        self.client
+
+    def open(self, tenant: str) -> ChromaCollection:
+        """打开租户的集合，不存在时创建"""
+        return ChromaCollection(self.client.get_or_create_collection(
+            collection_name(tenant), metadata={"tenant": tenant}
+        ))
+
+    def _names(self) -> List[str]:
+        return [c.name for c in self.client.list_collections()]
+
+    def exists(self, tenant: str) -> bool:
+        return collection_name(tenant) in self._names()
+
+    def tenants(self) -> List[str]:
+        return [
+            (c.metadata or {}).get("tenant", c.name[len(COLLECTION_PREFIX):])
+            for c in self.client.list_collections()
+            if c.name.startswith(COLLECTION_PREFIX)
+        ]
+
+    def drop(self, tenant: str):
+        self.client.delete_collection(collection_name(tenant))
+
+    def migrate_legacy(self, expand: Optional[Callable[[Dict], Dict]] = None) -> int:
+        """将分租户之前的共用集合按session_id拆分到各租户（复用已有向量，不重新嵌入）
+
+        expand为元数据补充可过滤字段，使迁移的记录同样可以按主题、实体和时间过滤。
+        """
+        if LEGACY_COLLECTION not in self._names():
+            return 0
+        legacy = self.client.get_collection(LEGACY_COLLECTION)
+        data = legacy.get(include=["embeddings", "documents", "metadatas"])
+        grouped: Dict[str, List[int]] = {}
+        for i, metadata in enumerate(data["metadatas"]):
+            tenant = (metadata or {}).get("session_id") or DEFAULT_TENANT
+            grouped.setdefault(tenant, []).append(i)
+        batch_size = self.client.get_max_batch_size()
+        for tenant, positions in grouped.items():
+            target = self.open(tenant)
+            for start in range(0, len(positions), batch_size):
+                batch = positions[start:start + batch_size]
+                target.add(
+                    ids=[data["ids"][i] for i in batch],
+                    embeddings=[data["embeddings"][i] for i in batch],
+                    documents=[data["documents"][i] for i in batch],
+                    metadatas=[
+                        expand(data["metadatas"][i]) if expand else data["metadatas"][i]
+                        for i in batch
+                    ]
+                )
+        self.client.delete_collection(LEGACY_COLLECTION)
+        print(f"已将 {len(data['ids'])} 条记忆迁移到 {len(grouped)} 个租户集合")
+        return len(data["ids"])
+
+VECTORS_FILE = "vectors.f32"
+NORMS_FILE = "norms.f32"
+SCAN_BLOCK = 512  # 量化向量分块反量化计算：块小到能留在CPU缓存中，也限制临时内存
+
+class ScalarQuantizer:
+    """标量量化
+
+    float16直接降低精度；int8按每个向量的最大绝对值缩放到[-127, 127]，缩放系数单独保存。
+    """
+
+    def __init__(self, mode: str):
+        if mode not in ("float16", "int8"):
+            raise ValueError(f"未知的量化方式: {mode}")
+        self.mode = mode
+
+    def sidecars(self, dim: int) -> Dict[str, Tuple[Any, int, Any]]:
+        """量化后需要逐行追加保存的数组：文件名 -> (数据类型, 每行元素数, 由全精度向量计算的函数)"""
+        if self.mode == "float16":
+            return {"vectors.float16": (np.float16, dim, lambda v: v.astype(np.float16))}
+        return {
+            "vectors.int8": (np.int8, dim, lambda v: np.rint(v / self._scales(v)[:, None]).astype(np.int8)),
+            "scales.f32": (np.float32, 1, self._scales)
+        }
+
+    @staticmethod
+    def _scales(vectors: np.ndarray) -> np.ndarray:
+        scales = np.abs(vectors).max(axis=1) / 127
+        scales[scales == 0] = 1.0
+        return scales.astype(np.float32)
+
+    def dot(self, views: Dict[str, np.ndarray], query: np.ndarray) -> np.ndarray:
+        """用量化向量近似计算与查询向量的内积"""
+        codes = views[f"vectors.{self.mode}"]
+        scores = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), SCAN_BLOCK):
+            block = codes[start:start + SCAN_BLOCK].astype(np.float32)
+            scores[start:start + SCAN_BLOCK] = block @ query
+        if self.mode == "int8":
+            scores *= views["scales.f32"]
+        return scores
+
+class LocalCollection:
+    """进程内的向量集合
+
+    向量按行追加到float32文件中并通过内存映射读取；内容和元数据保存在旁路记录表中，
+    元数据常驻内存用于过滤。删除和覆盖只把旧行标记为失效。规模较小时精确计算全部距离，
+    有效向量数超过阈值后建立HNSW图做近似检索（图在关闭时保存，之后新增的行在下次打开时补入）。
+    距离为平方欧氏距离，与Chroma默认的l2一致。
+
+    启用量化（float16/int8）时，精确检索先扫描量化向量选出k*RERANK_FACTOR个候选，
+    再读取这些候选的全精度向量重新排序，全精度文件只按需读取少量行。
+    """
+
+    def __init__(self, directory: str, tenant: str, config: Optional[Dict] = None):
+        self.directory = directory
+        self.tenant = tenant
+        self.config = config or Config.VECTOR_STORE
+        os.makedirs(directory, exist_ok=True)
+        self.vectors_path = os.path.join(directory, VECTORS_FILE)
+        self.graph_path = os.path.join(directory, "hnsw.bin")
+        self.meta_path = os.path.join(directory, "meta.json")
+        self.table = RecordTable(os.path.join(directory, "records.jsonl"))
+        self.dim: Optional[int] = None
+        quantization = self.config.get("QUANTIZATION", "none")
+        self.quantizer = None if quantization == "none" else ScalarQuantizer(quantization)
+        self.rows: Dict[str, int] = {}               # ID -> 行号
+        self.row_ids: List[Optional[str]] = []       # 行号 -> ID，失效行为None
+        self.metadatas: List[Optional[Dict]] = []    # 行号 -> 元数据，失效行为None
+        self.alive = np.zeros(0, dtype=bool)
+        self.norms = np.zeros(0, dtype=np.float32)   # 各行向量的平方范数
+        self._views: Dict[str, np.ndarray] = {}
+        self._graph = None
+        self._graph_saved_rows = 0
+        self._lock = threading.RLock()
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.meta_path):
+            self._write_meta()
+        with open(self.meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self.dim = meta.get("dim")
+        if self.dim is None:
+            return
+        # 异常退出时末尾可能有不完整的行（截掉）或没有记录的行（按失效处理）
+        num_rows = self._stored_rows(VECTORS_FILE, 4 * self.dim)
+        self.row_ids = [None] * num_rows
+        self.metadatas = [None] * num_rows
+        self.alive = np.zeros(num_rows, dtype=bool)
+        for record in self.table:
+            if record.get("deleted") or record["row"] >= num_rows:
+                continue
+            self.rows[record["id"]] = record["row"]
+            self.row_ids[record["row"]] = record["id"]
+            self.metadatas[record["row"]] = record["metadata"]
+            self.alive[record["row"]] = True
+
+        if meta.get("quantization", "none") != self._quantization:
+            # 量化方式改变：删除旧的量化数据，按当前方式从全精度向量重新生成
+            for name in ("vectors.float16", "vectors.int8", "scales.f32"):
+                if os.path.exists(os.path.join(self.directory, name)):
+                    os.remove(os.path.join(self.directory, name))
+        self._sync_sidecars(num_rows)
+        self.norms = np.array(self._view(NORMS_FILE))
+
+        self._graph_saved_rows = meta.get("graph_rows", 0)
+        self._write_meta()
+        if self._graph_saved_rows and os.path.exists(self.graph_path):
+            self._open_graph()
+        elif len(self.rows) >= self.config["HNSW_THRESHOLD"]:
+            self._build_graph()
+
+    @property
+    def _quantization(self) -> str:
+        return self.quantizer.mode if self.quantizer else "none"
+
+    def _sidecars(self) -> Dict[str, Tuple[Any, int, Any]]:
+        """随全精度向量逐行追加的派生数组（平方范数和量化数据）"""
+        sidecars = {NORMS_FILE: (np.float32, 1, lambda v: np.einsum('ij,ij->i', v, v))}
+        if self.quantizer:
+            sidecars.update(self.quantizer.sidecars(self.dim))
+        return sidecars
+
+    def _stored_rows(self, name: str, row_bytes: int, limit: Optional[int] = None) -> int:
+        """文件中完整的行数，截掉不完整的末行和超出limit的行"""
+        path = os.path.join(self.directory, name)
+        if not os.path.exists(path):
+            return 0
+        size = os.path.getsize(path)
+        rows = size // row_bytes
+        if limit is not None:
+            rows = min(rows, limit)
+        if size != rows * row_bytes:
+            os.truncate(path, rows * row_bytes)
+        return rows
+
+    def _sync_sidecars(self, num_rows: int):
+        """派生数组的行数与全精度向量对齐：缺少的行（旧数据或写入中断）从全精度向量补算"""
+        for name, (dtype, width, compute) in self._sidecars().items():
+            rows = self._stored_rows(name, np.dtype(dtype).itemsize * width, limit=num_rows)
+            if rows == num_rows:
+                continue
+            matrix = self._view(VECTORS_FILE)
+            with open(os.path.join(self.directory, name), 'ab') as f:
+                for start in range(rows, num_rows, SCAN_BLOCK):
+                    f.write(compute(np.asarray(matrix[start:min(start + SCAN_BLOCK, num_rows)])).tobytes())
+        self._views.clear()
+
+    def _write_meta(self):
+        with open(self.meta_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                "tenant": self.tenant,
+                "dim": self.dim,
+                "quantization": self._quantization,
+                "graph_rows": self._graph_saved_rows
+            }, f)
+
+    def _view(self, name: str) -> Optional[np.ndarray]:
+        """按行追加的数组文件的内存映射（行数变化后重新映射）"""
+        num_rows = len(self.metadatas)
+        if num_rows == 0:
+            return None
+        if name == VECTORS_FILE:
+            dtype, width = np.float32, self.dim
+        else:
+            dtype, width, _ = self._sidecars()[name]
+        view = self._views.get(name)
+        if view is None or view.shape[0] != num_rows:
+            shape = (num_rows, width) if width > 1 else (num_rows,)
+            view = np.memmap(os.path.join(self.directory, name), dtype=dtype, mode='r', shape=shape)
+            self._views[name] = view
+        return view
+
+    def _matrix_view(self):
+        """全部全精度向量的内存映射"""
+        return self._view(VECTORS_FILE)
+
+    @staticmethod
+    def _hnswlib():
+        try:
+            import hnswlib
+            return hnswlib
+        except ImportError as e:
+            print(f"hnswlib不可用，继续使用精确检索: {e}")
+            return None
+
+    def _new_graph(self, hnswlib, capacity: int):
+        graph = hnswlib.Index(space='l2', dim=self.dim)
+        graph.init_index(
+            max_elements=capacity,
+            ef_construction=self.config["HNSW_EF_CONSTRUCTION"],
+            M=self.config["HNSW_M"]
+        )
+        return graph
+
+    def _build_graph(self):
+        hnswlib = self._hnswlib()
+        if hnswlib is None:
+            return
+        num_rows = len(self.metadatas)
+        graph = self._new_graph(hnswlib, max(2 * num_rows, 1024))
+        graph.add_items(self._matrix_view(), np.arange(num_rows))
+        for row in np.flatnonzero(~self.alive):
+            graph.mark_deleted(int(row))
+        graph.set_ef(self.config["HNSW_EF_SEARCH"])
+        self._graph = graph
+        self._graph_saved_rows = 0
+
+    def _open_graph(self):
+        hnswlib = self._hnswlib()
+        if hnswlib is None:
+            return
+        num_rows = len(self.metadatas)
+        graph = hnswlib.Index(space='l2', dim=self.dim)
+        graph.load_index(self.graph_path, max_elements=max(2 * num_rows, 1024))
+        saved_rows = min(self._graph_saved_rows, num_rows)
+        if num_rows > saved_rows:
+            graph.add_items(self._matrix_view()[saved_rows:], np.arange(saved_rows, num_rows))
+        deleted = set(graph.get_ids_list()) - set(np.flatnonzero(self.alive).tolist())
+        for row in deleted:
+            self._mark_deleted(graph, row)
+        graph.set_ef(self.config["HNSW_EF_SEARCH"])
+        self._graph = graph
+
+    @staticmethod
+    def _mark_deleted(graph, row: int):
+        try:
+            graph.mark_deleted(int(row))
+        except RuntimeError:
+            pass  # 已标记删除
+
+    def _invalidate(self, row: int):
+        self.row_ids[row] = None
+        self.metadatas[row] = None
+        self.alive[row] = False
+        if self._graph is not None:
+            self._mark_deleted(self._graph, row)
+
+    def add(self, ids: List[str], embeddings: List[List[float]], documents: List[str], metadatas: List[Dict]):
+        """追加向量；已存在的ID先使旧行失效"""
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        with self._lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                self._write_meta()
+            start = len(self.metadatas)
+            for doc_id in ids:
+                if doc_id in self.rows:
+                    self._invalidate(self.rows.pop(doc_id))
+            # 先写向量再写记录，异常退出时多出的行没有记录，加载时按失效处理
+            with open(self.vectors_path, 'ab') as f:
+                f.write(vectors.tobytes())
+            sidecar_values = {}
+            for name, (_, _, compute) in self._sidecars().items():
+                sidecar_values[name] = compute(vectors)
+                with open(os.path.join(self.directory, name), 'ab') as f:
+                    f.write(sidecar_values[name].tobytes())
+            self.table.append_many([
+                {"id": doc_id, "row": start + i, "document": document, "metadata": metadata}
+                for i, (doc_id, document, metadata) in enumerate(zip(ids, documents, metadatas))
+            ])
+            for i, (doc_id, metadata) in enumerate(zip(ids, metadatas)):
+                self.rows[doc_id] = start + i
+                self.row_ids.append(doc_id)
+                self.metadatas.append(metadata)
+            self.alive = np.concatenate([self.alive, np.ones(len(ids), dtype=bool)])
+            self.norms = np.concatenate([self.norms, sidecar_values[NORMS_FILE]])
+
+            if self._graph is not None:
+                needed = len(self.metadatas)
+                if needed > self._graph.get_max_elements():
+                    self._graph.resize_index(2 * needed)
+                self._graph.add_items(vectors, np.arange(start, start + len(ids)))
+            elif len(self.rows) >= self.config["HNSW_THRESHOLD"]:
+                self._build_graph()
+
+    def delete(self, ids: List[str]):
+        with self._lock:
+            deleted = [doc_id for doc_id in ids if doc_id in self.rows]
+            for doc_id in deleted:
+                self._invalidate(self.rows.pop(doc_id))
+            self.table.append_many([{"id": doc_id, "deleted": True} for doc_id in deleted])
+
+    def query(self, embedding: List[float], k: int, where: Optional[Dict] = None) -> List[QueryResult]:
+        query = np.asarray(embedding, dtype=np.float32)
+        with self._lock:
+            if not self.rows:
+                return []
+            k = min(k, len(self.rows))
+            if self._graph is not None:
+                hits = self._query_graph(query, k, where)
+                if hits is not None:
+                    return self._results(hits)
+            # 精确检索：复制当前的行状态，计算不持锁
+            metadatas = self.metadatas
+            alive = self.alive.copy()
+            norms = self.norms
+            matrix = self._matrix_view()
+            views = {name: self._view(name) for name in self._sidecars()}
+
+        if where:
+            for row in np.flatnonzero(alive):
+                if not matches_where(where, metadatas[row]):
+                    alive[row] = False
+        candidates = int(alive.sum())
+        if candidates == 0:
+            return []
+        norms = norms[:len(alive)]
+        if self.quantizer is None:
+            # 整块矩阵乘一次比按行取子集（复制）更快，失效和被过滤的行置为无穷远
+            distances = norms - 2 * (matrix @ query) + query @ query
+            distances[~alive] = np.inf
+            rows = np.arange(len(alive))
+        else:
+            # 用量化向量粗排，只对候选读取全精度向量重新计算距离
+            approx = norms - 2 * self.quantizer.dot(views, query) + query @ query
+            approx[~alive] = np.inf
+            num_candidates = min(k * self.config["RERANK_FACTOR"], candidates)
+            rows = np.sort(np.argpartition(approx, num_candidates - 1)[:num_candidates])
+            distances = norms[rows] - 2 * (matrix[rows] @ query) + query @ query
+        k = min(k, candidates)
+        top = np.argpartition(distances, k - 1)[:k]
+        top = top[np.argsort(distances[top])]
+        return self._results([(int(rows[i]), float(max(distances[i], 0.0))) for i in top])
+
+    def _query_graph(self, query, k: int, where: Optional[Dict]) -> Optional[List[Tuple[int, float]]]:
+        """HNSW近似检索；过滤后不足k条时返回None，改为精确检索"""
+        metadatas = self.metadatas
+        row_filter = None
+        if where:
+            row_filter = lambda row: metadatas[row] is not None and matches_where(where, metadatas[row])
+        try:
+            labels, distances = self._graph.knn_query(query, k=k, filter=row_filter)
+        except RuntimeError:
+            return None
+        return [(int(row), float(distance)) for row, distance in zip(labels[0], distances[0])]
+
+    def _results(self, hits: List[Tuple[int, float]]) -> List[QueryResult]:
+        """按行号从记录表读取内容和元数据"""
+        results = []
+        for row, distance in hits:
+            doc_id = self.row_ids[row]
+            if doc_id is None:
+                continue
+            record = self.table.get(doc_id)
+            results.append((doc_id, record["document"], record["metadata"], distance))
+        return results
+
+    def records(self) -> List[Dict[str, Any]]:
+        return [
+            {"id": record["id"], "content": record["document"], "metadata": record["metadata"]}
+            for record in self.table
+            if not record.get("deleted") and record["id"] in self.rows
+        ]
+
+    def count(self) -> int:
+        return len(self.rows)
+
+    def close(self):
+        """保存HNSW图并关闭文件"""
+        with self._lock:
+            if self._graph is not None and self._graph_saved_rows != len(self.metadatas):
+                self._graph.save_index(self.graph_path)
+                self._graph_saved_rows = len(self.metadatas)
+                self._write_meta()
+            self.table.close()
+            self._views.clear()
+
+class LocalBackend:
+    """进程内后端：每个租户一个目录，不依赖数据库服务"""
+
+    name = "local"
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory or Config.VECTOR_STORE["LOCAL_DIRECTORY"]
+
+    def connect(self):
+        os.makedirs(self.directory, exist_ok=True)
+
+    def open(self, tenant: str) -> LocalCollection:
+        return LocalCollection(os.path.join(self.directory, collection_name(tenant)), tenant)
+
+    def exists(self, tenant: str) -> bool:
+        return os.path.isdir(os.path.join(self.directory, collection_name(tenant)))
+
+    def tenants(self) -> List[str]:
+        if not os.path.isdir(self.directory):
+            return []
+        tenants = []
+        for name in os.listdir(self.directory):
+            meta_path = os.path.join(self.directory, name, "meta.json")
+            if name.startswith(COLLECTION_PREFIX) and os.path.exists(meta_path):
+                with open(meta_path, 'r', encoding='utf-8') as f:
+                    tenants.append(json.load(f).get("tenant", name[len(COLLECTION_PREFIX):]))
+        return tenants
+
+    def drop(self, tenant: str):
+        shutil.rmtree(os.path.join(self.directory, collection_name(tenant)), ignore_errors=True)
+
+    def migrate_legacy(self, expand: Optional[Callable[[Dict], Dict]] = None) -> int:
+        return 0
+
+BACKENDS = {
+    "chroma": ChromaBackend,
+    "local": LocalBackend,
+}
+
+def get_backend(name: str, directory: Optional[str] = None):
+    """按名称创建向量库后端"""
+    return BACKENDS[name](directory)
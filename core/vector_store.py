@@ -1,19 +1,211 @@
-from langchain_community.vectorstores import Chroma
-from langchain_community.embeddings import ZhipuAIEmbeddings
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Union, TYPE_CHECKING
+from datetime import datetime
+import asyncio
+import functools
 import json
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from core.lexical_index import BigramIndex
+from core.vector_backends import DEFAULT_TENANT, collection_name, get_backend, matches_where
+from config.config import Config
+from utils.usage_tracker import usage_tracker
+
+if TYPE_CHECKING:
+    from langchain_community.embeddings import ZhipuAIEmbeddings
+
+THEME_PREFIX = "theme_"
+ENTITY_PREFIX = "entity_"
 
 class VectorStoreManager:
-    def __init__(self, embeddings: ZhipuAIEmbeddings):
+    """向量库管理
+
+    向量的存取由可替换的后端完成（见core/vector_backends.py）：默认Chroma，
+    或进程内的NumPy/HNSW索引；嵌入由本类计算后交给后端。
+
+    记忆按租户（会话）分片：每个租户一个集合和一个词法索引，检索只涉及该租户
+    自己的记忆，删除租户时直接删除其集合和索引文件。打开的集合和词法索引放在有界的
+    LRU池中，超出容量时关闭最久未使用的。
+
+    嵌入走HTTP、索引读写磁盘，都是同步调用，这里统一放到专用线程池中执行，
+    不阻塞事件循环。并发数由信号量限制，排队中的请求被取消时不会占用线程；
+    嵌入和检索可以并发进行，写入索引串行执行。词法索引的读写（含首次加载）也在线程池中串行执行。
+    """
+
+    def __init__(self,
+                 embeddings: 'ZhipuAIEmbeddings',
+                 max_concurrency: Optional[int] = None,
+                 persist_directory: Optional[str] = None,
+                 lexical_dir: Optional[str] = None,
+                 tenant: str = DEFAULT_TENANT,
+                 max_open_collections: Optional[int] = None,
+                 backend: Optional[str] = None):
+        """lexical_dir为空字符串时词法索引只保存在内存中；persist_directory为后端的数据目录"""
+        self.config = Config.VECTOR_STORE
         self.embeddings = embeddings
-        self.vector_store = Chroma(
-            collection_name="memory_lane",
-            embedding_function=embeddings,
-            persist_directory="./chroma_db"
+        self.tenant = tenant
+        self.backend = get_backend(backend or self.config["BACKEND"], persist_directory)
+        self.lexical_dir = Config.LEXICAL_INDEX["TENANT_DIR"] if lexical_dir is None else lexical_dir
+        self.max_open_collections = max_open_collections or self.config["MAX_OPEN_COLLECTIONS"]
+        self._collections: OrderedDict = OrderedDict()      # 租户 -> 后端集合
+        self._lexical_indexes: OrderedDict = OrderedDict()  # 租户 -> 词法索引
+        self._recent_embeddings: OrderedDict = OrderedDict()  # 记忆ID -> 写入时计算的向量
+        self._pool_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._lexical_lock = threading.Lock()
+        self._open_task: Optional[asyncio.Task] = None
+        max_concurrency = max_concurrency or self.config["MAX_CONCURRENCY"]
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrency,
+            thread_name_prefix="vector-store"
         )
-    
-    async def add_memory(self, text: str, metadata: Dict):
-        """添加记忆到向量存储"""
+
+    @property
+    def vector_store(self):
+        """当前租户的集合"""
+        return self.collection(self.tenant)
+
+    @property
+    def lexical_index(self) -> BigramIndex:
+        """当前租户的词法索引"""
+        return self.lexical_index_for(self.tenant)
+
+    def collection(self, tenant: str):
+        """从集合池中取出租户的集合，不在池中时打开（不存在时创建）"""
+        return self._pooled(self._collections, tenant, lambda: self.backend.open(tenant))
+
+    def lexical_index_for(self, tenant: str) -> BigramIndex:
+        """从池中取出租户的词法索引（首次检索时才从磁盘加载）"""
+        return self._pooled(self._lexical_indexes, tenant, lambda: BigramIndex(
+            storage_path=self._lexical_path(tenant)
+        ))
+
+    def _lexical_path(self, tenant: str) -> str:
+        if not self.lexical_dir:
+            return ""
+        return os.path.join(self.lexical_dir, f"{collection_name(tenant)}.jsonl")
+
+    def _pooled(self, pool: OrderedDict, tenant: str, open_func):
+        with self._pool_lock:
+            if tenant in pool:
+                pool.move_to_end(tenant)
+                return pool[tenant]
+            pool[tenant] = open_func()
+            while len(pool) > self.max_open_collections:
+                _, evicted = pool.popitem(last=False)
+                if hasattr(evicted, "close"):
+                    evicted.close()
+            return pool[tenant]
+
+    def open_in_background(self) -> asyncio.Task:
+        """在后台线程中打开向量库（并迁移分租户之前的数据），不阻塞事件循环"""
+        if self._open_task is None:
+            def open_backend():
+                self.backend.connect()
+                if self.config["MIGRATE_LEGACY"]:
+                    self.migrate_legacy()
+            self._open_task = asyncio.create_task(asyncio.to_thread(open_backend))
+        return self._open_task
+
+    async def _get_vector_store(self, tenant: Optional[str] = None):
+        """获取租户的集合；后台打开尚未完成时等待其完成"""
+        if self._open_task is not None and not self._open_task.done():
+            await self._open_task
+        tenant = tenant or self.tenant
+        with self._pool_lock:
+            if tenant in self._collections:
+                self._collections.move_to_end(tenant)
+                return self._collections[tenant]
+        return await self._run(self.collection, tenant)
+
+    async def _run(self, func, *args, **kwargs):
+        """在向量库线程池中执行同步调用，同时进行的调用数不超过max_concurrency"""
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._executor, functools.partial(func, *args, **kwargs)
+            )
+
+    def _add_texts(self, collection, texts: List[str], metadatas: List[Dict], ids: List[str],
+                   embeddings: Optional[List[List[float]]] = None):
+        """计算嵌入（可并发）后写入集合（串行）；已有向量时直接写入"""
+        if embeddings is None:
+            embeddings = self.embeddings.embed_documents(texts)
+            usage_tracker.record_embedding(self._embedding_model(), texts)
+        with self._write_lock:
+            collection.add(ids=ids, embeddings=embeddings, documents=texts, metadatas=metadatas)
+            for doc_id, embedding in zip(ids, embeddings):
+                self._recent_embeddings[doc_id] = embedding
+                self._recent_embeddings.move_to_end(doc_id)
+            while len(self._recent_embeddings) > self.config["RECENT_EMBEDDINGS"]:
+                self._recent_embeddings.popitem(last=False)
+
+    def _lexical_add(self, tenant: str, doc_id: str, text: str, metadata: Dict):
+        with self._lexical_lock:
+            self.lexical_index_for(tenant).add(doc_id, text, metadata)
+
+    def _lexical_search(self, tenant: str, query: str, k: int, predicate) -> List[Dict[str, Any]]:
+        with self._lexical_lock:
+            return self.lexical_index_for(tenant).search(query, k=k, predicate=predicate)
+
+    def _query(self, collection, query: str, k: int, where: Optional[Dict]):
+        return collection.query(self._embed_query(query), k, where)
+
+    def _embed_query(self, text: str) -> List[float]:
+        embedding = self.embeddings.embed_query(text)
+        usage_tracker.record_embedding(self._embedding_model(), [text])
+        return embedding
+
+    async def embedding_for(self, text: str, doc_id: Optional[str] = None) -> List[float]:
+        """文本的嵌入向量；刚写入的记忆直接复用写入时计算的向量"""
+        with self._write_lock:
+            embedding = self._recent_embeddings.get(doc_id)
+        if embedding is not None:
+            return list(embedding)
+        return await self._run(self._embed_query, text)
+
+    def _embedding_model(self) -> str:
+        model = getattr(self.embeddings, "model", None)
+        return model if isinstance(model, str) else ""
+
+    def migrate_legacy(self):
+        """将分租户之前共用集合和词法索引中的记忆按session_id拆分到各租户（复用已有向量，不重新嵌入）"""
+        with self._write_lock:
+            try:
+                self.backend.migrate_legacy(self._expand_legacy_metadata)
+
+                legacy_path = Config.LEXICAL_INDEX["STORAGE_PATH"]
+                if self.lexical_dir and os.path.exists(legacy_path):
+                    legacy_index = BigramIndex(storage_path=legacy_path)
+                    legacy_index._ensure_loaded()
+                    for doc_id, document in zip(legacy_index.doc_ids, legacy_index.documents):
+                        if document is None:
+                            continue
+                        tenant = document["metadata"].get("session_id") or DEFAULT_TENANT
+                        BigramIndex(storage_path=self._lexical_path(tenant))._append({
+                            "id": doc_id, **document,
+                            "metadata": self._expand_legacy_metadata(document["metadata"])
+                        })
+                    os.replace(legacy_path, f"{legacy_path}.migrated")
+            except Exception as e:
+                print(f"向量库迁移失败: {e}")
+
+    def close(self):
+        """关闭池中的集合（进程内后端此时保存HNSW图）"""
+        with self._pool_lock:
+            for collection in self._collections.values():
+                collection.close()
+            self._collections.clear()
+
+    async def add_memory(self, text: str, metadata: Dict, tenant: Optional[str] = None,
+                         embedding: Optional[List[float]] = None):
+        """添加记忆到租户的向量存储；未指定租户时按记忆的session_id，再退回当前租户
+
+        ID已存在时覆盖原记录（用于更新元数据），此时可传入原有的向量避免重新嵌入。
+        """
         try:
             formatted_metadata = {
                 "id": metadata.get("id"),
@@ -21,31 +213,283 @@ class VectorStoreManager:
                 "themes": ",".join(metadata.get("themes", [])),
                 "entities": json.dumps(metadata.get("entities", {})),
                 "keywords": ",".join(metadata.get("keywords", [])),
-                "dialogue_id": metadata.get("dialogue_id")
+                "dialogue_id": metadata.get("dialogue_id"),
+                "session_id": metadata.get("session_id")
+            }
+            formatted_metadata.update(self._filterable_metadata(metadata))
+            # Chroma不接受None值
+            formatted_metadata = {
+                key: value for key, value in formatted_metadata.items()
+                if value is not None
             }
-            
-            self.vector_store.add_texts(
-                texts=[text],
-                metadatas=[formatted_metadata]
+
+            tenant = tenant or metadata.get("session_id") or self.tenant
+            doc_id = formatted_metadata.get("id") or str(uuid.uuid4())
+            vector_store = await self._get_vector_store(tenant)
+            await self._run(
+                self._add_texts, vector_store, [text], [formatted_metadata], [doc_id],
+                [embedding] if embedding is not None else None
             )
+            await self._run(self._lexical_add, tenant, doc_id, text, formatted_metadata)
             return True
         except Exception as e:
             print(f"存储失败: {e}")
             return False
-    
+
+    def _filterable_metadata(self, metadata: Dict) -> Dict:
+        """将主题、实体和时间展开为可在where子句中过滤的标量字段"""
+        filterable = {}
+        for theme in metadata.get("themes", []):
+            filterable[f"{THEME_PREFIX}{theme}"] = True
+        for entities in metadata.get("entities", {}).values():
+            if not isinstance(entities, list):
+                continue
+            for entity in entities:
+                filterable[f"{ENTITY_PREFIX}{entity}"] = True
+        if metadata.get("timestamp"):
+            filterable["ts"] = self._to_epoch(metadata["timestamp"])
+        return filterable
+
+    def _expand_legacy_metadata(self, stored: Dict) -> Dict:
+        """为早期写入的记录补充可过滤字段（早期只保存了序列化的themes、entities和timestamp）"""
+        stored = dict(stored or {})
+        try:
+            entities = json.loads(stored.get("entities") or "{}")
+        except (json.JSONDecodeError, TypeError):
+            entities = {}
+        metadata = {
+            "themes": [theme for theme in (stored.get("themes") or "").split(",") if theme],
+            "entities": entities if isinstance(entities, dict) else {},
+            "timestamp": stored.get("timestamp")
+        }
+        try:
+            stored.update(self._filterable_metadata(metadata))
+        except (TypeError, ValueError):
+            # 时间格式无法解析时只展开主题和实体
+            stored.update(self._filterable_metadata({**metadata, "timestamp": None}))
+        return stored
+
+    @staticmethod
+    def _to_epoch(value: Union[str, datetime]) -> float:
+        if isinstance(value, str):
+            value = datetime.fromisoformat(value)
+        return value.timestamp()
+
+    def _build_where(self,
+                     themes: Optional[List[str]] = None,
+                     entities: Optional[List[str]] = None,
+                     start_time: Optional[Union[str, datetime]] = None,
+                     end_time: Optional[Union[str, datetime]] = None,
+                     session_id: Optional[str] = None,
+                     dialogue_id: Optional[str] = None) -> Optional[Dict]:
+        """构建Chroma的where过滤条件，未指定任何条件时返回None"""
+
+        def any_of(conditions: List[Dict]) -> Dict:
+            return conditions[0] if len(conditions) == 1 else {"$or": conditions}
+
+        conditions = []
+        if themes:
+            conditions.append(any_of([{f"{THEME_PREFIX}{t}": True} for t in themes]))
+        if entities:
+            conditions.append(any_of([{f"{ENTITY_PREFIX}{e}": True} for e in entities]))
+        if start_time is not None:
+            conditions.append({"ts": {"$gte": self._to_epoch(start_time)}})
+        if end_time is not None:
+            conditions.append({"ts": {"$lte": self._to_epoch(end_time)}})
+        if session_id:
+            conditions.append({"session_id": session_id})
+        if dialogue_id:
+            conditions.append({"dialogue_id": dialogue_id})
+
+        if not conditions:
+            return None
+        return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
     async def calculate_similarity(self, text1: str, text2: str) -> float:
         """改进相似度计算"""
         # 添加预处理
         # 考虑语义特征
         # 优化阈值设置
-    
-    async def search_similar(self, query: str, k: int = 3) -> List[Dict[str, Any]]:
-        """搜索相似的记忆，返回内容和相似度分数"""
-        results = self.vector_store.similarity_search_with_score(query, k=k)
+
+    async def search_similar(self,
+                             query: str,
+                             k: int = 3,
+                             themes: Optional[List[str]] = None,
+                             entities: Optional[List[str]] = None,
+                             start_time: Optional[Union[str, datetime]] = None,
+                             end_time: Optional[Union[str, datetime]] = None,
+                             session_id: Optional[str] = None,
+                             dialogue_id: Optional[str] = None,
+                             tenant: Optional[str] = None) -> List[Dict[str, Any]]:
+        """在租户的记忆中搜索相似内容，返回内容和相似度分数
+
+        未指定租户时按session_id，再退回当前租户。themes和entities为"任一匹配"，
+        各类条件之间为"同时满足"，所有条件都下推到向量库的where子句中执行。
+        """
+        where = self._build_where(
+            themes=themes,
+            entities=entities,
+            start_time=start_time,
+            end_time=end_time,
+            session_id=session_id,
+            dialogue_id=dialogue_id
+        )
+        collection = await self._get_vector_store(tenant or session_id)
+        results = await self._run(self._query, collection, query, k, where)
+        return [
+            {
+                'content': content,
+                'score': distance,
+                'metadata': metadata
+            } for _, content, metadata, distance in results
+        ]
+
+    async def search_lexical(self,
+                             query: str,
+                             k: int = 3,
+                             tenant: Optional[str] = None,
+                             **filters) -> List[Dict[str, Any]]:
+        """基于二元组倒排索引的BM25检索，不调用嵌入API"""
+        where = self._build_where(**filters)
+        predicate = None
+        if where:
+            predicate = lambda metadata: matches_where(where, metadata)
+        tenant = tenant or filters.get("session_id") or self.tenant
+        results = await self._run(self._lexical_search, tenant, query, k, predicate)
         return [
             {
-                'content': doc.page_content,
-                'score': score,
-                'metadata': doc.metadata
-            } for doc, score in results
-        ] 
\ No newline at end of file
+                'content': result['content'],
+                'score': result['score'],
+                'metadata': result['metadata']
+            } for result in results
+        ]
+
+    async def search_hybrid(self,
+                            query: str,
+                            k: int = 3,
+                            mode: str = "hybrid",
+                            alpha: Optional[float] = None,
+                            **filters) -> List[Dict[str, Any]]:
+        """混合检索：融合BM25与向量相似度
+
+        mode: "hybrid" 融合两路结果；"lexical" 仅词法检索（无API调用）；
+        "vector" 仅向量检索（score为原始距离）。其余模式的score越大越相关。
+        """
+        if mode == "lexical":
+            return await self.search_lexical(query, k=k, **filters)
+        if mode == "vector":
+            return await self.search_similar(query, k=k, **filters)
+
+        alpha = Config.LEXICAL_INDEX["HYBRID_ALPHA"] if alpha is None else alpha
+        candidates = k * Config.LEXICAL_INDEX["CANDIDATE_MULTIPLIER"]
+        # 两路检索都在线程池中并发进行（词法检索经_run在_lexical_lock下执行），事件循环只负责等待和融合
+        vector_task = asyncio.ensure_future(self.search_similar(query, k=candidates, **filters))
+        try:
+            lexical_results = await self.search_lexical(query, k=candidates, **filters)
+        except BaseException:
+            vector_task.cancel()
+            raise
+        vector_results = await vector_task
+
+        # 向量检索返回的是距离，转换为相似度后再归一化
+        lexical_scores = self._normalize({
+            self._result_key(r): r['score'] for r in lexical_results
+        })
+        vector_scores = self._normalize({
+            self._result_key(r): 1 / (1 + r['score']) for r in vector_results
+        })
+
+        merged = {}
+        for result in lexical_results + vector_results:
+            merged.setdefault(self._result_key(result), result)
+
+        fused = []
+        for key, result in merged.items():
+            fused.append({
+                'content': result['content'],
+                'score': alpha * vector_scores.get(key, 0.0) + (1 - alpha) * lexical_scores.get(key, 0.0),
+                'lexical_score': lexical_scores.get(key, 0.0),
+                'vector_score': vector_scores.get(key, 0.0),
+                'metadata': result['metadata']
+            })
+        fused.sort(key=lambda r: r['score'], reverse=True)
+        return fused[:k]
+
+    async def list_tenants(self) -> List[str]:
+        """已有记忆集合的租户"""
+        return await self._run(self.backend.tenants)
+
+    async def tenant_stats(self, tenant: Optional[str] = None) -> Dict[str, Any]:
+        """租户的记忆条数、词法索引文档数和是否在集合池中"""
+        tenant = tenant or self.tenant
+
+        def stats_sync():
+            exists = self.backend.exists(tenant)
+            lexical_path = self._lexical_path(tenant)
+            with self._lexical_lock:
+                lexical_documents = len(self.lexical_index_for(tenant))
+            return {
+                "tenant": tenant,
+                "collection": collection_name(tenant),
+                "documents": self.collection(tenant).count() if exists else 0,
+                "lexical_documents": lexical_documents,
+                "lexical_bytes": os.path.getsize(lexical_path) if lexical_path and os.path.exists(lexical_path) else 0,
+                "open": tenant in self._collections
+            }
+        return await self._run(stats_sync)
+
+    async def export_tenant(self, tenant: Optional[str] = None, path: Optional[str] = None) -> List[Dict[str, Any]]:
+        """导出租户的全部记忆（ID、内容、元数据）；指定path时同时写入JSONL文件"""
+        tenant = tenant or self.tenant
+
+        def export_sync():
+            if not self.backend.exists(tenant):
+                return []
+            records = self.collection(tenant).records()
+            if path:
+                directory = os.path.dirname(path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with open(path, 'w', encoding='utf-8') as f:
+                    for record in records:
+                        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            return records
+        return await self._run(export_sync)
+
+    async def delete_tenant(self, tenant: str) -> bool:
+        """删除租户的集合和词法索引，不涉及其他租户的数据；租户不存在时返回False"""
+        def delete_sync():
+            with self._write_lock:
+                with self._pool_lock:
+                    collection = self._collections.pop(tenant, None)
+                    self._lexical_indexes.pop(tenant, None)
+                if collection is not None:
+                    collection.close()
+                existed = False
+                if self.backend.exists(tenant):
+                    self.backend.drop(tenant)
+                    existed = True
+                lexical_path = self._lexical_path(tenant)
+                if lexical_path and os.path.exists(lexical_path):
+                    os.remove(lexical_path)
+                    existed = True
+                return existed
+        try:
+            return await self._run(delete_sync)
+        except Exception as e:
+            print(f"删除租户数据失败: {e}")
+            return False
+
+    @staticmethod
+    def _result_key(result: Dict) -> str:
+        return result['metadata'].get('id') or result['content']
+
+    @staticmethod
+    def _normalize(scores: Dict[str, float]) -> Dict[str, float]:
+        """最小-最大归一化到[0, 1]"""
+        if not scores:
+            return {}
+        low, high = min(scores.values()), max(scores.values())
+        if high == low:
+            return {key: 1.0 for key in scores}
+        return {key: (score - low) / (high - low) for key, score in scores.items()}
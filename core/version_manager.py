@@ -1,8 +1,10 @@
+import asyncio
 import json
 import os
 from typing import Dict, List, Optional
 from datetime import datetime
 import shutil
+from utils.io_pool import run_io
 
 class VersionManager:
     def __init__(self, base_dir: str = "./data"):
@@ -19,9 +21,18 @@ class VersionManager:
                             generated_contents: Dict[str, str],
                             theme_data: Dict,
                             description: str = "") -> str:
-        """创建数据快照"""
+        """创建数据快照（序列化和写入在I/O线程池中进行）"""
+        return await run_io(
+            self.write_snapshot, dialogue_history, generated_contents, theme_data, description
+        )
+        
+    def write_snapshot(self,
+                       dialogue_history: List[Dict],
+                       generated_contents: Dict[str, str],
+                       theme_data: Dict,
+                       description: str = "") -> str:
         # 生成版本ID
-        version_id = datetime.now().strftime("%Y%m%d_%H%M%S")
+        version_id = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
         version_dir = f"{self.versions_dir}/{version_id}"
         
         try:
@@ -59,6 +70,9 @@ class VersionManager:
             
     async def list_versions(self) -> List[Dict]:
         """列出所有可用的版本"""
+        return await run_io(self.read_versions)
+        
+    def read_versions(self) -> List[Dict]:
         versions = []
         for version_id in os.listdir(self.versions_dir):
             info_file = f"{self.versions_dir}/{version_id}/version_info.json"
@@ -73,6 +87,9 @@ class VersionManager:
         
     async def restore_version(self, version_id: str) -> Dict:
         """恢复到指定版本"""
+        return await run_io(self.read_version, version_id)
+        
+    def read_version(self, version_id: str) -> Dict:
         version_dir = f"{self.versions_dir}/{version_id}"
         
         if not os.path.exists(version_dir):
@@ -102,8 +119,10 @@ class VersionManager:
                              version_id1: str, 
                              version_id2: str) -> Dict:
         """比较两个版本的差异"""
-        v1_data = await self.restore_version(version_id1)
-        v2_data = await self.restore_version(version_id2)
+        v1_data, v2_data = await asyncio.gather(
+            self.restore_version(version_id1),
+            self.restore_version(version_id2)
+        )
         
         differences = {
             "dialogue_history": {
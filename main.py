@@ -1,52 +1,121 @@
 import os
 from dotenv import load_dotenv, find_dotenv
-from langchain_community.chat_models import ChatZhipuAI
-from langchain_community.embeddings import ZhipuAIEmbeddings
 from core.dialogue_manager import DialogueManager
 from core.vector_store import VectorStoreManager
 from core.content_processor import ContentProcessor
 from core.theme_manager import ThemeManager
 from core.content_generator import ContentGenerator
+from core.biography_compiler import BiographyCompiler
+from core.knowledge_graph import KnowledgeGraph
+from core.summary_cache import SummaryCache
+from core.sub_theme_clusterer import SubThemeClusterer
+from core.generation_cache import GenerationCache
+from core.memory_prefetcher import MemoryPrefetcher
+from core.storage_manager import StorageManager
+from config.config import Config
 from models.schemas import DialogueContext, DialogueTurn
-from typing import List, Dict
+from utils.lazy import LazyObject
+from utils.lru_cache import LazyLRUDict
+from utils.json_parser import ResponseParser
+from utils.auto_save import AutoSaver, ChangeTracker
+from utils.api_manager import api_manager
+from typing import Dict, List
+from datetime import datetime
+import asyncio
+import copy
 import uuid
 
+def _chat_model(model_env: str, key_env: str, model: str = None) -> LazyObject:
+    """首次调用时才导入并构建的智谱对话模型（指定model时不读取model_env）"""
+    def build():
+        from langchain_community.chat_models import ChatZhipuAI
+        return ChatZhipuAI(
+            model=model or os.getenv(model_env),
+            api_key=os.getenv(key_env)
+        )
+    return LazyObject(build)
+
+def _embeddings(model_env: str, key_env: str) -> LazyObject:
+    """首次调用时才导入并构建的智谱嵌入模型"""
+    def build():
+        from langchain_community.embeddings import ZhipuAIEmbeddings
+        return ZhipuAIEmbeddings(
+            model=os.getenv(model_env),
+            api_key=os.getenv(key_env)
+        )
+    return LazyObject(build)
+
 class MemoryLane:
     def __init__(self):
         # 加载环境变量
         _ = load_dotenv(find_dotenv())
         
-        # 初始化不同用途的LLM
-        self.extract_llm = ChatZhipuAI(
-            model=os.getenv('Extract_Model'),
-            api_key=os.getenv('Extract_API_key')
-        )
+        # 初始化不同用途的LLM（延迟构建，见_warm_up）
+        self.extract_llm = _chat_model('Extract_Model', 'Extract_API_key')
+        self.identify_llm = _chat_model('Identify_Model', 'Identify_API_key')
+        self.generate_llm = _chat_model('Generate_Model', 'Generate_API_key')
+        self.embeddings = _embeddings('Embedding_model', 'Embedding_API_key')
         
-        self.identify_llm = ChatZhipuAI(
-            model=os.getenv('Identify_Model'),
-            api_key=os.getenv('Identify_API_key')
-        )
+        # 当前会话ID，用于按会话过滤记忆
+        self.session_id = str(uuid.uuid4())
         
-        self.generate_llm = ChatZhipuAI(
-            model=os.getenv('Generate_Model'),
-            api_key=os.getenv('Generate_API_key')
-        )
-        
-        self.embeddings = ZhipuAIEmbeddings(
-            model=os.getenv('Embedding_model'),
-            api_key=os.getenv('Embedding_API_key')
-        )
+        # 按会话统计token用量和费用；接近预算时各角色改用低价模型（首次降级调用时才构建）
+        api_manager.usage.reset(self.session_id)
+        ResponseParser.reset_stats()
+        for role, key_env in [("question", 'Generate_API_key'), ("extract", 'Extract_API_key'),
+                              ("identify", 'Identify_API_key'), ("generate", 'Generate_API_key'),
+                              ("summarize", 'Generate_API_key')]:
+            api_manager.register_fallback(
+                role, _chat_model(None, key_env, model=Config.USAGE["FALLBACK_MODEL"])
+            )
         
         # 初始化组件
         self.dialogue_manager = DialogueManager(self.generate_llm)
-        self.vector_store = VectorStoreManager(self.embeddings)
+        # 向量库按会话分片，检索只涉及本次故事的记忆
+        self.vector_store = VectorStoreManager(self.embeddings, tenant=self.session_id)
+        self.knowledge_graph = LazyObject(KnowledgeGraph)
         self.content_processor = ContentProcessor(
             extract_llm=self.extract_llm,
             identify_llm=self.identify_llm,
-            vector_store=self.vector_store
+            vector_store=self.vector_store,
+            knowledge_graph=self.knowledge_graph,
+            session_id=self.session_id,
+            on_refined=self._on_segment_refined
+        )
+        self.storage = StorageManager(Config.STORAGE["DIR"])
+        # 记录修改过的对话轮次、主题、生成内容和会话状态，由自动保存增量写入
+        self.changes = ChangeTracker()
+        self.auto_saver = AutoSaver(
+            self._persist_changes,
+            interval=Config.STORAGE["AUTOSAVE_MAX_DELAY"],
+            tracker=self.changes,
+            debounce=Config.STORAGE["AUTOSAVE_DEBOUNCE"],
+            max_failures=Config.STORAGE["AUTOSAVE_MAX_FAILURES"]
+        )
+        # 子主题由内容片段的嵌入向量在线聚类形成（复用写入向量库时计算的向量）
+        self.theme_manager = ThemeManager(
+            tracker=self.changes,
+            clusterer=SubThemeClusterer(
+                embed=lambda segment: self.vector_store.embedding_for(segment.content, segment.id)
+            )
         )
-        self.theme_manager = ThemeManager()
-        self.content_generator = ContentGenerator(self.generate_llm)
+        # 主题的完整内容片段按需从磁盘加载，内存中只保留有限个
+        self._saving_themes = set()
+        self.theme_manager.themes = LazyLRUDict(
+            loader=self.storage.read_theme,
+            capacity=Config.STORAGE["THEME_CACHE_SIZE"],
+            keys=self.storage.list_themes(),
+            # 未保存或正在写入的主题留在内存中由自动保存写入，不在淘汰时同步回写
+            pinned=lambda theme: self.changes.is_dirty("themes", theme) or theme in self._saving_themes
+        )
+        self.content_generator = ContentGenerator(
+            self.generate_llm,
+            knowledge_graph=self.knowledge_graph,
+            summary_cache=SummaryCache(),
+            generation_cache=GenerationCache()
+        )
+        self.biography_compiler = BiographyCompiler(self.content_generator)
+        self.memory_prefetcher = MemoryPrefetcher(self.vector_store)
         
         # 初始化上下文
         self.context = DialogueContext(
@@ -59,45 +128,180 @@ class MemoryLane:
             last_response=""
         )
         
-        # 添加对话历史
-        self.dialogue_history: List[DialogueTurn] = []
+        # 对话记忆（短期记忆固定长度，更早的轮次按话题写入磁盘）
+        self.dialogue_memory = self.dialogue_manager.attention_memory
+        self.dialogue_memory.reset(self.session_id)
         
-        # 添加生成的内容存储
-        self.generated_contents: Dict[str, str] = {}
+        # 添加生成的内容存储（按需从磁盘加载）
+        self.generated_contents: Dict[str, str] = LazyLRUDict(
+            loader=self.storage.read_generated_content,
+            capacity=Config.STORAGE["CONTENT_CACHE_SIZE"],
+            keys=self.storage.list_generated_themes()
+        )
         
         # 初始化last_question
         self.last_question: str = ""
         
+        # 对话指标
+        self.metrics: Dict[str, float] = {
+            'emotion_score': 0.5,
+            'interest_score': 0.7,
+            'completion_score': 0.3,
+            'topic_weight': 0.5
+        }
+        
     async def start_conversation(self):
         """开始对话"""
         print("欢迎使用 MemoryLane！让我们开始记录您的故事。")
         print("可用命令：")
         print("- 'show content': 显示所有生成的内容")
         print("- 'show content <主题>': 显示特定主题的内容")
+        print("- 'compile': 汇编完整传记")
         print("- 'exit': 退出程序")
         
-        # 第一个问题
-        self.last_question = "能告诉我一些关于您家庭的事情吗？"
+        # 显示第一个问题的同时在后台完成初始化
+        self._warm_up()
+        await self.auto_saver.start()
+        
+        if await self.resume_session():
+            print("\n欢迎回来，我们接着上次的话题继续。")
+        else:
+            # 第一个问题
+            self.last_question = "能告诉我一些关于您家庭的事情吗？"
         print(f"\n系统: {self.last_question}")
         
-        while True:
-            # 获取用户输入
-            user_input = input("\n您: ").lower()
+        # 无论正常退出、Ctrl+C还是输入流结束，都保存未保存的修改并关闭向量库
+        try:
+            while True:
+                # 等待输入期间在后台预取相关记忆、预生成候选问题
+                self.memory_prefetcher.schedule(self.context)
+                self.dialogue_manager.speculator.speculate(self.metrics, self.context)
+                
+                # 获取用户输入（在线程中等待，不阻塞事件循环）
+                user_input = (await asyncio.to_thread(input, "\n您: ")).lower()
+                self.dialogue_manager.speculator.cancel()
+                
+                # 处理命令
+                if user_input == 'exit':
+                    if Config.SPECULATION["ENABLED"]:
+                        stats = self.dialogue_manager.speculator.stats()
+                        print(f"问题预生成命中率: {stats['hit_rate']:.0%} "
+                              f"({stats['hits']}/{stats['lookups']}，调用 {stats['calls']} 次)")
+                    for prompt, counts in ResponseParser.stats().items():
+                        if counts["failures"]:
+                            print(f"响应解析失败 [{prompt}]: {counts['failures']}/{counts['attempts']}")
+                    for line in api_manager.usage.summary():
+                        print(f"用量 {line}")
+                    break
+                elif user_input.startswith('show content'):
+                    parts = user_input.split()
+                    theme = parts[2] if len(parts) > 2 else None
+                    content = await self.show_generated_content(theme)
+                    print(f"\n{content}")
+                    continue
+                elif user_input == 'compile':
+                    print(f"\n{await self.compile_biography()}")
+                    continue
+                
+                # 处理普通对话
+                response = await self.process_user_input(user_input)
+                print(f"\n系统: {response}")
+        except (KeyboardInterrupt, EOFError):
+            print("\n正在保存并退出...")
+        finally:
+            self.changes.mark("usage", self.session_id)
+            await self.auto_saver.flush()
+            self.auto_saver.stop()
+            self.vector_store.close()
+    
+    async def resume_session(self) -> bool:
+        """恢复上次的会话状态，没有可恢复的会话时返回False
+        
+        只读取会话文件（上下文、最近轮次、主题汇总），耗时与历史长度无关；
+        主题内容片段和生成内容在首次访问时加载。
+        """
+        state = await self.storage.load_session()
+        if not state:
+            return False
             
-            # 处理命令
-            if user_input == 'exit':
-                break
-            elif user_input.startswith('show content'):
-                parts = user_input.split()
-                theme = parts[2] if len(parts) > 2 else None
-                content = await self.show_generated_content(theme)
-                print(f"\n{content}")
-                continue
+        self.session_id = state["session_id"]
+        self.content_processor.session_id = self.session_id
+        self.vector_store.tenant = self.session_id
+        api_manager.usage.reset(self.session_id, await self.storage.load_usage(self.session_id))
+        self.context = DialogueContext(**state["context"])
+        self.last_question = state["last_question"]
+        await self.dialogue_memory.restore(
+            self.session_id,
+            [DialogueTurn(**turn) for turn in state["recent_turns"]],
+            state.get("attention")
+        )
+        self.theme_manager.theme_stats = state["theme_stats"]
+        return True
+        
+    async def _persist_changes(self, changes: Dict[str, Dict]):
+        """增量保存：只写入上次保存以来新增的对话轮次、修改过的主题、新生成的内容、会话状态和用量统计"""
+        # 写入完成前这些主题不被淘汰，否则重新加载会读到磁盘上的旧内容
+        self._saving_themes.update(changes.get("themes", {}))
+        try:
+            await self._write_changes(changes)
+        finally:
+            self._saving_themes.difference_update(changes.get("themes", {}))
             
-            # 处理普通对话
-            response = await self.process_user_input(user_input)
-            print(f"\n系统: {response}")
-    
+    async def _write_changes(self, changes: Dict[str, Dict]):
+        # 先取出内存中的主题对象，其余的在I/O线程中加载
+        cached = self.theme_manager.themes
+        themes = {
+            theme: cached[theme]
+            for theme in changes.get("themes", {})
+            if theme in cached and cached.is_loaded(theme)
+        }
+        for theme in changes.get("themes", {}):
+            if theme not in themes:
+                theme_content = await self.theme_manager.get_theme(theme)
+                if theme_content is not None:
+                    themes[theme] = theme_content
+        if changes.get("turns"):
+            await self.storage.append_dialogue_turns(list(changes["turns"].values()))
+            # 移入长期记忆的轮次随对话轮次一起写入
+            await self.dialogue_memory.flush()
+        if themes:
+            await self.storage.save_theme_data(themes)
+        for theme, content in changes.get("generated", {}).values():
+            await self.storage.save_generated_content(theme, content)
+        if changes.get("session"):
+            await self.storage.save_session(self._session_state())
+        if changes.get("session") or changes.get("usage"):
+            # 用量统计随会话状态一起保存
+            await self.storage.save_usage(self.session_id, api_manager.usage.snapshot())
+            
+    def _session_state(self) -> Dict:
+        return {
+            "session_id": self.session_id,
+            "saved_at": datetime.now().isoformat(),
+            "last_question": self.last_question,
+            "context": self.context.model_dump(),
+            "recent_turns": [
+                t.model_dump() for t in self.dialogue_memory.recent(Config.STORAGE["RECENT_TURNS"])
+            ],
+            "attention": self.dialogue_memory.state(),
+            # 在事件循环中复制，写入线程序列化期间主题汇总仍可能被修改
+            "theme_stats": copy.deepcopy(self.theme_manager.theme_stats)
+        }
+        
+    def _warm_up(self):
+        """后台打开向量库并构建各模型客户端，避免阻塞第一个问题的显示"""
+        self.vector_store.open_in_background()
+        self._warm_up_task = asyncio.create_task(asyncio.to_thread(self._build_clients))
+        
+    def _build_clients(self):
+        for client in (self.extract_llm, self.identify_llm, self.generate_llm,
+                       self.embeddings, self.knowledge_graph):
+            try:
+                client._resolve()
+            except Exception as e:
+                # 首次实际使用时会再次构建并报告错误
+                print(f"后台初始化失败: {e}")
+        
     async def process_user_input(self, user_input: str):
         # 更新上下文中的最后回答
         self.context.last_response = user_input
@@ -113,52 +317,104 @@ class MemoryLane:
             depth_level=self.context.depth_level
         )
         
-        # 添加到对话历史
-        self.dialogue_history.append(current_turn)
+        # 添加到对话记忆
+        await self.dialogue_memory.add(current_turn)
+        self.changes.mark("turns", current_turn.id, current_turn)
         
         # 处理内容
         content_segment = await self.content_processor.process_dialogue(
             current_turn,
-            self.dialogue_history
+            self.dialogue_memory.recent()
         )
         
+        # 更新最近提到的实体
+        self._update_recent_entities(content_segment)
+        
         # 处理内容片段，检查是否需要生成内容
         themes_to_generate = await self.theme_manager.process_content(content_segment)
         
-        # 如果有主题需要生成内容
-        for theme in themes_to_generate:
-            theme_content = self.theme_manager.themes[theme]
-            generated_content = await self.content_generator.generate_theme_content(
-                theme_content
-            )
+        # 如果有主题需要生成内容（各主题并发生成，单个主题失败不丢弃其他主题已生成的内容）
+        generated = await asyncio.gather(*[
+            self.content_generator.generate_theme_content(await self.theme_manager.get_theme(theme))
+            for theme in themes_to_generate
+        ], return_exceptions=True)
+        for theme, generated_content in zip(themes_to_generate, generated):
+            if isinstance(generated_content, Exception):
+                print(f"生成主题内容失败 [{theme}]: {generated_content}")
+                continue
             # 存储生成的内容
             self.generated_contents[theme] = generated_content
+            # 每次生成都保存为新版本
+            self.changes.mark("generated", str(uuid.uuid4()), (theme, generated_content))
             print(f"\n系统: 已经为主题 '{theme}' 生成了新的内容。")
             print(f"要查看生成的内容吗？(yes/no)")
             
-            show_content = input("\n您: ").lower()
+            show_content = (await asyncio.to_thread(input, "\n您: ")).lower()
             if show_content in ['yes', 'y', '是']:
                 print(f"\n{generated_content}\n")
         
-        # 计算指标
-        metrics = {
-            'emotion_score': 0.5,
-            'interest_score': 0.7,
-            'completion_score': 0.3,
-            'topic_weight': 0.5
-        }
+        # 使用已预取的相关记忆（不等待未完成的预取）
+        self.memory_prefetcher.apply(self.context)
         
         # 生成下一个问题
         next_question = await self.dialogue_manager.generate_next_question(
-            metrics,
+            self.metrics,
             self.context
         )
         
         # 保存当前问题
         self.last_question = next_question
         
+        # 会话状态随本轮对话一起由自动保存写入
+        self.changes.mark("session", "state")
+        
         return next_question
         
+    def _update_recent_entities(self, segment):
+        """将内容片段中的实体加入最近实体列表"""
+        for entities in segment.entities.values():
+            if not isinstance(entities, list):
+                continue
+            for entity in entities:
+                # 跳过"我""他"等单字代词
+                if not isinstance(entity, str) or len(entity) < 2:
+                    continue
+                if entity in self.context.recent_entities:
+                    self.context.recent_entities.remove(entity)
+                self.context.recent_entities.append(entity)
+        self.context.recent_entities = self.context.recent_entities[-Config.MAX_RECENT_ENTITIES:]
+        
+    async def _on_segment_refined(self, segment, new_themes: List[str]):
+        """后台补全完成：片段加入新识别的主题，已有主题重新保存（片段的实体已更新）"""
+        for theme in segment.themes:
+            if theme in new_themes:
+                await self.theme_manager.update_theme_content(theme, segment)
+            elif theme in self.theme_manager.themes:
+                self.changes.mark("themes", theme)
+        
+    async def compile_biography(self) -> str:
+        """汇编全部已有内容的主题为完整传记，各章节同时保存为对应主题的新版本"""
+        themes = {}
+        for theme in self.theme_manager.theme_stats:
+            theme_content = await self.theme_manager.get_theme(theme)
+            if theme_content is not None:
+                themes[theme] = theme_content
+        if not themes:
+            return "还没有可以汇编的内容。"
+        result = await self.biography_compiler.compile(themes)
+        for theme, chapter in result["chapters"].items():
+            self.generated_contents[theme] = chapter
+            self.changes.mark("generated", str(uuid.uuid4()), (theme, chapter))
+        await self.storage.save_biography(result["text"], result["report"])
+        
+        report = result["report"]
+        print(f"全书汇编完成：{report['chapters']}/{report['themes']} 章，"
+              f"调用 {report['llm_calls']} 次，耗时 {report['total_seconds']:.1f} 秒"
+              f"（章节 {report['map_seconds']:.1f} 秒，过渡 {report['transition_seconds']:.1f} 秒）")
+        if report["failed"]:
+            print(f"生成失败的章节：{', '.join(report['failed'])}")
+        return result["text"]
+        
     async def show_generated_content(self, theme: str = None):
         """显示生成的内容"""
         if theme:
@@ -177,6 +433,5 @@ async def main():
     await memory_lane.start_conversation()
 
 if __name__ == "__main__":
-    import asyncio
     asyncio.run(main())
 
@@ -42,4 +42,5 @@ class DialogueContext(BaseModel):
     emotion_state: float                # 当前情感状态
     interest_level: float               # 当前兴趣度
     pending_questions: List[str]        # 待问问题队列
-    last_response: str = ""             # 用户最后一次回答
\ No newline at end of file
+    last_response: str = ""             # 用户最后一次回答
+    related_memories: List[Dict] = []   # 后台预取的相关记忆
\ No newline at end of file
@@ -0,0 +1,458 @@
+"""性能基准测试
+
+用法：python -m tests.benchmark [基准名称 ...]
+不带参数时运行全部基准。基准不调用任何在线API。
+"""
+import contextlib
+import io
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# 合成语料用的词汇
+PEOPLE = ["我", "父母", "姐姐", "哥哥", "爷爷", "奶奶", "朋友", "同学", "老师", "同事"]
+TIMES = ["从小", "去年春节", "大学时", "小时候", "工作后", "那年夏天", "周末"]
+PLACES = ["北京", "上海", "老家", "学校", "公司", "海边", "山里"]
+EVENTS = ["包饺子", "看电影", "爬山", "毕业", "搬家", "出差", "学游泳", "下象棋", "写作业"]
+FEELINGS = ["很开心", "有些难过", "印象很深", "至今难忘", "觉得很温暖"]
+
+def synthetic_segment(rng: random.Random) -> str:
+    """生成一段合成的回忆文本"""
+    return (
+        f"{rng.choice(TIMES)}，{rng.choice(PEOPLE)}和{rng.choice(PEOPLE)}"
+        f"在{rng.choice(PLACES)}{rng.choice(EVENTS)}，{rng.choice(FEELINGS)}。"
+        f"编号{rng.randint(0, 10 ** 6)}"
+    )
+
+def report_latency(name: str, samples_ms):
+    samples_ms = sorted(samples_ms)
+    p50 = statistics.median(samples_ms)
+    p95 = samples_ms[int(len(samples_ms) * 0.95) - 1]
+    print(f"{name}: p50 {p50:.2f} ms, p95 {p95:.2f} ms")
+
+def bench_lexical_index(num_segments: int = 100_000, num_queries: int = 200):
+    """二元组倒排索引：构建时间、索引大小和BM25查询延迟"""
+    from core.lexical_index import BigramIndex
+
+    print(f"\n=== 词法索引基准（{num_segments} 个片段）===")
+    rng = random.Random(42)
+    index = BigramIndex(storage_path="")
+
+    segments = [synthetic_segment(rng) for _ in range(num_segments)]
+
+    start = time.perf_counter()
+    for i, segment in enumerate(segments):
+        index.add(str(i), segment, {"theme_家庭": i % 2 == 0})
+    build_seconds = time.perf_counter() - start
+    print(f"构建耗时: {build_seconds:.2f} 秒 ({num_segments / build_seconds:.0f} 片段/秒)")
+    print(f"词项数: {len(index.postings)}")
+    print(f"索引大小（估算）: {index.memory_usage() / 1024 / 1024:.1f} MB")
+
+    queries = [f"{rng.choice(PEOPLE)}{rng.choice(EVENTS)}" for _ in range(num_queries)]
+    # 稀有词：语料中实际出现过的编号
+    rare_queries = [rng.choice(segments).split("。")[-1] for _ in range(num_queries)]
+
+    for name, query_set, predicate in [
+        ("常见词查询", queries, None),
+        ("稀有词查询", rare_queries, None),
+        ("常见词查询+过滤", queries, lambda metadata: metadata.get("theme_家庭", False)),
+    ]:
+        samples = []
+        for query in query_set:
+            start = time.perf_counter()
+            index.search(query, k=10, predicate=predicate)
+            samples.append((time.perf_counter() - start) * 1000)
+        report_latency(name, samples)
+
+STARTUP_SCRIPT = """
+import asyncio, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+memory_lane = main.MemoryLane()
+constructed = time.perf_counter()
+
+async def open_store():
+    memory_lane._warm_up()
+    await memory_lane.vector_store._open_task
+    await memory_lane._warm_up_task
+
+asyncio.run(open_store())
+warmed = time.perf_counter()
+print(f"{imported - start} {constructed - imported} {warmed - constructed}")
+"""
+
+def bench_startup(runs: int = 5):
+    """启动耗时：导入main、构建MemoryLane、后台打开向量库和构建客户端"""
+    print("\n=== 启动基准 ===")
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=repo_dir, PYTHONWARNINGS="ignore")
+    for prefix in ["Extract", "Identify", "Generate"]:
+        env.setdefault(f"{prefix}_API_key", "benchmark.key")
+        env.setdefault(f"{prefix}_Model", "glm-4")
+    env.setdefault("Embedding_API_key", "benchmark.key")
+    env.setdefault("Embedding_model", "embedding-2")
+
+    samples = {"导入main": [], "构建MemoryLane": [], "后台预热": []}
+    for _ in range(runs):
+        # 在临时目录中运行，避免写入仓库中的数据目录
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output = subprocess.run(
+                [sys.executable, "-c", STARTUP_SCRIPT],
+                cwd=tmp_dir, env=env, capture_output=True, text=True, check=True
+            ).stdout.split()
+        for name, seconds in zip(samples, output[-3:]):
+            samples[name].append(float(seconds) * 1000)
+
+    for name, values in samples.items():
+        report_latency(name, values)
+
+def _legacy_theme_record(theme) -> dict:
+    """旧格式：主题文件内嵌完整片段及其对话上下文"""
+    return {
+        "main_theme": theme.main_theme,
+        "last_updated": theme.last_updated.isoformat(),
+        "sub_themes": {
+            name: {
+                "name": sub.name,
+                "first_mentioned": sub.first_mentioned.isoformat(),
+                "last_updated": sub.last_updated.isoformat(),
+                "related_entities": {k: sorted(v) for k, v in sub.related_entities.items()},
+                "content_segments": [
+                    {
+                        "id": seg.id,
+                        "content": seg.content,
+                        "timestamp": seg.timestamp.isoformat(),
+                        "entities": seg.entities,
+                        "relations": seg.relations,
+                        "themes": seg.themes,
+                        "keywords": seg.keywords,
+                        "dialogue_context": [turn.model_dump() for turn in seg.dialogue_context]
+                    }
+                    for seg in sub.content_segments
+                ]
+            }
+            for name, sub in theme.sub_themes.items()
+        }
+    }
+
+def _dir_size(path: str) -> int:
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, files in os.walk(path) for name in files
+    )
+
+def _synthetic_session(num_turns: int):
+    """模拟长会话：每轮生成一个带3轮上下文的片段，并归入2-3个主题"""
+    import asyncio
+    from datetime import datetime
+    from core.theme_manager import ThemeManager
+    from models.content_manager import ContentSegment
+    from models.schemas import DialogueTurn
+
+    rng = random.Random(42)
+    themes = ["童年", "家庭", "教育", "工作", "爱好", "旅行"]
+    theme_manager = ThemeManager()
+    turns = []
+
+    async def build():
+        for i in range(num_turns):
+            turn = DialogueTurn(
+                id=f"turn-{i}",
+                question=f"能再讲讲{rng.choice(EVENTS)}的经历吗？",
+                answer=synthetic_segment(rng) * 3,
+                topic=rng.choice(themes),
+                emotion_score=0.5,
+                interest_score=0.5,
+                depth_level=1
+            )
+            turns.append(turn)
+            segment = ContentSegment(
+                id=f"segment-{i}",
+                content=synthetic_segment(rng) * 3,
+                timestamp=datetime.now(),
+                dialogue_context=turns[-3:],
+                entities={"人物": [rng.choice(PEOPLE)], "地点": [rng.choice(PLACES)]},
+                themes=rng.sample(themes, rng.randint(2, 3)),
+                keywords=[rng.choice(EVENTS)]
+            )
+            for theme in segment.themes:
+                await theme_manager.update_theme_content(theme, segment)
+    # 主题管理器会打印每次更新，基准中屏蔽
+    with contextlib.redirect_stdout(io.StringIO()):
+        asyncio.run(build())
+    return theme_manager, turns
+
+def bench_segment_storage(num_turns: int = 2000):
+    """片段存储：内嵌格式与ID引用格式的磁盘占用和加载后内存"""
+    import asyncio
+    import json
+    import tracemalloc
+    from core.storage_manager import StorageManager
+
+    print(f"\n=== 片段存储基准（{num_turns} 轮对话）===")
+    theme_manager, turns = _synthetic_session(num_turns)
+
+    def measure_load(storage_dir: str) -> int:
+        storage = StorageManager(storage_dir)
+        tracemalloc.start()
+        loaded = [storage.read_theme(name) for name in storage.list_themes()]
+        peak = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del loaded
+        return peak
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        legacy_dir = os.path.join(tmp_dir, "legacy")
+        os.makedirs(os.path.join(legacy_dir, "themes"))
+        for name, theme in theme_manager.themes.items():
+            with open(os.path.join(legacy_dir, "themes", f"{name}.json"), 'w', encoding='utf-8') as f:
+                json.dump(_legacy_theme_record(theme), f, ensure_ascii=False, indent=2)
+        legacy_disk = _dir_size(os.path.join(legacy_dir, "themes"))
+        legacy_memory = measure_load(legacy_dir)
+
+        ref_dir = os.path.join(tmp_dir, "reference")
+        storage = StorageManager(ref_dir)
+        asyncio.run(storage.append_dialogue_turns(turns))
+        for name, theme in theme_manager.themes.items():
+            storage.write_theme(name, theme)
+        ref_disk = sum(
+            _dir_size(os.path.join(ref_dir, sub))
+            for sub in ["themes", "segments", "dialogue_history"]
+        )
+        ref_memory = measure_load(ref_dir)
+
+    transcript = sum(len(json.dumps(t.model_dump(), ensure_ascii=False).encode('utf-8')) for t in turns)
+    print(f"原始对话记录: {transcript / 1024 / 1024:.1f} MB")
+    print(f"内嵌格式: 磁盘 {legacy_disk / 1024 / 1024:.1f} MB，加载后内存 {legacy_memory / 1024 / 1024:.1f} MB")
+    print(f"引用格式: 磁盘 {ref_disk / 1024 / 1024:.1f} MB（含轮次表），加载后内存 {ref_memory / 1024 / 1024:.1f} MB")
+
+def bench_storage_codec(num_turns: int = 2000, runs: int = 5):
+    """存储编码：JSON与msgpack、校验加载与快速加载的保存/加载吞吐量"""
+    import asyncio
+    from core.storage_manager import StorageManager
+
+    print(f"\n=== 存储编码基准（{num_turns} 轮对话）===")
+    theme_manager, turns = _synthetic_session(num_turns)
+    records = num_turns + sum(
+        len(sub.content_segments)
+        for theme in theme_manager.themes.values() for sub in theme.sub_themes.values()
+    )
+
+    for storage_format, fast_load in [("json", False), ("json", True), ("msgpack", False), ("msgpack", True)]:
+        save_times, load_times = [], []
+        for _ in range(runs):
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                storage = StorageManager(tmp_dir, storage_format=storage_format)
+                start = time.perf_counter()
+                asyncio.run(storage.append_dialogue_turns(turns))
+                asyncio.run(storage.save_theme_data(theme_manager.themes))
+                save_times.append(time.perf_counter() - start)
+                disk = sum(
+                    _dir_size(os.path.join(tmp_dir, sub))
+                    for sub in ["themes", "segments", "dialogue_history"]
+                )
+
+                # 新建实例，从磁盘冷加载全部主题
+                storage = StorageManager(tmp_dir, storage_format=storage_format)
+                storage.fast_load = fast_load
+                start = time.perf_counter()
+                for name in storage.list_themes():
+                    storage.read_theme(name)
+                load_times.append(time.perf_counter() - start)
+        save, load = min(save_times), min(load_times)
+        label = f"{storage_format}（{'快速加载' if fast_load else '校验加载'}）"
+        print(
+            f"{label}: 磁盘 {disk / 1024 / 1024:.2f} MB，"
+            f"保存 {save * 1000:.0f} ms（{records / save:.0f} 条/秒），"
+            f"加载 {load * 1000:.0f} ms（{records / load:.0f} 条/秒）"
+        )
+
+def bench_event_loop_lag(num_turns: int = 20_000, snapshots: int = 5):
+    """快照密集负载下的事件循环延迟：直接在事件循环中写盘 vs I/O线程池"""
+    import asyncio
+    from core.version_manager import VersionManager
+
+    print(f"\n=== 事件循环延迟基准（{snapshots} 个快照，每个 {num_turns} 轮对话）===")
+    rng = random.Random(42)
+    history = [
+        {"id": f"turn-{i}", "question": "能再讲讲吗？", "answer": synthetic_segment(rng) * 3,
+         "topic": "家庭", "emotion_score": 0.5, "interest_score": 0.5, "depth_level": 1}
+        for i in range(num_turns)
+    ]
+    generated = {f"主题{i}": synthetic_segment(rng) * 200 for i in range(10)}
+    theme_data = {"家庭": {"segments": [turn["answer"] for turn in history]}}
+
+    async def heartbeat(lags, stop, interval=0.005):
+        while not stop.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(interval)
+            lags.append((time.perf_counter() - start - interval) * 1000)
+
+    async def workload(manager, blocking: bool):
+        lags, stop = [], asyncio.Event()
+        beat = asyncio.create_task(heartbeat(lags, stop))
+        await asyncio.sleep(0.02)
+        start = time.perf_counter()
+        for _ in range(snapshots):
+            if blocking:
+                manager.write_snapshot(history, generated, theme_data)
+                await asyncio.sleep(0)
+            else:
+                await manager.create_snapshot(history, generated, theme_data)
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await beat
+        return lags, elapsed
+
+    for label, blocking in [("事件循环中直接写盘", True), ("I/O线程池", False)]:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            lags, elapsed = asyncio.run(workload(VersionManager(tmp_dir), blocking))
+        lags.sort()
+        print(
+            f"{label}: 总耗时 {elapsed * 1000:.0f} ms，心跳延迟 p50 {statistics.median(lags):.1f} ms，"
+            f"p95 {lags[int(len(lags) * 0.95) - 1]:.1f} ms，最大 {lags[-1]:.1f} ms"
+        )
+
+def bench_tenant_search(num_tenants: int = 50, segments_per_tenant: int = 2000, num_queries: int = 200):
+    """按租户分片前后的检索延迟：共用索引按session_id过滤 vs 每个租户独立索引"""
+    from core.lexical_index import BigramIndex
+
+    print(f"\n=== 租户分片基准（{num_tenants} 个租户，每个 {segments_per_tenant} 个片段）===")
+    rng = random.Random(42)
+    shared = BigramIndex(storage_path="")
+    own = BigramIndex(storage_path="")
+    for tenant in range(num_tenants):
+        for i in range(segments_per_tenant):
+            segment = synthetic_segment(rng)
+            metadata = {"session_id": f"t{tenant}"}
+            shared.add(f"t{tenant}-{i}", segment, metadata)
+            if tenant == 0:
+                own.add(f"t{tenant}-{i}", segment, metadata)
+
+    queries = [f"{rng.choice(PEOPLE)}{rng.choice(EVENTS)}" for _ in range(num_queries)]
+    for name, index, predicate in [
+        ("共用索引+会话过滤", shared, lambda metadata: metadata.get("session_id") == "t0"),
+        ("租户独立索引", own, None),
+    ]:
+        samples = []
+        for query in queries:
+            start = time.perf_counter()
+            index.search(query, k=10, predicate=predicate)
+            samples.append((time.perf_counter() - start) * 1000)
+        report_latency(name, samples)
+
+def _synthetic_embeddings(num_vectors: int, dim: int, num_queries: int, k: int):
+    """带聚类结构的归一化合成向量（近似真实嵌入的分布）、查询向量和精确的前k个结果"""
+    import numpy as np
+
+    rng = np.random.default_rng(42)
+    centers = rng.standard_normal((200, dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, 200, num_vectors)] + 0.5 * rng.standard_normal((num_vectors, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    queries = vectors[rng.integers(0, num_vectors, num_queries)] + 0.02 * rng.standard_normal((num_queries, dim)).astype(np.float32)
+    norms = np.einsum('ij,ij->i', vectors, vectors)
+    truth = [set(np.argsort(norms - 2 * vectors @ q)[:k].tolist()) for q in queries]
+    return vectors, queries, truth
+
+def bench_vector_backend(num_vectors: int = 20_000, dim: int = 1024, num_queries: int = 200, k: int = 10):
+    """向量库后端：Chroma、进程内精确检索、进程内HNSW的写入耗时、检索延迟、recall@k和磁盘占用"""
+    import numpy as np
+    from core.vector_backends import ChromaBackend, LocalCollection
+    from config.config import Config
+
+    print(f"\n=== 向量库后端基准（{num_vectors} 个 {dim} 维向量）===")
+    vectors, queries, truth = _synthetic_embeddings(num_vectors, dim, num_queries, k)
+    ids = [f"m{i}" for i in range(num_vectors)]
+    metadatas = [{"id": doc_id, "theme_家庭": i % 2 == 0} for i, doc_id in enumerate(ids)]
+    documents = [f"片段{i}" for i in range(num_vectors)]
+
+    def run(label, open_collection, directory):
+        collection = open_collection()
+        start = time.perf_counter()
+        for i in range(0, num_vectors, 1000):
+            collection.add(ids[i:i + 1000], vectors[i:i + 1000].tolist(), documents[i:i + 1000], metadatas[i:i + 1000])
+        insert_seconds = time.perf_counter() - start
+        samples, hits = [], 0
+        for q, expected in zip(queries, truth):
+            start = time.perf_counter()
+            results = collection.query(q.tolist(), k)
+            samples.append((time.perf_counter() - start) * 1000)
+            hits += len(expected & {int(doc_id[1:]) for doc_id, *_ in results})
+        filtered = []
+        for q in queries[:50]:
+            start = time.perf_counter()
+            collection.query(q.tolist(), k, where={"theme_家庭": True})
+            filtered.append((time.perf_counter() - start) * 1000)
+        collection.close()
+        print(f"{label}: 写入 {insert_seconds:.1f} 秒，recall@{k} {hits / (k * num_queries):.3f}，"
+              f"磁盘 {_dir_size(directory) / 1024 / 1024:.1f} MB")
+        report_latency(f"  {label} 检索", samples)
+        report_latency(f"  {label} 过滤检索", filtered)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        chroma_dir = os.path.join(tmp_dir, "chroma")
+        run("Chroma", lambda: ChromaBackend(chroma_dir).open("bench"), chroma_dir)
+        for label, threshold in [("进程内精确检索", num_vectors + 1), ("进程内HNSW", 1)]:
+            directory = os.path.join(tmp_dir, label)
+            config = {**Config.VECTOR_STORE, "HNSW_THRESHOLD": threshold}
+            run(label, lambda: LocalCollection(directory, "bench", config), directory)
+
+def bench_vector_quantization(num_vectors: int = 20_000, dim: int = 1024, num_queries: int = 200, k: int = 10):
+    """向量量化：各量化方式检索时扫描的常驻数据量、磁盘占用、检索延迟和recall@k（有无全精度重排）"""
+    from core.vector_backends import LocalCollection
+    from config.config import Config
+
+    print(f"\n=== 向量量化基准（{num_vectors} 个 {dim} 维向量）===")
+    vectors, queries, truth = _synthetic_embeddings(num_vectors, dim, num_queries, k)
+    ids = [f"m{i}" for i in range(num_vectors)]
+    metadatas = [{"id": doc_id} for doc_id in ids]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for mode in ["none", "float16", "int8"]:
+            directory = os.path.join(tmp_dir, mode)
+            for rerank_factor in [1, 4]:
+                if mode == "none" and rerank_factor > 1:
+                    continue
+                config = {**Config.VECTOR_STORE, "QUANTIZATION": mode,
+                          "RERANK_FACTOR": rerank_factor, "HNSW_THRESHOLD": num_vectors + 1}
+                collection = LocalCollection(directory, "bench", config)
+                if collection.count() == 0:
+                    for i in range(0, num_vectors, 1000):
+                        collection.add(ids[i:i + 1000], vectors[i:i + 1000].tolist(), ids[i:i + 1000], metadatas[i:i + 1000])
+                samples, hits = [], 0
+                for q, expected in zip(queries, truth):
+                    start = time.perf_counter()
+                    results = collection.query(q.tolist(), k)
+                    samples.append((time.perf_counter() - start) * 1000)
+                    hits += len(expected & {int(doc_id[1:]) for doc_id, *_ in results})
+                # 每次检索需要常驻内存的数据：未量化时为全部全精度向量，量化时为量化向量、缩放系数和范数
+                scanned = ["vectors.f32", "norms.f32"] if mode == "none" else list(collection._sidecars())
+                resident = sum(os.path.getsize(os.path.join(directory, name)) for name in scanned)
+                label = "全精度" if mode == "none" else f"{mode} 重排x{rerank_factor}"
+                print(f"{label}: 常驻 {resident / 1024 / 1024:.1f} MB，磁盘 {_dir_size(directory) / 1024 / 1024:.1f} MB，"
+                      f"recall@{k} {hits / (k * num_queries):.3f}")
+                report_latency(f"  {label} 检索", samples)
+                collection.close()
+
+BENCHMARKS = {
+    "lexical_index": bench_lexical_index,
+    "startup": bench_startup,
+    "segment_storage": bench_segment_storage,
+    "storage_codec": bench_storage_codec,
+    "event_loop_lag": bench_event_loop_lag,
+    "tenant_search": bench_tenant_search,
+    "vector_backend": bench_vector_backend,
+    "vector_quantization": bench_vector_quantization,
+}
+
+def main(names=None):
+    for name in names or BENCHMARKS:
+        BENCHMARKS[name]()
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
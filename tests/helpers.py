@@ -0,0 +1,113 @@
+"""测试共用的假模型、数据构造函数和全局API管理器设置"""
+import asyncio
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Optional
+from langchain_core.embeddings import Embeddings
+from core.lexical_index import tokenize
+from models.content_manager import ContentSegment
+from models.schemas import DialogueTurn
+from utils.api_manager import APIManager, APIRateLimiter, api_manager
+from utils.usage_tracker import UsageTracker
+
+class FakeMessage:
+    """模型响应，可带用量信息"""
+
+    def __init__(self, content, usage_metadata=None, response_metadata=None):
+        self.content = content
+        self.usage_metadata = usage_metadata
+        self.response_metadata = response_metadata or {}
+
+class FakeLLM:
+    """记录调用次数和同时进行的调用数的假模型
+
+    子类重写reply按提示返回响应；reply返回异常对象时在等待delay()秒后抛出。
+    """
+    model_name = "fake-model"
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = 0
+        self.active = 0
+        self.max_active = 0
+
+    def reply(self, messages):
+        return FakeMessage("好的")
+
+    def delay(self) -> float:
+        return self.latency
+
+    async def ainvoke(self, messages):
+        self.calls += 1
+        outcome = self.reply(messages)
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(self.delay())
+        finally:
+            self.active -= 1
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+class HashEmbeddings(Embeddings):
+    """按二元组哈希得到的确定性向量，不调用在线API"""
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        vector = [0.0] * 32
+        for token in tokenize(text):
+            vector[hash(token) % 32] += 1.0
+        return vector
+
+def make_turn(answer: str = "回答", topic: str = "家庭", **fields) -> DialogueTurn:
+    return DialogueTurn(**{
+        "id": str(uuid.uuid4()),
+        "question": "问题",
+        "answer": answer,
+        "topic": topic,
+        "emotion_score": 0.5,
+        "interest_score": 0.7,
+        "depth_level": 0,
+        **fields
+    })
+
+def make_segment(content: str,
+                 themes: Optional[List[str]] = None,
+                 entities: Optional[Dict[str, List[str]]] = None,
+                 relations: Optional[List[Dict[str, str]]] = None,
+                 dialogue_context: Optional[List[DialogueTurn]] = None,
+                 keywords: Optional[List[str]] = None) -> ContentSegment:
+    return ContentSegment(
+        id=str(uuid.uuid4()),
+        content=content,
+        timestamp=datetime.now(),
+        dialogue_context=list(dialogue_context or []),
+        entities=entities if entities is not None else {"人物": ["姐姐"]},
+        relations=relations or [],
+        themes=themes or ["家庭"],
+        keywords=list(keywords or [])
+    )
+
+def make_api_manager(retry_config: Optional[Dict] = None, usage: Optional[UsageTracker] = None) -> APIManager:
+    """不受限流影响的API管理器"""
+    manager = APIManager(retry_config, usage=usage)
+    manager.rate_limiter = APIRateLimiter(max_requests=1000, time_window=1)
+    return manager
+
+@contextmanager
+def relaxed_api_manager(usage: Optional[UsageTracker] = None):
+    """临时放宽全局api_manager的限流（可同时替换用量统计），退出时恢复（包括期间登记的低价模型）"""
+    saved_limiter, saved_usage = api_manager.rate_limiter, api_manager.usage
+    saved_fallbacks = dict(api_manager.fallbacks)
+    api_manager.rate_limiter = APIRateLimiter(max_requests=1000, time_window=1)
+    if usage is not None:
+        api_manager.usage = usage
+    try:
+        yield api_manager
+    finally:
+        api_manager.rate_limiter, api_manager.usage = saved_limiter, saved_usage
+        api_manager.fallbacks = saved_fallbacks
@@ -0,0 +1,126 @@
+import asyncio
+import time
+from utils.api_manager import APIManager, CircuitOpenError
+from helpers import FakeLLM, make_api_manager
+
+class FakeResponse:
+    def __init__(self, status_code: int, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+class FakeHTTPError(Exception):
+    def __init__(self, status_code: int, headers=None):
+        super().__init__(f"HTTP {status_code}")
+        self.response = FakeResponse(status_code, headers)
+
+class FakeModel(FakeLLM):
+    """按预设序列返回结果或抛出异常的模型（只有第一次调用有延迟）"""
+
+    def __init__(self, outcomes, latency: float = 0.0):
+        super().__init__(latency)
+        self.outcomes = list(outcomes)
+
+    def reply(self, messages):
+        return self.outcomes.pop(0) if self.outcomes else "ok"
+
+    def delay(self) -> float:
+        return self.latency if self.calls == 1 else 0.0
+
+def make_manager(**overrides) -> APIManager:
+    return make_api_manager({
+        "DEFAULT": {
+            "MAX_RETRIES": 3, "BASE_DELAY": 0.01, "MAX_DELAY": 0.02, "MAX_RETRY_AFTER": 1.0,
+            "BREAKER_THRESHOLD": 3, "BREAKER_COOLDOWN": 0.2, "HEDGE_AFTER": None
+        },
+        "ROLES": {"test": overrides}
+    })
+
+def test_retry_classification():
+    """测试临时性错误重试、请求错误不重试"""
+    async def run():
+        manager = make_manager()
+        model = FakeModel([FakeHTTPError(503), asyncio.TimeoutError(), "ok"])
+        assert await manager.execute_with_retry(model.ainvoke, [], role="test") == "ok"
+        assert model.calls == 3
+
+        model = FakeModel([FakeHTTPError(400)])
+        try:
+            await manager.execute_with_retry(model.ainvoke, [], role="test")
+            assert False, "400不应重试"
+        except FakeHTTPError:
+            pass
+        assert model.calls == 1
+
+    asyncio.run(run())
+
+def test_retry_after_honored():
+    """测试遵循Retry-After等待"""
+    async def run():
+        manager = make_manager()
+        model = FakeModel([FakeHTTPError(429, {"retry-after": "0.3"}), "ok"])
+        start = time.monotonic()
+        assert await manager.execute_with_retry(model.ainvoke, [], role="test") == "ok"
+        assert time.monotonic() - start >= 0.3
+
+    asyncio.run(run())
+
+def test_circuit_breaker():
+    """测试连续失败后熔断、冷却后探测恢复"""
+    async def run():
+        manager = make_manager(MAX_RETRIES=1)
+        model = FakeModel([FakeHTTPError(500)] * 3)
+        for _ in range(3):
+            try:
+                await manager.execute_with_retry(model.ainvoke, [], role="test")
+            except FakeHTTPError:
+                pass
+        try:
+            await manager.execute_with_retry(model.ainvoke, [], role="test")
+            assert False, "熔断期间应直接失败"
+        except CircuitOpenError:
+            pass
+        assert model.calls == 3
+        assert manager.stats()["breakers"] == {"FakeModel:fake-model": "open"}
+
+        await asyncio.sleep(0.25)
+        assert await manager.execute_with_retry(model.ainvoke, [], role="test") == "ok"
+        assert manager.stats()["breakers"] == {"FakeModel:fake-model": "closed"}
+
+    asyncio.run(run())
+
+def test_hedged_request():
+    """测试主请求过慢时由对冲请求返回结果"""
+    async def run():
+        manager = make_manager(HEDGE_AFTER=0.05)
+        model = FakeModel(["slow", "fast"], latency=1.0)
+        start = time.monotonic()
+        assert await manager.execute_with_retry(model.ainvoke, [], role="test") == "fast"
+        assert time.monotonic() - start < 0.5
+        assert manager.counters["hedge_wins"] == 1
+
+    asyncio.run(run())
+
+def test_cancelled_hedge_does_not_leak():
+    """测试等待主请求期间调用方被取消时，主请求一并取消"""
+    async def run():
+        manager = make_manager(HEDGE_AFTER=0.5)
+        model = FakeModel(["slow"], latency=1.0)
+        caller = asyncio.create_task(manager.execute_with_retry(model.ainvoke, [], role="test"))
+        await asyncio.sleep(0.05)
+        assert model.active == 1
+        caller.cancel()
+        try:
+            await caller
+        except asyncio.CancelledError:
+            pass
+        await asyncio.sleep(0)
+        assert model.active == 0 and model.calls == 1
+
+    asyncio.run(run())
+
+if __name__ == "__main__":
+    test_retry_classification()
+    test_retry_after_honored()
+    test_circuit_breaker()
+    test_hedged_request()
+    test_cancelled_hedge_does_not_leak()
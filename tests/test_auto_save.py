@@ -0,0 +1,102 @@
+import asyncio
+from utils.auto_save import AutoSaver, ChangeTracker
+
+def test_change_tracker():
+    """测试标记、取出和失败后放回"""
+    tracker = ChangeTracker()
+    tracker.mark("themes", "家庭")
+    tracker.mark("turns", "t1", "turn-1")
+    tracker.mark("themes", "家庭")
+    assert tracker.is_dirty("themes", "家庭")
+
+    changes = tracker.drain()
+    assert changes == {"themes": {"家庭": None}, "turns": {"t1": "turn-1"}}
+    assert not tracker.has_changes()
+
+    tracker.mark("turns", "t1", "turn-1-new")
+    tracker.restore(changes)
+    assert tracker.drain()["turns"] == {"t1": "turn-1-new"}
+
+def test_debounced_incremental_save():
+    """测试连续修改合并为一次保存、空闲时没有I/O、只保存修改过的实体"""
+    async def run():
+        saved = []
+
+        async def save(changes):
+            saved.append(changes)
+
+        tracker = ChangeTracker()
+        saver = AutoSaver(save, interval=1.0, tracker=tracker, debounce=0.05)
+        await saver.start()
+
+        for i in range(10):
+            tracker.mark("turns", f"t{i}", i)
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.1)
+        assert len(saved) == 1 and len(saved[0]["turns"]) == 10
+
+        # 空闲期间不保存
+        await asyncio.sleep(0.2)
+        assert len(saved) == 1
+
+        tracker.mark("themes", "旅行")
+        await asyncio.sleep(0.1)
+        assert saved[1] == {"themes": {"旅行": None}}
+
+    asyncio.run(run())
+
+def test_max_delay_and_failure_retry():
+    """测试持续修改时不超过最长延迟，保存失败后修改被保留并重试"""
+    async def run():
+        saved, failures = [], []
+
+        async def save(changes):
+            if not failures:
+                failures.append(changes)
+                raise IOError("磁盘已满")
+            saved.append(changes)
+
+        tracker = ChangeTracker()
+        saver = AutoSaver(save, interval=0.1, tracker=tracker, debounce=0.05)
+        await saver.start()
+
+        for i in range(20):
+            tracker.mark("turns", f"t{i}", i)
+            await asyncio.sleep(0.02)
+        await saver.flush()
+        assert failures
+        assert sum(len(changes["turns"]) for changes in saved) == 20
+        assert len(saved) >= 2  # 持续修改期间按最长延迟保存过
+
+    asyncio.run(run())
+
+def test_repeated_failures_back_off_and_stop():
+    """测试连续保存失败时按退避重试，达到上限后暂停，新的修改时再尝试一次"""
+    async def run():
+        attempts = []
+
+        async def save(changes):
+            attempts.append(changes)
+            raise IOError("磁盘已满")
+
+        tracker = ChangeTracker()
+        saver = AutoSaver(save, interval=0.2, tracker=tracker, debounce=0.01, max_failures=3)
+        await saver.start()
+
+        tracker.mark("turns", "t1", 1)
+        await asyncio.sleep(0.5)
+        assert len(attempts) == 3 and saver.failures == 3
+        assert tracker.is_dirty("turns", "t1")
+
+        tracker.mark("turns", "t2", 2)
+        await asyncio.sleep(0.2)
+        assert len(attempts) == 4
+        assert set(attempts[-1]["turns"]) == {"t1", "t2"}
+
+    asyncio.run(run())
+
+if __name__ == "__main__":
+    test_change_tracker()
+    test_debounced_incremental_save()
+    test_max_delay_and_failure_retry()
+    test_repeated_failures_back_off_and_stop()
@@ -0,0 +1,115 @@
+import asyncio
+import os
+import tempfile
+from config.config import Config
+from core.biography_compiler import BiographyCompiler
+from core.content_generator import ContentGenerator
+from core.summary_cache import SummaryCache
+from core.theme_manager import ThemeManager
+from helpers import FakeLLM, FakeMessage, make_segment, make_turn, relaxed_api_manager
+
+class BiographyLLM(FakeLLM):
+    """按提示类型返回固定内容的模型"""
+    model_name = "fake-biography"
+
+    def __init__(self, fail_theme=None):
+        super().__init__(latency=0.02)
+        self.fail_theme = fail_theme
+        self.prompts = []
+
+    def reply(self, messages):
+        system, human = messages[0].content, messages[1].content
+        self.prompts.append(human)
+        if self.fail_theme and f"主题：{self.fail_theme}" in human:
+            return ValueError("bad request")
+        if "摘要" in system:
+            return FakeMessage("摘要")
+        if "相邻的两章" in system:
+            return FakeMessage("过渡句")
+        theme = human.split("主题：")[1].split()[0]
+        return FakeMessage(f"{theme}的章节")
+
+def make_theme_segment(content: str, theme: str):
+    return make_segment(content, [theme], dialogue_context=[make_turn(content, theme)])
+
+def test_compile_biography():
+    """测试章节并发生成、过长主题分块摘要、按主题顺序拼接并添加过渡、单章失败不影响其他章节"""
+    async def run():
+        theme_manager = ThemeManager()
+        for theme, count in [("旅行", 2), ("家庭", 12), ("友谊", 2), ("信仰", 1)]:
+            for i in range(count):
+                await theme_manager.update_theme_content(theme, make_theme_segment(f"{theme}的回忆{i}" * 3, theme))
+
+        llm = BiographyLLM(fail_theme="信仰")
+        config = {**Config.BIOGRAPHY, "MAX_CONCURRENCY": 2, "CHUNK_CHARS": 100}
+        compiler = BiographyCompiler(ContentGenerator(llm), config)
+        result = await compiler.compile(theme_manager.themes)
+
+        assert list(result["chapters"]) == ["家庭", "友谊", "旅行"]
+        assert result["chapters"]["家庭"] == "家庭的章节"
+        assert result["transitions"] == {"家庭": "过渡句", "友谊": "过渡句"}
+        assert result["text"].index("## 家庭") < result["text"].index("过渡句") < result["text"].index("## 友谊")
+        # 家庭的内容超过分块长度，由各块摘要生成章节
+        assert result["report"]["chunked"] == {"家庭": 4}
+        assert any("第1部分" in prompt and "摘要" in prompt for prompt in llm.prompts)
+        assert llm.max_active == 2
+        assert result["report"]["failed"] == ["信仰"]
+        assert result["report"]["llm_calls"] == 4 + 4 + 2
+        assert set(result["report"]["chapter_seconds"]) == {"家庭", "友谊", "旅行", "信仰"}
+
+    with relaxed_api_manager():
+        asyncio.run(run())
+
+def test_overlapping_compiles_keep_separate_reports():
+    """测试同一编译器同时汇编两次时各自的报告互不影响"""
+    async def run():
+        first, second = ThemeManager(), ThemeManager()
+        await first.update_theme_content("家庭", make_theme_segment("家庭的回忆", "家庭"))
+        for theme in ["友谊", "旅行"]:
+            await second.update_theme_content(theme, make_theme_segment(f"{theme}的回忆", theme))
+
+        compiler = BiographyCompiler(ContentGenerator(BiographyLLM()), {**Config.BIOGRAPHY, "MAX_CONCURRENCY": 1})
+        one, two = await asyncio.gather(compiler.compile(first.themes), compiler.compile(second.themes))
+
+        assert list(one["chapters"]) == ["家庭"]
+        assert set(one["report"]["chapter_seconds"]) == {"家庭"}
+        assert one["report"]["llm_calls"] == 1
+        assert list(two["chapters"]) == ["友谊", "旅行"]
+        assert set(two["report"]["chapter_seconds"]) == {"友谊", "旅行"}
+        assert two["report"]["llm_calls"] == 2 + 1
+
+    with relaxed_api_manager():
+        asyncio.run(run())
+
+def test_sub_theme_summaries_counted_and_limited():
+    """测试整理内容时的子主题摘要请求受并发限制并计入调用次数"""
+    async def run():
+        theme_manager = ThemeManager()
+        for theme in ["家庭", "友谊"]:
+            for i in range(3):
+                await theme_manager.update_theme_content(theme, make_theme_segment(f"{theme}的回忆{i}" * 3, theme))
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            llm = BiographyLLM()
+            generator = ContentGenerator(llm, summary_cache=SummaryCache(os.path.join(tmp_dir, "summaries.json")))
+            compiler = BiographyCompiler(generator, {**Config.BIOGRAPHY, "MAX_CONCURRENCY": 1, "TRANSITIONS": False})
+            result = await compiler.compile(theme_manager.themes)
+
+        assert list(result["chapters"]) == ["家庭", "友谊"]
+        assert generator.summary_stats["rebuilds"] == 2
+        assert result["report"]["llm_calls"] == 2 + 2
+        assert llm.max_active == 1
+
+    saved = dict(Config.SUMMARY)
+    Config.SUMMARY["MIN_CHARS"] = 10
+    try:
+        with relaxed_api_manager():
+            asyncio.run(run())
+    finally:
+        Config.SUMMARY.update(saved)
+
+if __name__ == "__main__":
+    test_compile_biography()
+    test_overlapping_compiles_keep_separate_reports()
+    test_sub_theme_summaries_counted_and_limited()
+    print("全书汇编测试通过")
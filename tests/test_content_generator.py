@@ -0,0 +1,148 @@
+import asyncio
+import os
+import tempfile
+from datetime import datetime
+from config.config import Config
+from core.biography_compiler import BiographyCompiler
+from core.content_generator import ContentGenerator
+from core.generation_cache import GenerationCache
+from core.summary_cache import SummaryCache
+from models.content_manager import ContentSegment, SubTheme, ThematicContent
+from utils.api_manager import api_manager
+from utils.lazy import LazyObject
+from utils.usage_tracker import UsageTracker
+from helpers import FakeLLM, FakeMessage, make_segment, make_turn, relaxed_api_manager
+
+class GeneratorLLM(FakeLLM):
+    """记录摘要请求和生成请求的模型"""
+    model_name = "fake-generator"
+
+    def __init__(self):
+        super().__init__()
+        self.summaries = []
+        self.prompts = []
+
+    def reply(self, messages):
+        human = messages[1].content
+        if "简洁的摘要" in messages[0].content:
+            self.summaries.append(human)
+            return FakeMessage(f"摘要{len(self.summaries)}")
+        self.prompts.append(human)
+        return FakeMessage("生成的叙述")
+
+def make_family_segment(content: str) -> ContentSegment:
+    return make_segment(content, dialogue_context=[make_turn(content)])
+
+def make_sub_theme(name: str, count: int) -> SubTheme:
+    return SubTheme(
+        name=name,
+        content_segments=[make_family_segment(f"{name}的第{i}段回忆" * 20) for i in range(count)],
+        first_mentioned=datetime.now(),
+        last_updated=datetime.now(),
+        related_entities={}
+    )
+
+def make_family_theme(**counts: int) -> ThematicContent:
+    """“家庭”主题，counts为各子主题的片段数"""
+    return ThematicContent(
+        main_theme="家庭",
+        sub_themes={name: make_sub_theme(name, count) for name, count in counts.items()},
+        last_updated=datetime.now()
+    )
+
+def test_cached_sub_theme_summaries():
+    """测试子主题摘要缓存：未变化的子主题不重新摘要，只新增片段时并入原摘要，重启后仍可复用"""
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "summaries.json")
+            theme = make_family_theme(家庭成员=5, 家庭传统=4, 短=1)
+            llm = GeneratorLLM()
+            generator = ContentGenerator(llm, summary_cache=SummaryCache(path))
+
+            await generator.generate_theme_content(theme)
+            assert len(llm.summaries) == 2
+            # 较短的子主题直接使用原始片段，较长的使用摘要
+            assert "短的第0段回忆" in llm.prompts[-1] and "家庭成员的第0段回忆" not in llm.prompts[-1]
+
+            await generator.generate_theme_content(theme)
+            assert len(llm.summaries) == 2 and generator.summary_stats["hits"] == 2
+
+            theme.sub_themes["家庭传统"].content_segments.append(make_family_segment("新的传统"))
+            await generator.generate_theme_content(theme)
+            assert len(llm.summaries) == 3
+            assert "已有摘要：摘要2" in llm.summaries[-1] or "已有摘要：摘要1" in llm.summaries[-1]
+            assert "新的传统" in llm.summaries[-1] and "家庭传统的第0段回忆" not in llm.summaries[-1]
+
+            restarted = ContentGenerator(llm, summary_cache=SummaryCache(path))
+            await restarted.generate_theme_content(theme)
+            assert len(llm.summaries) == 3 and restarted.summary_stats["hits"] == 2
+
+            # 片段被替换时重新摘要
+            theme.sub_themes["家庭成员"].content_segments.pop(0)
+            await restarted.generate_theme_content(theme)
+            assert len(llm.summaries) == 4 and restarted.summary_stats["rebuilds"] == 1
+
+    with relaxed_api_manager():
+        asyncio.run(run())
+
+def test_generation_memoization():
+    """测试输入指纹相同的生成请求直接返回已有结果：重启后、全书汇编中同样生效；片段或模型变化时重新生成"""
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "generation_cache.json")
+            theme = make_family_theme(家庭成员=2)
+            llm = GeneratorLLM()
+            generator = ContentGenerator(llm, generation_cache=GenerationCache(path))
+            first = await generator.generate_theme_content(theme)
+            assert await generator.generate_theme_content(theme) == first
+            assert len(llm.prompts) == 1 and generator.generation_stats["hits"] == 1
+
+            # 恢复或导入重放后内容片段相同
+            restarted = ContentGenerator(llm, generation_cache=GenerationCache(path))
+            assert await restarted.generate_theme_content(theme.model_copy(deep=True)) == first
+            result = await BiographyCompiler(restarted).compile({"家庭": theme})
+            assert result["report"]["cached"] == ["家庭"] and result["report"]["llm_calls"] == 0
+            assert len(llm.prompts) == 1
+
+            theme.sub_themes["家庭成员"].content_segments.append(make_family_segment("新的回忆"))
+            await restarted.generate_theme_content(theme)
+            assert len(llm.prompts) == 2
+
+            llm.model_name = "another-model"
+            await restarted.generate_theme_content(theme)
+            assert len(llm.prompts) == 3
+
+    with relaxed_api_manager():
+        asyncio.run(run())
+
+def test_no_memoization_when_degraded():
+    """测试预算接近上限（可能已改用低价模型）时生成结果不记入主模型的指纹"""
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            theme = make_family_theme(家庭成员=2)
+            llm = GeneratorLLM()
+            # 超出预算后生成请求改用低价模型（这里仍由同一个模型应答）
+            api_manager.register_fallback("generate", llm)
+            generator = ContentGenerator(llm, generation_cache=GenerationCache(os.path.join(tmp_dir, "cache.json")))
+            api_manager.usage.record("generate", "fake-generator", 90, 0)
+            assert api_manager.usage.status() == "degraded"
+            await generator.generate_theme_content(theme)
+            await generator.generate_theme_content(theme)
+            assert len(llm.prompts) == 2 and generator.generation_stats["skipped_degraded"] == 2
+
+    with relaxed_api_manager(UsageTracker({**Config.USAGE, "SESSION_BUDGET": {"TOKENS": 100, "COST": None}})):
+        asyncio.run(run())
+
+def test_lazy_proxy_does_not_shadow_get():
+    """测试延迟构建的缓存经代理调用时，get转发给缓存本身"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cache = LazyObject(lambda: SummaryCache(os.path.join(tmp_dir, "summaries.json")))
+        cache.put("家庭", "家庭成员", ["a"], "摘要")
+        assert cache.get("家庭", "家庭成员")["summary"] == "摘要"
+
+if __name__ == "__main__":
+    test_cached_sub_theme_summaries()
+    test_generation_memoization()
+    test_no_memoization_when_degraded()
+    test_lazy_proxy_does_not_shadow_get()
+    print("内容生成测试通过")
@@ -0,0 +1,123 @@
+import asyncio
+import json
+import os
+import tempfile
+from config.config import Config
+from core.content_processor import ContentProcessor
+from core.gazetteer import EntityGazetteer
+from core.knowledge_graph import KnowledgeGraph
+from core.vector_store import VectorStoreManager
+from helpers import FakeLLM, FakeMessage, HashEmbeddings, make_turn, relaxed_api_manager
+
+class ExtractLLM(FakeLLM):
+    """返回固定抽取结果的模型"""
+
+    def reply(self, messages):
+        if "关系抽取" in messages[0].content:
+            return FakeMessage('[{"from": "姐姐", "relation": "一起团聚", "to": "父母"}]')
+        return FakeMessage(json.dumps({
+            "entities": {"人物": ["外婆"], "地点": ["镇上"], "事件": ["赶集"]},
+            "relations": [{"from": "外婆", "relation": "带去", "to": "镇上"}],
+            "keywords": ["赶集", "糖葫芦"]
+        }, ensure_ascii=False))
+
+class IdentifyLLM(FakeLLM):
+    """首次识别为家庭，按补全后的实体识别时增加早年生活"""
+
+    def reply(self, messages):
+        if "地点" in messages[1].content:
+            return FakeMessage('["家庭", "早年生活"]')
+        return FakeMessage('["家庭"]')
+
+def make_processor(tmp_dir: str, **components) -> ContentProcessor:
+    """使用本地向量库和临时词典的内容处理器，components覆盖默认的模型等组件"""
+    return ContentProcessor(**{
+        "extract_llm": ExtractLLM(),
+        "identify_llm": IdentifyLLM(),
+        "vector_store": VectorStoreManager(
+            HashEmbeddings(), persist_directory=os.path.join(tmp_dir, "vectors"),
+            lexical_dir="", tenant="alice", backend="local"
+        ),
+        "gazetteer": EntityGazetteer(storage_path=os.path.join(tmp_dir, "gazetteer.json")),
+        "session_id": "alice",
+        **components
+    })
+
+def test_refinement_updates_stored_segment():
+    """测试后台补全后重新识别主题，并更新向量库、词法索引和知识图谱"""
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            knowledge_graph = KnowledgeGraph(storage_path=os.path.join(tmp_dir, "graph.jsonl"))
+            refined = []
+
+            async def on_refined(segment, new_themes):
+                refined.append((segment.id, new_themes))
+
+            processor = make_processor(tmp_dir, knowledge_graph=knowledge_graph, on_refined=on_refined)
+            vector_store = processor.vector_store
+            turn = make_turn("小时候外婆常带我去镇上赶集，买糖葫芦吃。")
+            segment = await processor.process_dialogue(turn, [turn])
+            assert segment.themes == ["家庭"]
+            await asyncio.gather(*processor._refine_tasks)
+
+            assert segment.themes == ["家庭", "早年生活"]
+            assert refined == [(segment.id, ["早年生活"])]
+            assert knowledge_graph.relations_for_segments([segment.id]) == [("外婆", "带去", "镇上")]
+
+            results = await vector_store.search_similar("赶集", entities=["赶集"], themes=["早年生活"])
+            assert [r["metadata"]["id"] for r in results] == [segment.id]
+            stats = await vector_store.tenant_stats("alice")
+            assert stats["documents"] == 1 and stats["lexical_documents"] == 1
+            results = await vector_store.search_lexical("糖葫芦", entities=["镇上"])
+            assert [r["metadata"]["id"] for r in results] == [segment.id]
+            vector_store.close()
+
+    with relaxed_api_manager():
+        asyncio.run(run())
+
+def test_relations_refined_on_gazetteer_path():
+    """测试词典完全覆盖时不等待LLM，启用REFINE_RELATIONS后由后台只补全关系（不重新识别主题）"""
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            extract_llm, identify_llm = ExtractLLM(), IdentifyLLM()
+            knowledge_graph = KnowledgeGraph(storage_path=os.path.join(tmp_dir, "graph.jsonl"))
+            processor = make_processor(
+                tmp_dir, extract_llm=extract_llm, identify_llm=identify_llm, knowledge_graph=knowledge_graph
+            )
+            turn = make_turn("去年春节，我和父母、姐姐一起在北京的家里团聚")
+            segment = await processor.process_dialogue(turn, [turn])
+            assert segment.relations == [] and extract_llm.calls == 0
+            await asyncio.gather(*processor._refine_tasks)
+
+            assert extract_llm.calls == 1 and identify_llm.calls == 1
+            assert segment.relations == [{"from": "姐姐", "relation": "一起团聚", "to": "父母"}]
+            assert knowledge_graph.relations_for_segments([segment.id]) == [("姐姐", "一起团聚", "父母")]
+            processor.vector_store.close()
+
+    saved = Config.GAZETTEER["REFINE_RELATIONS"]
+    Config.GAZETTEER["REFINE_RELATIONS"] = True
+    try:
+        with relaxed_api_manager():
+            asyncio.run(run())
+    finally:
+        Config.GAZETTEER["REFINE_RELATIONS"] = saved
+
+def test_no_refinement_when_gazetteer_covers_text():
+    """测试默认配置下词典完全覆盖的内容不调用抽取模型"""
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            extract_llm = ExtractLLM()
+            processor = make_processor(tmp_dir, extract_llm=extract_llm)
+            turn = make_turn("去年春节，我和父母、姐姐一起在北京的家里团聚")
+            await processor.process_dialogue(turn, [turn])
+            assert not processor._refine_tasks and extract_llm.calls == 0
+            processor.vector_store.close()
+
+    with relaxed_api_manager():
+        asyncio.run(run())
+
+if __name__ == "__main__":
+    test_refinement_updates_stored_segment()
+    test_relations_refined_on_gazetteer_path()
+    test_no_refinement_when_gazetteer_covers_text()
+    print("内容处理测试通过")
@@ -0,0 +1,110 @@
+import asyncio
+import os
+import tempfile
+import tracemalloc
+from config.config import Config
+from core.dialogue_manager import DialogueManager
+from core.dialogue_memory import DialogueMemory
+from models.schemas import DialogueContext, DialogueTurn
+from helpers import make_turn
+
+def make_indexed_turn(index: int) -> DialogueTurn:
+    return make_turn(
+        f"第{index}轮的回答" * 10, Config.TOPICS[index % len(Config.TOPICS)],
+        question=f"问题{index}", emotion_score=(index % 10) / 10
+    )
+
+def test_memory_bounded_over_long_session():
+    """测试一万轮对话后内存中的记忆仍有上限，移出的轮次全部写入磁盘"""
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            config = Config.ATTENTION_MEMORY
+            memory = DialogueMemory()
+            memory.reset(spill_dir=tmp_dir)
+
+            tracemalloc.start()
+            for i in range(2000):
+                await memory.add(make_indexed_turn(i))
+            baseline = tracemalloc.get_traced_memory()[0]
+            for i in range(2000, 10000):
+                await memory.add(make_indexed_turn(i))
+            growth = tracemalloc.get_traced_memory()[0] - baseline
+            tracemalloc.stop()
+            # 每轮对话对象约1KB，没有上限时会增长数MB
+            assert growth < 200 * 1024, growth
+
+            assert len(memory.short_term) == config["SHORT_TERM_SIZE"]
+            assert [t.question for t in memory.recent(3)] == ["问题9997", "问题9998", "问题9999"]
+            assert all(len(turns) <= config["LONG_TERM_SIZE"] for turns in memory.long_term.values())
+            assert all(len(scores) <= config["EMOTION_WINDOW"] for scores in memory.emotion_history.values())
+            assert set(memory.topic_weights) == set(Config.TOPICS)
+            assert sum(s["count"] for s in memory.emotion_stats.values()) == 10000
+            assert abs(memory.emotion_stats["家庭"]["mean"] - 0.45) < 0.01
+
+            await memory.flush()
+            lines = 0
+            for filename in os.listdir(tmp_dir):
+                with open(os.path.join(tmp_dir, filename), encoding='utf-8') as f:
+                    lines += sum(1 for _ in f)
+            assert lines == 10000 - config["SHORT_TERM_SIZE"]
+
+            topic = Config.TOPICS[0]
+            recalled = await memory.recall(topic)
+            assert len(recalled) > config["LONG_TERM_SIZE"]
+            assert [t.id for t in recalled[-config["LONG_TERM_SIZE"]:]] == [t.id for t in memory.long_term[topic]]
+
+    asyncio.run(run())
+
+def test_restore_memory():
+    """测试恢复会话后短期记忆、滚动统计和长期记忆与保存前一致"""
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            config = {**Config.ATTENTION_MEMORY, "SPILL_DIR": tmp_dir, "SHORT_TERM_SIZE": 5, "LONG_TERM_SIZE": 3}
+            memory = DialogueMemory(config)
+            memory.reset("session")
+            for i in range(30):
+                await memory.add(make_indexed_turn(i))
+            await memory.flush()
+
+            restored = DialogueMemory(config)
+            await restored.restore("session", memory.recent(), memory.state())
+            assert [t.id for t in restored.recent()] == [t.id for t in memory.recent()]
+            assert restored.topic_weights == memory.topic_weights
+            assert restored.emotion_stats == memory.emotion_stats
+            assert {topic: [t.id for t in turns] for topic, turns in restored.long_term.items()} == \
+                {topic: [t.id for t in turns] for topic, turns in memory.long_term.items()}
+
+    asyncio.run(run())
+
+def test_topic_selection_explores_unvisited_topics():
+    """测试选择新话题时优先覆盖未聊过的话题（其中已有预生成问题的优先），兴趣度明显更高的旧话题才会被再次选中"""
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            manager = DialogueManager(None)
+            manager.attention_memory.reset(spill_dir=tmp_dir)
+            for topic in ["家庭", "早年生活", "友谊"]:
+                await manager.attention_memory.add(make_turn(topic=topic, interest_score=0.7))
+            context = DialogueContext(
+                current_topic="家庭", depth_level=0, recent_entities=[], emotion_state=0.0,
+                interest_level=0.5, pending_questions=[], last_response=""
+            )
+            metrics = {"emotion_score": 0.0, "interest_score": 0.5, "completion_score": 0.7, "topic_weight": 0.5}
+
+            chosen = {manager._select_new_topic(context, metrics, "家庭") for _ in range(50)}
+            assert not chosen & {"家庭", "早年生活", "友谊"} and len(chosen) > 1
+
+            key = manager.speculator.fingerprint({"action": "switch", "new_topic": "旅行"}, context)
+            manager.speculator.cache[key] = "去过哪些地方旅行？"
+            assert manager._select_new_topic(context, metrics, "家庭") == "旅行"
+
+            for _ in range(5):
+                await manager.attention_memory.add(make_turn(topic="友谊", interest_score=1.0))
+            assert manager._select_new_topic(context, metrics, "家庭") == "友谊"
+
+    asyncio.run(run())
+
+if __name__ == "__main__":
+    test_memory_bounded_over_long_session()
+    test_restore_memory()
+    test_topic_selection_explores_unvisited_topics()
+    print("对话记忆测试通过")
@@ -0,0 +1,64 @@
+import json
+import os
+import tempfile
+from core.gazetteer import EntityGazetteer
+
+def test_seed_extraction():
+    """测试预置词典的实体抽取"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        gazetteer = EntityGazetteer(storage_path=os.path.join(tmp_dir, "gazetteer.json"))
+        result = gazetteer.extract("去年春节，我和父母、姐姐一起在北京的家里团聚，大家一起包饺子，很开心。")
+
+        print(f"实体: {result['entities']}")
+        print(f"覆盖率: {result['coverage']}")
+        assert result['entities']['人物'] == ["我", "父母", "姐姐"]
+        assert result['entities']['时间'] == ["去年春节"]  # 最长匹配
+        assert "北京" in result['keywords']
+        assert result['confidence']['姐姐'] > 0.9
+        assert gazetteer.is_known("去年春节，我和父母、姐姐一起在北京的家里团聚")
+
+def test_learning_and_persistence():
+    """测试从LLM结果学习并持久化"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "gazetteer.json")
+        gazetteer = EntityGazetteer(storage_path=path)
+        text = "我在硅谷做芯片设计"
+        assert not gazetteer.is_known(text)
+
+        gazetteer.learn({"地点": ["硅谷"], "事件": ["芯片设计"]})
+        gazetteer.save()
+
+        reloaded = EntityGazetteer(storage_path=path)
+        result = reloaded.extract(text)
+        print(f"学习后的实体: {result['entities']}")
+        assert result['entities']['地点'] == ["硅谷"]
+        assert result['confidence']['硅谷'] < result['confidence']['我']
+        assert reloaded.is_known(text)
+
+def test_incremental_save_and_legacy_file():
+    """测试每次保存只追加新学习的词条，并能读取旧版整体保存的词典"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "gazetteer.json")
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({"硅谷": {"地点": 2}}, f, ensure_ascii=False, indent=2)
+        gazetteer = EntityGazetteer(storage_path=path)
+        assert gazetteer.extract("硅谷")['entities'] == {"地点": ["硅谷"]}
+
+        gazetteer.learn({"事件": ["芯片设计"]})
+        gazetteer.save()
+        size = os.path.getsize(path)
+        gazetteer.save()
+        assert os.path.getsize(path) == size  # 没有新词条时不写入
+        gazetteer.learn({"地点": ["硅谷"]})
+        gazetteer.save()
+        with open(path, 'r', encoding='utf-8') as f:
+            assert f.read().splitlines()[-1] == '{"硅谷": {"地点": 1}}'
+
+        reloaded = EntityGazetteer(storage_path=path)
+        assert reloaded.extract("在硅谷做芯片设计")['entities'] == {"地点": ["硅谷"], "事件": ["芯片设计"]}
+        assert reloaded._confidence(reloaded._longest_match("硅谷", 0)[1]) == ("地点", 0.75)
+
+if __name__ == "__main__":
+    test_seed_extraction()
+    test_learning_and_persistence()
+    test_incremental_save_and_legacy_file()
@@ -0,0 +1,45 @@
+from utils.json_parser import ResponseParser
+
+def test_extract_from_prose_and_code_fence():
+    """测试从说明文字和代码块中提取数组和对象"""
+    text = '根据分析，相关主题为：\n```json\n["家庭", "早年生活"]\n```\n以上。'
+    assert ResponseParser.parse_llm_response(text, schema=[str]) == ["家庭", "早年生活"]
+
+    text = '分析如下 {"entities": {"人物": ["我", "父母"]}, "keywords": ["教育"]} 希望有帮助'
+    result = ResponseParser.parse_llm_response(text, schema={"entities": dict})
+    assert result["entities"]["人物"] == ["我", "父母"]
+
+def test_multiple_candidates_and_brackets_in_strings():
+    """测试跳过不符合schema的候选，字符串中的括号不影响配对"""
+    text = '[注意] 结果：["友谊", "影响"]'
+    assert ResponseParser.parse_llm_response(text, schema=[str]) == ["友谊", "影响"]
+
+    text = '{"entities": {"事件": ["看《西游记}》"]}, "keywords": []}'
+    result = ResponseParser.parse_llm_response(text, schema={"entities": dict})
+    assert result["entities"]["事件"] == ["看《西游记}》"]
+
+def test_repair():
+    """测试尾逗号、单引号、Python字面量和截断输出的修复"""
+    prompt = "test_repair"
+    ResponseParser.reset_stats()
+    assert ResponseParser.parse_llm_response('["家庭", "旅行",]', prompt=prompt) == ["家庭", "旅行"]
+    assert ResponseParser.parse_llm_response("['家庭', '旅行']", prompt=prompt) == ["家庭", "旅行"]
+    assert ResponseParser.parse_llm_response('{"ok": True, "x": None}', prompt=prompt) == {"ok": True, "x": None}
+    assert ResponseParser.parse_llm_response('{"keywords": ["学习", "从', prompt=prompt) == {"keywords": ["学习", "从"]}
+    assert ResponseParser.stats() == {prompt: {"attempts": 4, "repairs": 4, "failures": 0}}
+
+def test_failure_counted_per_prompt():
+    """测试解析失败时返回默认值并按提示词计数"""
+    prompt = "test_failure"
+    ResponseParser.reset_stats()
+    assert ResponseParser.parse_llm_response("没有JSON", prompt=prompt, default=[]) == []
+    assert ResponseParser.parse_llm_response('{"a": 1}', schema=[str], prompt=prompt, default=[]) == []
+    assert ResponseParser.parse_llm_response("无法解析") == {"entities": {}, "keywords": []}
+    assert ResponseParser.failures[prompt] == 2
+    assert ResponseParser.stats()["default"] == {"attempts": 1, "repairs": 0, "failures": 1}
+
+if __name__ == "__main__":
+    test_extract_from_prose_and_code_fence()
+    test_multiple_candidates_and_brackets_in_strings()
+    test_repair()
+    test_failure_counted_per_prompt()
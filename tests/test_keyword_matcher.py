@@ -0,0 +1,73 @@
+import asyncio
+import os
+import tempfile
+from config.config import Config
+from core.dialogue_manager import DialogueManager
+from core.keyword_matcher import KeywordMatcher
+from core.sub_theme_clusterer import SubThemeClusterer
+from models.schemas import DialogueContext
+from helpers import make_segment
+
+def make_context(last_response: str, current_topic: str = "家庭") -> DialogueContext:
+    return DialogueContext(
+        current_topic=current_topic,
+        depth_level=0,
+        recent_entities=[],
+        emotion_state=0.0,
+        interest_level=0.5,
+        pending_questions=[],
+        last_response=last_response
+    )
+
+def test_single_pass_matching():
+    """测试重叠、嵌套的关键词在一次扫描中全部命中"""
+    matcher = KeywordMatcher({
+        "代词": ["he", "she", "his", "hers"],
+        "时期": ["小时候", "时候"],
+        "家人": ["姐姐", "姐"]
+    })
+    assert matcher.match("ushers") == {"代词": ["she", "he", "hers"]}
+    assert matcher.match("小时候姐姐教我骑车，那时候她也是小孩") == {
+        "时期": ["小时候", "时候", "时候"],
+        "家人": ["姐", "姐姐", "姐"]
+    }
+    assert [start for start, _, _ in matcher.iter_matches("USHERS")] == [1, 2, 2]
+    assert matcher.match("没有任何关键词") == {}
+
+def test_dialogue_heuristics():
+    """测试切换请求、简短否定回答和所有话题的关键词识别"""
+    manager = DialogueManager(None)
+    metrics = {"emotion_score": 0.0, "interest_score": 0.5, "completion_score": 0.7, "topic_weight": 0.5}
+
+    strategy = manager._determine_question_strategy(metrics, make_context("我们换个话题吧，聊聊我的工作和公司"))
+    assert strategy["action"] == "switch" and strategy["new_topic"] == "职业生涯"
+    assert manager._determine_question_strategy(metrics, make_context("不记得了"))["action"] == "switch"
+    assert manager._determine_question_strategy(metrics, make_context("家里一直很热闹，没有吵过架"))["action"] == "continue"
+
+    for topic in Config.TOPICS:
+        keywords = Config.KEYWORDS["TOPICS"][topic]
+        if keywords and topic != "家庭":
+            assert manager._select_new_topic(make_context(f"说起{keywords[0]}"), metrics, "家庭") == topic
+    # 当前话题的关键词不作为新话题
+    assert manager._select_new_topic(make_context("爸爸妈妈和朋友"), metrics, "家庭") == "友谊"
+
+def test_sub_theme_names_from_keywords():
+    """测试新建子主题时优先用关键词表中的名称命名"""
+    async def embed(segment):
+        return [1.0, 0.0] if "春节" in segment.content else [0.0, 1.0]
+
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            clusterer = SubThemeClusterer(embed, os.path.join(tmp_dir, "clusters.json"))
+            segment = make_segment("每年春节全家一起过年，这是我们的传统", entities={"事件": ["过年"]})
+            assert (await clusterer.assign("家庭", segment))[0] == "家庭传统"
+            other = segment.model_copy(update={"content": "海边的小屋", "entities": {"地点": ["海边"]}})
+            assert (await clusterer.assign("家庭", other))[0] == "海边"
+
+    asyncio.run(run())
+
+if __name__ == "__main__":
+    test_single_pass_matching()
+    test_dialogue_heuristics()
+    test_sub_theme_names_from_keywords()
+    print("关键词匹配测试通过")
@@ -0,0 +1,44 @@
+import os
+import tempfile
+import time
+from core.knowledge_graph import KnowledgeGraph
+from helpers import make_segment
+
+def test_graph_queries_and_persistence():
+    """测试图谱查询与增量持久化"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "graph.jsonl")
+        graph = KnowledgeGraph(storage_path=path)
+
+        first = make_segment(
+            "去年春节，我和姐姐一起包饺子。", ["家庭"],
+            {"人物": ["我", "姐姐"], "事件": ["包饺子"]},
+            [{"from": "我", "relation": "一起", "to": "姐姐"}]
+        )
+        second = make_segment(
+            "姐姐带我去北京看升旗。", ["家庭"],
+            {"人物": ["姐姐", "我"], "地点": ["北京"], "事件": ["看升旗"]},
+            [{"from": "姐姐", "relation": "带去", "to": "北京"}]
+        )
+        graph.add_segment(first)
+        graph.add_segment(second)
+        graph.save()
+
+        assert graph.events_involving("姐姐") == ["包饺子", "看升旗"]
+        assert graph.neighbors("我", hops=2) == {"姐姐": 1, "北京": 2}
+        assert graph.segments_for("姐姐") == {first.id, second.id}
+
+        reloaded = KnowledgeGraph(storage_path=path)
+        assert reloaded.events_involving("姐姐") == ["包饺子", "看升旗"]
+        assert reloaded.relations_for_segments([second.id]) == [("姐姐", "带去", "北京")]
+
+        start = time.perf_counter()
+        for _ in range(1000):
+            reloaded.events_involving("姐姐")
+            reloaded.neighbors("我", hops=2)
+        per_query_ms = (time.perf_counter() - start) * 1000 / 1000
+        print(f"单次查询耗时: {per_query_ms:.4f} 毫秒")
+        assert per_query_ms < 1.0
+
+if __name__ == "__main__":
+    test_graph_queries_and_persistence()
@@ -0,0 +1,51 @@
+import os
+import tempfile
+from core.lexical_index import BigramIndex, tokenize
+
+def test_tokenize():
+    """测试二元组切分"""
+    assert tokenize("姐姐包饺子") == ["姐姐", "姐包", "包饺", "饺子"]
+    assert tokenize("在IBM工作，我") == ["在", "ibm", "工作", "我"]
+
+def test_bm25_search_and_persistence():
+    """测试BM25检索、过滤、删除和持久化"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "lexical.jsonl")
+        index = BigramIndex(storage_path=path)
+        index.add("1", "去年春节，我和姐姐在北京包饺子。", {"theme_家庭": True})
+        index.add("2", "大学时和同学去张家界爬山。", {"theme_旅行": True})
+        index.add("3", "姐姐教我骑自行车。", {"theme_家庭": True})
+
+        results = index.search("张家界", k=3)
+        assert [r['id'] for r in results] == ["2"]
+
+        results = index.search("姐姐", k=3, predicate=lambda m: m.get("theme_家庭", False))
+        assert {r['id'] for r in results} == {"1", "3"}
+
+        index.remove("3")
+        reloaded = BigramIndex(storage_path=path)
+        assert len(reloaded) == 2
+        assert [r['id'] for r in reloaded.search("姐姐", k=3)] == ["1"]
+
+def test_scores_ignore_deleted_documents():
+    """测试删除和覆盖过的文档不影响词项的文档频率，得分与只含现有文档的索引相同"""
+    index = BigramIndex(storage_path="")
+    for i in range(5):
+        index.add(f"old{i}", "姐姐包饺子")
+    for i in range(5):
+        index.remove(f"old{i}")
+    index.add("1", "姐姐包饺子")
+    index.add("2", "和同学去爬山")
+    index.add("2", "和同学去张家界爬山")
+
+    fresh = BigramIndex(storage_path="")
+    fresh.add("1", "姐姐包饺子")
+    fresh.add("2", "和同学去张家界爬山")
+    for query in ["姐姐", "张家界爬山"]:
+        assert [(r['id'], r['score']) for r in index.search(query)] == \
+            [(r['id'], r['score']) for r in fresh.search(query)]
+
+if __name__ == "__main__":
+    test_tokenize()
+    test_bm25_search_and_persistence()
+    test_scores_ignore_deleted_documents()
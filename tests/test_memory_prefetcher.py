@@ -0,0 +1,89 @@
+import asyncio
+from core.memory_prefetcher import MemoryPrefetcher
+from models.schemas import DialogueContext
+
+class GatedStore:
+    """检索在放行前一直等待的向量库"""
+
+    def __init__(self):
+        self.queries = []
+        self.cancelled = []
+        self.gate = asyncio.Event()
+
+    async def search_hybrid(self, query, k=3, mode="hybrid"):
+        self.queries.append(query)
+        try:
+            await self.gate.wait()
+        except asyncio.CancelledError:
+            self.cancelled.append(query)
+            raise
+        return [{"content": f"{query}的记忆"}]
+
+def make_context(topic: str, entities=()) -> DialogueContext:
+    return DialogueContext(
+        current_topic=topic,
+        depth_level=0,
+        recent_entities=list(entities),
+        emotion_state=0.0,
+        interest_level=0.5,
+        pending_questions=[],
+        last_response=""
+    )
+
+def test_schedule_dedupes_and_cancels():
+    """测试相同条件不重复预取，条件变化时取消进行中的预取"""
+    async def run():
+        store = GatedStore()
+        prefetcher = MemoryPrefetcher(store)
+        prefetcher.schedule(make_context("家庭", ["姐姐"]))
+        prefetcher.schedule(make_context("家庭", ["姐姐"]))
+        await asyncio.sleep(0)
+        assert store.queries == ["家庭 姐姐"]
+
+        prefetcher.schedule(make_context("工作", ["同事"]))
+        await asyncio.sleep(0)
+        assert store.queries == ["家庭 姐姐", "工作 同事"]
+        assert store.cancelled == ["家庭 姐姐"]
+
+        store.gate.set()
+        await asyncio.sleep(0)
+        context = make_context("工作", ["同事"])
+        prefetcher.apply(context)
+        # 已缓存的条件不再预取
+        prefetcher.schedule(context)
+        await asyncio.sleep(0)
+        assert len(store.queries) == 2
+
+    asyncio.run(run())
+
+def test_apply_uses_only_finished_results():
+    """测试apply从不等待：预取未完成时保留旧结果，完成后才写入上下文"""
+    async def run():
+        store = GatedStore()
+        prefetcher = MemoryPrefetcher(store)
+        context = make_context("家庭", ["姐姐"])
+        prefetcher.schedule(context)
+        await asyncio.sleep(0)
+
+        prefetcher.apply(context)
+        assert context.related_memories == []
+
+        store.gate.set()
+        await asyncio.sleep(0)
+        prefetcher.apply(context)
+        assert context.related_memories == [{"content": "家庭 姐姐的记忆"}]
+
+        # 新的预取未完成时仍使用上一次的结果
+        store.gate.clear()
+        following = make_context("工作")
+        prefetcher.schedule(following)
+        prefetcher.apply(following)
+        assert following.related_memories == [{"content": "家庭 姐姐的记忆"}]
+        prefetcher._task.cancel()
+
+    asyncio.run(run())
+
+if __name__ == "__main__":
+    test_schedule_dedupes_and_cancels()
+    test_apply_uses_only_finished_results()
+    print("记忆预取测试通过")
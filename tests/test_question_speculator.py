@@ -0,0 +1,73 @@
+import asyncio
+from config.config import Config
+from core.dialogue_manager import DialogueManager
+from models.schemas import DialogueContext
+from helpers import FakeLLM, FakeMessage, relaxed_api_manager
+
+METRICS = {"emotion_score": 0.0, "interest_score": 0.5, "completion_score": 0.7, "topic_weight": 0.5}
+
+class QuestionLLM(FakeLLM):
+    """按提示中的实体返回候选问题"""
+
+    def reply(self, messages):
+        entities = messages[1].content.split("最近提到的实体:")[1].strip()
+        return FakeMessage(f"关于{entities}的问题{self.calls}")
+
+def make_context(recent_entities, last_response: str = "") -> DialogueContext:
+    return DialogueContext(
+        current_topic="家庭",
+        depth_level=0,
+        recent_entities=list(recent_entities),
+        emotion_state=0.0,
+        interest_level=0.5,
+        pending_questions=[],
+        last_response=last_response
+    )
+
+def make_manager() -> DialogueManager:
+    manager = DialogueManager(QuestionLLM())
+    manager.speculator.config = {**Config.SPECULATION, "ENABLED": True, "BRANCHES": 1}
+    return manager
+
+async def speculate(manager: DialogueManager, context: DialogueContext):
+    manager.speculator.speculate(METRICS, context)
+    await asyncio.gather(*manager.speculator._tasks)
+
+def test_speculated_question_hit():
+    """测试回答后上下文与预生成时一致时直接返回候选问题"""
+    async def run():
+        manager = make_manager()
+        await speculate(manager, make_context(["姐姐"]))
+        context = make_context(["姐姐"], last_response="姐姐教我骑车，那时候家里在老家的院子里")
+        assert await manager.generate_next_question(METRICS, context) == "关于姐姐的问题1"
+        assert manager.speculator.stats()["hits"] == 1 and manager.llm.calls == 1
+
+    with relaxed_api_manager():
+        asyncio.run(run())
+
+def test_speculation_keyed_on_strategy_branch():
+    """测试候选问题按策略分支命中（最近实体变化不影响），查询后不会留到之后的轮次"""
+    async def run():
+        manager = make_manager()
+        speculator = manager.speculator
+        await speculate(manager, make_context(["姐姐"]))
+        strategy = manager._determine_question_strategy(METRICS, make_context(["姐姐"]))
+        assert speculator.fingerprint(strategy, make_context(["姐姐"])) == \
+            speculator.fingerprint(strategy, make_context(["姐姐", "老家"]))
+        deeper = {**strategy, "depth_change": strategy.get("depth_change", 0) + 1}
+        assert speculator.fingerprint(deeper, make_context(["姐姐"])) != \
+            speculator.fingerprint(strategy, make_context(["姐姐"]))
+
+        # 新的回答带来了新的实体，同一策略分支仍然命中
+        assert speculator.lookup(strategy, make_context(["姐姐", "老家"])) == "关于姐姐的问题1"
+        # 本轮查询后候选问题已清空，之后的轮次不再返回
+        assert speculator.lookup(strategy, make_context(["姐姐"])) is None
+        assert speculator.stats()["hits"] == 1 and not speculator.cache
+
+    with relaxed_api_manager():
+        asyncio.run(run())
+
+if __name__ == "__main__":
+    test_speculated_question_hit()
+    test_speculation_keyed_on_strategy_branch()
+    print("问题预生成测试通过")
@@ -0,0 +1,211 @@
+import asyncio
+import tempfile
+from core.storage_manager import StorageManager
+from core.sub_theme_clusterer import SubThemeClusterer
+from core.theme_manager import ThemeManager
+from models.schemas import DialogueTurn
+from utils.auto_save import ChangeTracker
+from utils.lru_cache import LazyLRUDict
+from helpers import make_segment
+
+def test_lazy_lru_dict():
+    """测试按需加载、LRU淘汰，未保存的值不被淘汰"""
+    loaded, dirty = [], {"a"}
+    cache = LazyLRUDict(
+        loader=lambda key: loaded.append(key) or f"value-{key}",
+        capacity=2,
+        keys=["a", "b", "c", "d"],
+        pinned=lambda key: key in dirty
+    )
+    assert "a" in cache and not loaded  # 检查键不触发加载
+    assert cache["a"] == "value-a"
+    cache["b"]
+    cache["c"]
+    assert loaded == ["a", "b", "c"]
+    assert cache.is_loaded("a") and not cache.is_loaded("b")
+
+    dirty.clear()
+    assert asyncio.run(cache.load("d")) == "value-d"
+    assert not cache.is_loaded("a") and cache.is_loaded("c")
+    assert asyncio.run(cache.load("e")) is None
+    assert len(cache) == 4
+
+def test_theme_round_trip():
+    """测试主题写入磁盘后按需加载"""
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            storage = StorageManager(tmp_dir)
+            theme_manager = ThemeManager()
+            for i in range(3):
+                await theme_manager.update_theme_content(
+                    "家庭", make_segment(f"姐姐的故事{i}", ["家庭"])
+                )
+            await storage.save_theme_data(theme_manager.themes)
+            await storage.save_session({"theme_stats": theme_manager.theme_stats})
+
+            resumed = ThemeManager()
+            resumed.themes = LazyLRUDict(
+                loader=storage.read_theme,
+                capacity=1,
+                keys=storage.list_themes()
+            )
+            resumed.theme_stats = (await storage.load_session())["theme_stats"]
+            assert resumed.theme_stats["家庭"]["segment_count"] == 3
+            assert not resumed.themes.is_loaded("家庭")
+
+            theme = await resumed.get_theme("家庭")
+            segments = theme.sub_themes["general"].content_segments
+            assert [s.content for s in segments] == ["姐姐的故事0", "姐姐的故事1", "姐姐的故事2"]
+            assert theme.sub_themes["general"].related_entities == {"人物": {"姐姐"}}
+
+    asyncio.run(run())
+
+def test_segments_stored_by_reference():
+    """测试轮次和片段只存一份，主题间共享同一对象"""
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            storage = StorageManager(tmp_dir)
+            theme_manager = ThemeManager()
+            turn = DialogueTurn(
+                id="turn-1", question="小时候住在哪里？", answer="和姐姐住在老家",
+                topic="童年", emotion_score=0.6, interest_score=0.7, depth_level=1
+            )
+            segment = make_segment("和姐姐住在老家", ["童年", "家庭"], dialogue_context=[turn])
+            for theme in segment.themes:
+                await theme_manager.update_theme_content(theme, segment)
+            await storage.append_dialogue_turns([turn])
+            await storage.save_theme_data(theme_manager.themes)
+            assert len(list(storage.segment_table)) == 1
+
+            # 内容未变化时不重复写入，变化后追加新版本
+            size = storage.segment_table.size_bytes()
+            await storage.save_theme_data(theme_manager.themes)
+            assert storage.segment_table.size_bytes() == size
+            segment.keywords.append("老家")
+            await storage.save_theme_data(theme_manager.themes)
+            assert storage.segment_table.size_bytes() > size
+
+            resumed = StorageManager(tmp_dir)
+            childhood = resumed.read_theme("童年").sub_themes["general"].content_segments[0]
+            family = resumed.read_theme("家庭").sub_themes["general"].content_segments[0]
+            assert childhood is family
+            assert childhood.keywords == ["老家"]
+            assert childhood.dialogue_context[0].answer == "和姐姐住在老家"
+
+    asyncio.run(run())
+
+def test_msgpack_round_trip():
+    """测试msgpack格式的读写、快速加载与存储结构版本检查"""
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            storage = StorageManager(tmp_dir, storage_format="msgpack")
+            theme_manager = ThemeManager()
+            turn = DialogueTurn(
+                id="turn-1", question="第一份工作是什么？", answer="在上海的公司做会计",
+                topic="工作", emotion_score=0.5, interest_score=0.8, depth_level=2
+            )
+            segment = make_segment("在上海的公司做会计", ["工作"], dialogue_context=[turn])
+            await theme_manager.update_theme_content("工作", segment)
+            await storage.append_dialogue_turns([turn])
+            await storage.save_theme_data(theme_manager.themes)
+            assert storage.list_themes() == ["工作"]
+
+            fast = StorageManager(tmp_dir, storage_format="msgpack").read_theme("工作")
+            validating = StorageManager(tmp_dir, storage_format="msgpack")
+            validating.fast_load = False
+            validated = validating.read_theme("工作")
+            assert fast == validated
+            assert fast.sub_themes["general"].content_segments[0].dialogue_context[0] == turn
+
+            # 末尾不完整的记录被忽略
+            with open(storage.turn_table.path, 'ab') as f:
+                f.write(b"\x10\x00")
+            assert "turn-1" in StorageManager(tmp_dir, storage_format="msgpack").turn_table
+
+            storage.segment_table.append({**storage._serialize_content_segment(segment), "v": 99})
+            newer = StorageManager(tmp_dir, storage_format="msgpack")
+            try:
+                newer.read_theme("工作")
+                assert False, "应拒绝更高版本的记录"
+            except ValueError:
+                pass
+
+    asyncio.run(run())
+
+def test_theme_snapshot_isolated_from_refinement():
+    """测试保存用的主题快照不受之后在事件循环中补全片段的影响"""
+    async def run():
+        theme_manager = ThemeManager()
+        segment = make_segment("姐姐的故事", ["家庭"])
+        await theme_manager.update_theme_content("家庭", segment)
+        snapshot = StorageManager._snapshot_theme(theme_manager.themes["家庭"])
+
+        # 后台补全扩充片段的实体、关键词和关系
+        segment.entities["人物"].append("妈妈")
+        segment.entities.setdefault("地点", []).append("老家")
+        segment.keywords.append("故事")
+        segment.relations.append({"from": "姐姐", "relation": "讲", "to": "故事"})
+
+        saved = snapshot.sub_themes["general"].content_segments[0]
+        assert saved.entities == {"人物": ["姐姐"]}
+        assert saved.keywords == [] and saved.relations == []
+
+    asyncio.run(run())
+
+def test_reloaded_theme_shares_live_segment():
+    """测试淘汰后重新加载的主题取回原片段对象，之后的补全在再次保存时写入"""
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            storage = StorageManager(tmp_dir)
+            theme_manager = ThemeManager()
+            segment = make_segment("姐姐的故事", ["家庭"])
+            await theme_manager.update_theme_content("家庭", segment)
+            await storage.save_theme_data(theme_manager.themes)
+
+            reloaded = storage.read_theme("家庭")
+            assert reloaded.sub_themes["general"].content_segments[0] is segment
+
+            # 后台补全修改原片段，保存重新加载的主题时写入新内容
+            segment.keywords.append("故事")
+            await storage.save_theme_data({"家庭": reloaded})
+            resumed = StorageManager(tmp_dir)
+            assert resumed.read_theme("家庭").sub_themes["general"].content_segments[0].keywords == ["故事"]
+
+    asyncio.run(run())
+
+def test_new_theme_pinned_during_update():
+    """测试新建的主题在更新期间即被标记，不会在保存前被淘汰"""
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            storage = StorageManager(tmp_dir)
+            async def embed(segment):
+                await asyncio.sleep(0)
+                return [1.0, 0.0]
+
+            tracker = ChangeTracker()
+            theme_manager = ThemeManager(
+                tracker=tracker, clusterer=SubThemeClusterer(embed, f"{tmp_dir}/clusters.json")
+            )
+            theme_manager.themes = LazyLRUDict(
+                loader=storage.read_theme, capacity=1,
+                pinned=lambda theme: tracker.is_dirty("themes", theme)
+            )
+            # 两个主题的更新在等待嵌入向量时交错进行，尚未保存的主题都留在内存中
+            await asyncio.gather(
+                theme_manager.update_theme_content("家庭", make_segment("姐姐的故事", ["家庭"])),
+                theme_manager.update_theme_content("工作", make_segment("第一份工作", ["工作"]))
+            )
+            assert theme_manager.themes.is_loaded("家庭") and theme_manager.themes.is_loaded("工作")
+            family = await theme_manager.get_theme("家庭")
+            assert [s.content for sub in family.sub_themes.values() for s in sub.content_segments] == ["姐姐的故事"]
+
+    asyncio.run(run())
+
+if __name__ == "__main__":
+    test_lazy_lru_dict()
+    test_theme_round_trip()
+    test_segments_stored_by_reference()
+    test_msgpack_round_trip()
+    test_theme_snapshot_isolated_from_refinement()
+    test_reloaded_theme_shares_live_segment()
+    test_new_theme_pinned_during_update()
@@ -0,0 +1,119 @@
+import asyncio
+import os
+import tempfile
+from langchain_core.embeddings import Embeddings
+from config.config import Config
+from core.sub_theme_clusterer import SubThemeClusterer
+from core.theme_manager import ThemeManager
+from core.vector_store import VectorStoreManager
+from helpers import make_segment
+
+def make_event_segment(content: str, event: str):
+    return make_segment(content, entities={"人物": ["姐姐"], "事件": [event]})
+
+class CountingEmbeddings(Embeddings):
+    def __init__(self):
+        self.calls = 0
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        self.calls += 1
+        return [float(len(text)), 1.0]
+
+def test_online_clustering():
+    """测试相近片段归入同一子主题、不同内容新建子主题、子主题中心接近时合并、重启后保持"""
+    vectors = {
+        "包饺子": [1.0, 0.0],
+        "包汤圆": [0.99, 0.1],
+        "看海": [0.7, 0.714],
+        "海边散步": [0.88, 0.47],
+        "海边捡贝壳": [0.88, 0.47]
+    }
+
+    async def embed(segment):
+        return vectors[segment.content]
+
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "clusters.json")
+            config = {**Config.SUB_THEMES, "ASSIGN_THRESHOLD": 0.75, "MERGE_THRESHOLD": 0.85}
+            theme_manager = ThemeManager(clusterer=SubThemeClusterer(embed, path, config))
+
+            await theme_manager.update_theme_content("家庭", make_event_segment("包饺子", "包饺子"))
+            await theme_manager.update_theme_content("家庭", make_event_segment("包汤圆", "包汤圆"))
+            await theme_manager.update_theme_content("家庭", make_event_segment("看海", "看海"))
+            sub_themes = theme_manager.themes["家庭"].sub_themes
+            assert {name: len(s.content_segments) for name, s in sub_themes.items()} == {"包饺子": 2, "看海": 1}
+
+            await theme_manager.update_theme_content("家庭", make_event_segment("海边散步", "散步"))
+            await theme_manager.update_theme_content("家庭", make_event_segment("海边捡贝壳", "捡贝壳"))
+            # 两个子主题的中心已足够接近，合并到片段较多的一个
+            assert list(sub_themes) == ["看海"]
+            assert [s.content for s in sub_themes["看海"].content_segments] == [
+                "包饺子", "包汤圆", "看海", "海边散步", "海边捡贝壳"
+            ]
+            assert theme_manager.theme_stats["家庭"]["sub_themes"] == ["看海"]
+
+            restarted = SubThemeClusterer(embed, path, config)
+            assert restarted.sub_themes("家庭") == {"看海": 5}
+            name, merges = await restarted.assign("家庭", make_event_segment("包饺子", "包饺子"))
+            assert name == "看海" and merges == []
+
+    asyncio.run(run())
+
+def test_updated_cluster_merged_into_larger():
+    """测试片段加入的子主题较小并被合并时，片段归入合并后保留的子主题"""
+    vectors = {
+        "a1": [1.0, 0.0, 0.0],
+        "a2": [1.0, 0.0, 0.0],
+        "a3": [1.0, 0.0, 0.0],
+        "b1": [0.7, 0.71414, 0.0],
+        "b2": [0.7, 0.39278, 0.59643]
+    }
+
+    async def embed(segment):
+        return vectors[segment.content]
+
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            config = {**Config.SUB_THEMES, "ASSIGN_THRESHOLD": 0.75, "MERGE_THRESHOLD": 0.73}
+            clusterer = SubThemeClusterer(embed, os.path.join(tmp_dir, "clusters.json"), config)
+            theme_manager = ThemeManager(clusterer=clusterer)
+            for content in ["a1", "a2", "a3", "b1"]:
+                await theme_manager.update_theme_content("家庭", make_event_segment(content, content))
+            sub_themes = theme_manager.themes["家庭"].sub_themes
+            assert {name: len(s.content_segments) for name, s in sub_themes.items()} == {"a1": 3, "b1": 1}
+
+            # b2归入b1，更新后的b1与a1足够接近，并入片段较多的a1
+            await theme_manager.update_theme_content("家庭", make_event_segment("b2", "b2"))
+            assert list(sub_themes) == ["a1"]
+            assert [s.content for s in sub_themes["a1"].content_segments] == ["a1", "a2", "a3", "b1", "b2"]
+            assert clusterer.sub_themes("家庭") == {"a1": 5}
+
+    asyncio.run(run())
+
+def test_clustering_reuses_stored_embeddings():
+    """测试聚类复用写入向量库时计算的向量，不重复调用嵌入接口"""
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            embeddings = CountingEmbeddings()
+            manager = VectorStoreManager(embeddings, lexical_dir="", backend="local",
+                                         persist_directory=tmp_dir)
+            segment = make_event_segment("姐姐包饺子", "包饺子")
+            await manager.add_memory(segment.content, {"id": segment.id})
+            assert embeddings.calls == 1
+            assert await manager.embedding_for(segment.content, segment.id) == [5.0, 1.0]
+            assert embeddings.calls == 1
+            await manager.embedding_for("没有写入过的文本")
+            assert embeddings.calls == 2
+            manager.close()
+
+    asyncio.run(run())
+
+if __name__ == "__main__":
+    test_online_clustering()
+    test_updated_cluster_merged_into_larger()
+    test_clustering_reuses_stored_embeddings()
+    print("子主题聚类测试通过")
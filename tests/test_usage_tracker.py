@@ -0,0 +1,151 @@
+import asyncio
+import tempfile
+from config.config import Config
+from core.storage_manager import StorageManager
+from utils.usage_tracker import BudgetExceededError, UsageTracker
+from helpers import FakeLLM, FakeMessage, make_api_manager
+
+class UsageModel(FakeLLM):
+    """返回带用量信息的响应的模型"""
+
+    def __init__(self, model_name, usage=None):
+        super().__init__()
+        self.model_name = model_name
+        self.usage = usage
+
+    def reply(self, messages):
+        return FakeMessage("好的", usage_metadata=self.usage)
+
+def make_tracker(**budget) -> UsageTracker:
+    return UsageTracker({
+        **Config.USAGE,
+        "PRICES": {"big": {"INPUT": 1.0, "OUTPUT": 2.0}, "cheap": {"INPUT": 0.0, "OUTPUT": 0.0}},
+        "SESSION_BUDGET": {"TOKENS": None, "COST": None, **budget}
+    })
+
+def test_usage_aggregation():
+    """测试按角色、模型、主题汇总用量和费用，响应未提供用量时按长度估算"""
+    tracker = make_tracker()
+    tracker.record_response(
+        "generate", "big",
+        FakeMessage("", usage_metadata={"input_tokens": 1000, "output_tokens": 500}),
+        theme="家庭"
+    )
+    tracker.record_response(
+        "question", "big",
+        FakeMessage("", response_metadata={"token_usage": {"prompt_tokens": 200, "completion_tokens": 100}}),
+        theme="家庭"
+    )
+    tracker.record_response("extract", "other", FakeMessage("一二三"), [FakeMessage("一二三四五六")])
+    tracker.record_embedding("cheap", ["姐姐包饺子"])
+
+    assert tracker.roles["generate"]["cost"] == 2.0
+    assert tracker.roles["question"]["input_tokens"] == 200
+    assert tracker.roles["extract"]["input_tokens"] == 4 and tracker.roles["extract"]["output_tokens"] == 2
+    assert tracker.roles["embedding"]["cost"] == 0.0
+    assert tracker.themes["家庭"]["calls"] == 2 and tracker.themes["家庭"]["cost"] == 2.4
+    assert tracker.models["big"]["output_tokens"] == 600
+    assert tracker.total["calls"] == 4
+
+def test_usage_persistence():
+    """测试用量和会话预算按会话保存，恢复会话后继续累计"""
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            storage = StorageManager(tmp_dir)
+            tracker = make_tracker()
+            tracker.reset("s1", budget={"TOKENS": 10000, "COST": None})
+            tracker.record("generate", "big", 100, 50, theme="家庭")
+            await storage.save_usage("s1", tracker.snapshot())
+
+            restored = make_tracker()
+            restored.reset("s1", await storage.load_usage("s1"))
+            restored.record("generate", "big", 100, 50, theme="家庭")
+            assert restored.roles["generate"]["calls"] == 2
+            assert restored.themes["家庭"]["input_tokens"] == 200
+            assert restored.fraction_used() == 0.03
+            assert await storage.load_usage("s2") is None
+
+    asyncio.run(run())
+
+def test_budget_degradation():
+    """测试接近预算时跳过可选调用、其余调用改用低价模型"""
+    async def run():
+        tracker = make_tracker(TOKENS=1000)
+        manager = make_api_manager(usage=tracker)
+        big = UsageModel("big", usage={"input_tokens": 500, "output_tokens": 350})
+        cheap = UsageModel("cheap", usage={"input_tokens": 500, "output_tokens": 100})
+        manager.register_fallback("question", cheap)
+
+        await manager.execute_with_retry(big.ainvoke, [], role="question", theme="家庭")
+        assert tracker.status() == "degraded" and not tracker.allows_optional()
+
+        try:
+            await manager.execute_with_retry(big.ainvoke, [], role="speculate")
+            assert False, "可选调用应被跳过"
+        except BudgetExceededError:
+            pass
+
+        await manager.execute_with_retry(big.ainvoke, [], role="question", theme="家庭")
+        assert big.calls == 1 and cheap.calls == 1
+        assert tracker.models["cheap"]["calls"] == 1
+        assert tracker.degraded == {"skipped": 1, "fallback": 1}
+        assert tracker.status() == "exhausted"
+
+        # 超出预算后没有登记低价模型的角色不再调用原模型
+        try:
+            await manager.execute_with_retry(big.ainvoke, [], role="summarize")
+            assert False, "没有低价模型的调用应被跳过"
+        except BudgetExceededError:
+            pass
+        assert big.calls == 1 and tracker.degraded == {"skipped": 2, "fallback": 1}
+
+    asyncio.run(run())
+
+class FlakyModel(UsageModel):
+    """第一次调用先等待latency秒再超时失败，之后正常返回"""
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__("big", usage={"input_tokens": 100, "output_tokens": 50})
+        self.latency = latency
+
+    def reply(self, messages):
+        return asyncio.TimeoutError() if self.calls == 1 else super().reply(messages)
+
+    def delay(self) -> float:
+        return self.latency if self.calls == 1 else 0.0
+
+def test_retries_and_hedges_counted():
+    """测试失败重试的请求和对冲中落后的请求也计入用量"""
+    retry_config = {
+        "DEFAULT": {
+            "MAX_RETRIES": 3, "BASE_DELAY": 0.01, "MAX_DELAY": 0.02, "MAX_RETRY_AFTER": 1.0,
+            "BREAKER_THRESHOLD": 5, "BREAKER_COOLDOWN": 1.0, "HEDGE_AFTER": None
+        },
+        "ROLES": {"hedged": {"HEDGE_AFTER": 0.05}}
+    }
+    messages = [FakeMessage("一二三四五六")]
+
+    async def run():
+        tracker = make_tracker()
+        manager = make_api_manager(retry_config, usage=tracker)
+        await manager.execute_with_retry(FlakyModel().ainvoke, messages, role="question")
+        # 失败的请求按提示词估算输入用量
+        usage = tracker.roles["question"]
+        assert (usage["calls"], usage["input_tokens"], usage["output_tokens"]) == (2, 104, 50)
+
+        tracker = make_tracker()
+        manager = make_api_manager(retry_config, usage=tracker)
+        model = FlakyModel(latency=1.0)
+        await manager.execute_with_retry(model.ainvoke, messages, role="hedged")
+        assert manager.counters["hedge_wins"] == 1
+        # 落后的主请求被取消，同样计入
+        assert tracker.roles["hedged"]["calls"] == 2 and tracker.roles["hedged"]["input_tokens"] == 104
+
+    asyncio.run(run())
+
+if __name__ == "__main__":
+    test_usage_aggregation()
+    test_usage_persistence()
+    test_budget_degradation()
+    test_retries_and_hedges_counted()
+    print("用量统计测试通过")
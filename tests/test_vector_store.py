@@ -0,0 +1,323 @@
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime
+import numpy as np
+from config.config import Config
+from core.lexical_index import BigramIndex
+from core.vector_backends import LocalCollection, collection_name
+from core.vector_store import VectorStoreManager
+from helpers import HashEmbeddings
+
+class BlockingStore:
+    """模拟同步的后端集合：每次调用阻塞一段时间，并记录同时进行的调用数"""
+
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.documents = []
+        self.active = 0
+        self.max_active = 0
+        self.active_writes = 0
+        self.max_active_writes = 0
+        self._lock = threading.Lock()
+
+    def _enter(self, write=False):
+        with self._lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            if write:
+                self.active_writes += 1
+                self.max_active_writes = max(self.max_active_writes, self.active_writes)
+
+    def _exit(self, write=False):
+        with self._lock:
+            self.active -= 1
+            if write:
+                self.active_writes -= 1
+
+    def add(self, ids, embeddings, documents, metadatas):
+        self._enter(write=True)
+        time.sleep(self.delay)
+        self.documents.extend(zip(ids, documents, metadatas))
+        self._exit(write=True)
+
+    def query(self, embedding, k, where=None):
+        self._enter()
+        time.sleep(self.delay)
+        results = [(doc_id, text, metadata, 0.1) for doc_id, text, metadata in self.documents[:k]]
+        self._exit()
+        return results
+
+class BlockingIndex(BigramIndex):
+    """每次写入和检索阻塞一段时间的内存词法索引"""
+
+    def __init__(self, delay=0.05):
+        super().__init__(storage_path="")
+        self.delay = delay
+
+    def add(self, doc_id, content, metadata=None):
+        time.sleep(self.delay)
+        super().add(doc_id, content, metadata)
+
+    def search(self, query, k=3, predicate=None):
+        time.sleep(self.delay)
+        return super().search(query, k=k, predicate=predicate)
+
+def make_manager(store, max_concurrency=2):
+    manager = VectorStoreManager(HashEmbeddings(), max_concurrency=max_concurrency, lexical_dir="")
+    manager._collections[manager.tenant] = store
+    return manager
+
+def test_operations_do_not_block_event_loop():
+    """测试阻塞的嵌入和索引调用在线程池中执行，事件循环保持响应"""
+    async def run():
+        manager = make_manager(BlockingStore(delay=0.1))
+        manager._lexical_indexes[manager.tenant] = BlockingIndex(delay=0.1)
+        lags = []
+        stop = asyncio.Event()
+
+        async def heartbeat():
+            while not stop.is_set():
+                start = time.perf_counter()
+                await asyncio.sleep(0.005)
+                lags.append(time.perf_counter() - start - 0.005)
+
+        beat = asyncio.create_task(heartbeat())
+        assert await manager.add_memory("姐姐包饺子", {"id": "s1", "themes": ["家庭"]})
+        results = await manager.search_similar("饺子", k=1)
+        lexical_results = await manager.search_lexical("饺子", k=1)
+        stop.set()
+        await beat
+        assert results[0]["content"] == "姐姐包饺子"
+        assert lexical_results[0]["content"] == "姐姐包饺子"
+        assert max(lags) < 0.05
+
+    asyncio.run(run())
+
+def test_bounded_concurrency_and_serialized_writes():
+    """测试并发数受限、写入串行、并发检索和写入结果正确"""
+    async def run():
+        store = BlockingStore(delay=0.02)
+        manager = make_manager(store, max_concurrency=3)
+        await asyncio.gather(*[
+            manager.add_memory(f"第{i}段回忆", {"id": f"s{i}", "themes": ["家庭"]})
+            for i in range(6)
+        ], *[
+            manager.search_hybrid("回忆", k=2, mode="hybrid")
+            for _ in range(6)
+        ])
+        assert len(store.documents) == 6
+        assert store.max_active <= 3
+        assert store.max_active_writes == 1
+        assert len(await manager.search_lexical("回忆", k=10)) == 6
+
+    asyncio.run(run())
+
+def check_tenant_sharding(backend):
+    """按会话分片：检索隔离、集合池有界、按租户导出、统计和删除"""
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            manager = VectorStoreManager(
+                HashEmbeddings(),
+                persist_directory=os.path.join(tmp_dir, "vectors"),
+                lexical_dir=os.path.join(tmp_dir, "lexical"),
+                tenant="alice",
+                max_open_collections=2,
+                backend=backend
+            )
+            for tenant, texts in [("alice", ["姐姐包饺子", "爷爷下象棋"]),
+                                  ("bob", ["同事去海边"]),
+                                  ("carol", ["老师教写作业"])]:
+                for i, text in enumerate(texts):
+                    await manager.add_memory(text, {"id": f"{tenant}-{i}", "session_id": tenant})
+            assert len(manager._collections) == 2 and "alice" not in manager._collections
+
+            results = await manager.search_hybrid("饺子", k=5)
+            assert results and all(r["metadata"]["session_id"] == "alice" for r in results)
+            results = await manager.search_similar("同事去海边", k=5, tenant="carol")
+            assert [r["metadata"]["id"] for r in results] == ["carol-0"]
+            assert sorted(await manager.list_tenants()) == ["alice", "bob", "carol"]
+
+            stats = await manager.tenant_stats("alice")
+            assert stats["documents"] == 2 and stats["lexical_documents"] == 2
+
+            export_path = os.path.join(tmp_dir, "export", "alice.jsonl")
+            records = await manager.export_tenant("alice", path=export_path)
+            assert {r["id"] for r in records} == {"alice-0", "alice-1"}
+            assert os.path.exists(export_path)
+
+            assert await manager.delete_tenant("bob")
+            assert not await manager.delete_tenant("bob")
+            assert sorted(await manager.list_tenants()) == ["alice", "carol"]
+            assert (await manager.tenant_stats("carol"))["documents"] == 1
+
+    asyncio.run(run())
+
+def test_tenant_sharding_chroma():
+    """测试Chroma后端的租户分片"""
+    check_tenant_sharding("chroma")
+
+def test_tenant_sharding_local():
+    """测试进程内后端的租户分片"""
+    check_tenant_sharding("local")
+
+def test_local_collection():
+    """测试进程内索引：增量写入和删除、过滤、重新打开、切换到HNSW、截断的末行"""
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((300, 16)).astype(np.float32)
+    ids = [f"m{i}" for i in range(300)]
+    metadatas = [{"id": doc_id, "even": i % 2 == 0} for i, doc_id in enumerate(ids)]
+    documents = [f"第{i}段" for i in range(300)]
+    config = {**Config.VECTOR_STORE, "HNSW_THRESHOLD": 200}
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        collection = LocalCollection(tmp_dir, "alice", config)
+        collection.add(ids[:150], vectors[:150].tolist(), documents[:150], metadatas[:150])
+        assert collection._graph is None
+        hit = collection.query(vectors[3].tolist(), k=1)[0]
+        assert hit[:3] == ("m3", "第3段", metadatas[3]) and hit[3] < 1e-4
+
+        collection.delete(["m3"])
+        collection.add(["m5"], [vectors[7].tolist()], ["改写"], [metadatas[5]])
+        assert collection.count() == 149
+        assert collection.query(vectors[3].tolist(), k=1)[0][0] != "m3"
+        assert collection.query(vectors[7].tolist(), k=2)[0][0] in ("m5", "m7")
+        assert all(r[2]["even"] for r in collection.query(vectors[1].tolist(), k=5, where={"even": True}))
+
+        collection.add(ids[150:], vectors[150:].tolist(), documents[150:], metadatas[150:])
+        assert collection._graph is not None
+        assert collection.query(vectors[250].tolist(), k=1)[0][0] == "m250"
+        assert collection.query(vectors[3].tolist(), k=1)[0][0] != "m3"
+        collection.close()
+
+        # 模拟写入向量后、写入记录前异常退出
+        with open(collection.vectors_path, 'ab') as f:
+            f.write(b"\0" * 10)
+        reopened = LocalCollection(tmp_dir, "alice", config)
+        assert reopened.count() == 299 and reopened._graph is not None
+        assert reopened.query(vectors[299].tolist(), k=1)[0][0] == "m299"
+        assert reopened.query(vectors[7].tolist(), k=2, where={"even": False})[0][0] in ("m5", "m7")
+        reopened.add(["new"], [vectors[0].tolist()], ["新"], [{"id": "new"}])
+        assert reopened.query(vectors[0].tolist(), k=2)[0][0] in ("m0", "new")
+
+def test_quantized_collection():
+    """测试float16/int8量化粗排加全精度重排：结果与精确检索一致，切换量化方式时重新生成量化数据"""
+    rng = np.random.default_rng(1)
+    vectors = rng.standard_normal((500, 32)).astype(np.float32)
+    ids = [f"m{i}" for i in range(500)]
+    metadatas = [{"id": doc_id} for doc_id in ids]
+    queries = vectors[:20] + 0.05 * rng.standard_normal((20, 32)).astype(np.float32)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        exact = LocalCollection(os.path.join(tmp_dir, "exact"), "alice")
+        exact.add(ids, vectors.tolist(), ids, metadatas)
+        expected = [[r[0] for r in exact.query(q.tolist(), k=5)] for q in queries]
+
+        directory = os.path.join(tmp_dir, "quantized")
+        for mode, code_file in [("float16", "vectors.float16"), ("int8", "vectors.int8")]:
+            config = {**Config.VECTOR_STORE, "QUANTIZATION": mode, "RERANK_FACTOR": 4}
+            collection = LocalCollection(directory, "alice", config)
+            if collection.count() == 0:
+                collection.add(ids, vectors.tolist(), ids, metadatas)
+            assert os.path.exists(os.path.join(directory, code_file))
+            results = [collection.query(q.tolist(), k=5) for q in queries]
+            assert [[r[0] for r in hits] for hits in results] == expected
+            # 重排后的距离是全精度距离
+            assert abs(results[0][0][3] - exact.query(queries[0].tolist(), k=1)[0][3]) < 1e-3
+            collection.close()
+        assert not os.path.exists(os.path.join(directory, "vectors.float16"))
+        assert os.path.exists(os.path.join(directory, "scales.f32"))
+
+def test_migrate_legacy_collection():
+    """测试分租户之前的共用集合按session_id拆分，不重新嵌入"""
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            persist_directory = os.path.join(tmp_dir, "chroma")
+            manager = VectorStoreManager(
+                HashEmbeddings(), persist_directory=persist_directory, lexical_dir=""
+            )
+            client = manager.backend.client
+            legacy = client.create_collection("memory_lane")
+            legacy.add(
+                ids=["a", "b", "c"],
+                embeddings=[[1.0] * 32, [2.0] * 32, [3.0] * 32],
+                documents=["一", "二", "三"],
+                metadatas=[{"session_id": "s1"}, {"session_id": "s2"}, {"id": "c"}]
+            )
+            manager.migrate_legacy()
+            assert sorted(await manager.list_tenants()) == ["default", "s1", "s2"]
+            assert (await manager.tenant_stats("s1"))["documents"] == 1
+            moved = client.get_collection(collection_name("s2")).get(include=["embeddings"])
+            assert list(moved["embeddings"][0]) == [2.0] * 32
+
+    asyncio.run(run())
+
+def test_time_range_filter():
+    """测试按时间范围过滤，起止时间包含边界"""
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            manager = VectorStoreManager(
+                HashEmbeddings(), persist_directory=os.path.join(tmp_dir, "vectors"),
+                lexical_dir=os.path.join(tmp_dir, "lexical"), tenant="alice", backend="local"
+            )
+            for doc_id, day in [("a", 1), ("b", 5), ("c", 9)]:
+                await manager.add_memory(f"第{day}天的回忆", {
+                    "id": doc_id, "timestamp": f"2020-01-0{day}T12:00:00", "themes": ["家庭"]
+                })
+
+            results = await manager.search_similar(
+                "回忆", k=5, start_time="2020-01-05T12:00:00", end_time=datetime(2020, 1, 9, 12)
+            )
+            assert sorted(r["metadata"]["id"] for r in results) == ["b", "c"]
+            results = await manager.search_lexical("回忆", k=5, end_time="2020-01-04T00:00:00")
+            assert [r["metadata"]["id"] for r in results] == ["a"]
+            manager.close()
+
+    asyncio.run(run())
+
+def test_migrated_records_filterable():
+    """测试迁移的早期记录补充了主题、实体和时间字段，可按条件过滤"""
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            manager = VectorStoreManager(
+                HashEmbeddings(), persist_directory=os.path.join(tmp_dir, "chroma"), lexical_dir=""
+            )
+            legacy = manager.backend.client.create_collection("memory_lane")
+            legacy.add(
+                ids=["a", "b"],
+                embeddings=[[1.0] * 32, [2.0] * 32],
+                documents=["姐姐包饺子", "同事去海边"],
+                metadatas=[
+                    {"session_id": "s1", "themes": "家庭,节日", "timestamp": "2020-01-01T00:00:00",
+                     "entities": json.dumps({"人物": ["姐姐"]}, ensure_ascii=False)},
+                    {"session_id": "s1", "themes": "工作", "timestamp": "2021-06-01T00:00:00",
+                     "entities": json.dumps({"人物": ["同事"]}, ensure_ascii=False)}
+                ]
+            )
+            manager.migrate_legacy()
+
+            def contents(results):
+                return [r["content"] for r in results]
+
+            assert contents(await manager.search_similar("回忆", themes=["节日"], tenant="s1")) == ["姐姐包饺子"]
+            assert contents(await manager.search_similar("回忆", entities=["同事"], tenant="s1")) == ["同事去海边"]
+            assert contents(await manager.search_similar(
+                "回忆", start_time="2021-01-01T00:00:00", tenant="s1"
+            )) == ["同事去海边"]
+
+    asyncio.run(run())
+
+if __name__ == "__main__":
+    test_operations_do_not_block_event_loop()
+    test_bounded_concurrency_and_serialized_writes()
+    test_tenant_sharding_chroma()
+    test_tenant_sharding_local()
+    test_local_collection()
+    test_quantized_collection()
+    test_migrate_legacy_collection()
+    test_time_range_filter()
+    test_migrated_records_filterable()
+    print("向量库测试通过")
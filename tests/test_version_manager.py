@@ -0,0 +1,38 @@
+import asyncio
+import tempfile
+import threading
+from core.version_manager import VersionManager
+from utils.io_pool import run_io
+
+def test_snapshot_round_trip():
+    """测试快照写入、列出和恢复（同一秒内的多个快照互不覆盖）"""
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            manager = VersionManager(tmp_dir)
+            history = [{"id": "t1", "topic": "家庭"}]
+            first = await manager.create_snapshot(history, {"家庭": "第一版"}, {}, "第一次")
+            second = await manager.create_snapshot(
+                history + [{"id": "t2", "topic": "旅行"}], {"家庭": "第二版"}, {}, "第二次"
+            )
+            assert first != second
+            versions = await manager.list_versions()
+            assert [v["description"] for v in versions] == ["第二次", "第一次"]
+
+            restored = await manager.restore_version(first)
+            assert restored["generated_contents"] == {"家庭": "第一版"}
+            differences = await manager.compare_versions(first, second)
+            assert differences["dialogue_history"]["added"] == 1
+            assert differences["generated_contents"]["changed_themes"] == ["家庭"]
+
+    asyncio.run(run())
+
+def test_io_runs_off_event_loop():
+    """测试磁盘读写在专用线程池中执行"""
+    async def run():
+        return await run_io(lambda: threading.current_thread().name)
+
+    assert asyncio.run(run()).startswith("storage-io")
+
+if __name__ == "__main__":
+    test_snapshot_round_trip()
+    test_io_runs_off_event_loop()
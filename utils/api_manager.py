@@ -1,7 +1,22 @@
 import asyncio
+import random
 import time
-from typing import Any, Callable
+from collections import Counter
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Dict, Optional
 from functools import wraps
+from config.config import Config
+from utils.usage_tracker import BudgetExceededError, UsageTracker, usage_tracker
+
+# 可重试的HTTP状态码：超时、冲突、频率限制和服务端错误
+RETRYABLE_STATUS = {408, 409, 425, 429, 500, 502, 503, 504}
+# 第三方库（httpx、zhipuai）中表示网络或超时问题的异常类名
+TRANSIENT_ERROR_NAMES = {
+    "TimeoutException", "TransportError", "APITimeoutError", "APIConnectionError"
+}
+
+class CircuitOpenError(Exception):
+    """接口处于熔断状态，请求被直接拒绝"""
 
 class APIRateLimiter:
     def __init__(self, max_requests: int = 1, time_window: int = 2):
@@ -14,50 +29,265 @@ class APIRateLimiter:
         """检查是否需要等待"""
         async with self.lock:
             current_time = time.time()
-            
+
             # 清理过期的请求记录
-            self.requests = [req_time for req_time in self.requests 
+            self.requests = [req_time for req_time in self.requests
                            if current_time - req_time < self.time_window]
-            
+
             # 如果达到限制，等待直到可以发送新请求
             if len(self.requests) >= self.max_requests:
                 wait_time = self.requests[0] + self.time_window - current_time
                 if wait_time > 0:
                     print(f"API限制，等待 {wait_time:.2f} 秒...")
                     await asyncio.sleep(wait_time)
-                
+
             # 添加新请求
             self.requests.append(current_time)
 
+class CircuitBreaker:
+    """单个接口的熔断器
+
+    连续临时性失败达到阈值后进入熔断（open），期间请求直接失败；冷却时间过后放行一个
+    探测请求（half-open），成功则恢复，失败则重新熔断。
+    """
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if self.probing or time.monotonic() - self.opened_at >= self.cooldown:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def remaining(self) -> float:
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.cooldown - (time.monotonic() - self.opened_at))
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.probing or self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+            self.probing = False
+
 class APIManager:
-    def __init__(self):
+    def __init__(self,
+                 retry_config: Optional[Dict] = None,
+                 usage: Optional[UsageTracker] = None):
         self.rate_limiter = APIRateLimiter(max_requests=1, time_window=3)  # 每3秒1个请求
-        self.max_retries = 3
-        self.base_delay = 10  # 增加基础延迟到10秒
+        self.retry_config = retry_config or Config.API_RETRY
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.counters: Counter = Counter()
+        # 用量统计与预算；fallbacks为各角色接近预算时改用的低价模型
+        self.usage = usage or usage_tracker
+        self.fallbacks: Dict[str, Any] = {}
+        
+    def register_fallback(self, role: str, llm: Any):
+        """登记角色的低价模型，会话预算接近上限时改用"""
+        self.fallbacks[role] = llm
+
+    def policy(self, role: str) -> Dict:
+        """调用角色的重试策略（角色配置覆盖默认配置）"""
+        return {**self.retry_config["DEFAULT"], **self.retry_config["ROLES"].get(role, {})}
+
+    @staticmethod
+    def model_of(func: Callable) -> str:
+        """绑定的模型对象的模型名（用于计费），无法识别时为空"""
+        owner = getattr(func, "__self__", None)
+        model = getattr(owner, "model_name", None) or getattr(owner, "model", None)
+        return model if isinstance(model, str) else ""
+
+    @classmethod
+    def endpoint_of(cls, func: Callable) -> str:
+        """按绑定的模型对象区分接口，同一模型的各角色共享熔断状态"""
+        owner = getattr(func, "__self__", None)
+        if owner is None:
+            return getattr(func, "__qualname__", repr(func))
+        return f"{type(owner).__name__}:{cls.model_of(func)}"
 
-    async def execute_with_retry(self, 
-                               func: Callable, 
-                               *args, 
+    def breaker(self, endpoint: str, policy: Dict) -> CircuitBreaker:
+        if endpoint not in self.breakers:
+            self.breakers[endpoint] = CircuitBreaker(
+                policy["BREAKER_THRESHOLD"], policy["BREAKER_COOLDOWN"]
+            )
+        return self.breakers[endpoint]
+
+    @staticmethod
+    def _status_code(error: Exception) -> Optional[int]:
+        status = getattr(error, "status_code", None)
+        if status is None:
+            status = getattr(getattr(error, "response", None), "status_code", None)
+        return status if isinstance(status, int) else None
+
+    @classmethod
+    def is_retryable(cls, error: Exception) -> bool:
+        """按异常类型判断是否为临时性失败"""
+        if isinstance(error, CircuitOpenError):
+            return False
+        status = cls._status_code(error)
+        if status is not None:
+            return status in RETRYABLE_STATUS
+        if isinstance(error, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+            return True
+        if any(klass.__name__ in TRANSIENT_ERROR_NAMES for klass in type(error).__mro__):
+            return True
+        # 未携带状态码的频率限制错误
+        return "429" in str(error)
+
+    @staticmethod
+    def retry_after(error: Exception) -> Optional[float]:
+        """读取响应头中的Retry-After（秒数或HTTP日期）"""
+        headers = getattr(getattr(error, "response", None), "headers", None)
+        value = headers.get("retry-after") if headers is not None else None
+        if value is None:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def backoff_delay(attempt: int, policy: Dict) -> float:
+        """指数退避加完全随机抖动：在[0, min(上限, 基础延迟*2^attempt)]内均匀取值"""
+        return random.uniform(0, min(policy["MAX_DELAY"], policy["BASE_DELAY"] * 2 ** attempt))
+
+    async def execute_with_retry(self,
+                               func: Callable,
+                               *args,
+                               role: str = "default",
+                               theme: Optional[str] = None,
                                **kwargs) -> Any:
-        """执行API调用，带重试机制"""
-        for attempt in range(self.max_retries):
+        """执行API调用，带重试、熔断和可选的对冲请求，每次发出的请求都按角色和主题记录用量
+        
+        会话预算接近上限时，可选角色的调用抛出BudgetExceededError，其余角色改用登记的低价模型；
+        超出预算后没有登记低价模型的角色也抛出BudgetExceededError。
+        """
+        policy = self.policy(role)
+        decision = self.usage.admit(role, has_fallback=role in self.fallbacks)
+        if decision == "skip":
+            raise BudgetExceededError(f"会话预算接近上限，跳过 {role} 调用")
+        if decision == "fallback":
+            func = getattr(self.fallbacks[role], getattr(func, "__name__", "ainvoke"))
+            policy = {**policy, "HEDGE_AFTER": None}  # 降级时不再发出额外的对冲请求
+        endpoint = self.endpoint_of(func)
+        breaker = self.breaker(endpoint, policy)
+
+        def send() -> Awaitable[Any]:
+            return self._attempt(func, args, kwargs, role, theme)
+
+        for attempt in range(policy["MAX_RETRIES"]):
+            is_probe = breaker.state == "half-open"
+            if not breaker.allow():
+                self.counters["short_circuited"] += 1
+                raise CircuitOpenError(
+                    f"接口 {endpoint} 暂不可用（熔断中），{breaker.remaining():.0f} 秒后重试"
+                )
             try:
-                # 等待限流检查
-                await self.rate_limiter.wait_if_needed()
-                
-                # 执行API调用
-                return await func(*args, **kwargs)
-                
-            except Exception as e:
-                if "429" in str(e):  # Too Many Requests
-                    if attempt < self.max_retries - 1:
-                        delay = self.base_delay * (attempt + 1)
-                        print(f"API频率限制，等待 {delay} 秒后重试...")
-                        await asyncio.sleep(delay)
-                    else:
-                        print("达到最大重试次数，操作失败")
-                        raise
+                if policy["HEDGE_AFTER"] is not None:
+                    result = await self._call_hedged(send, policy["HEDGE_AFTER"])
                 else:
+                    result = await send()
+                breaker.record_success()
+                return result
+
+            except asyncio.CancelledError:
+                # 被取消的探测请求不应让熔断器一直停在探测状态
+                if is_probe:
+                    breaker.probing = False
+                raise
+            except Exception as e:
+                if not self.is_retryable(e):
+                    # 请求本身的问题，不计入接口健康状况
+                    if is_probe:
+                        breaker.probing = False
                     raise
+                breaker.record_failure()
+                if attempt == policy["MAX_RETRIES"] - 1:
+                    print("达到最大重试次数，操作失败")
+                    raise
+                delay = self.backoff_delay(attempt, policy)
+                retry_after = self.retry_after(e)
+                if retry_after is not None:
+                    delay = max(delay, min(retry_after, policy["MAX_RETRY_AFTER"]))
+                self.counters["retries"] += 1
+                print(f"API调用失败（{type(e).__name__}），等待 {delay:.1f} 秒后重试...")
+                await asyncio.sleep(delay)
+
+    async def _attempt(self, func: Callable, args, kwargs, role: str, theme: Optional[str]) -> Any:
+        """发出一次请求并记录用量：成功时取自响应；请求发出后失败或被取消（如对冲中落后的请求）时，
+        按提示词估算输入用量，重试和对冲产生的额外消耗同样计入预算"""
+        # 等待限流检查
+        await self.rate_limiter.wait_if_needed()
+        messages = args[0] if args else None
+        try:
+            result = await func(*args, **kwargs)
+        except BaseException:
+            self.usage.record_response(role, self.model_of(func), None, messages, theme=theme)
+            raise
+        self.usage.record_response(role, self.model_of(func), result, messages, theme=theme)
+        return result
+
+    async def _call_hedged(self, call: Callable[[], Awaitable[Any]], hedge_after: float) -> Any:
+        """主请求超过hedge_after秒未返回时再发出一个相同请求，取先成功的结果"""
+        primary = asyncio.create_task(call())
+        pending = {primary}
+        error = None
+        try:
+            # 调用方被取消时（包括等待主请求期间），finally中取消所有未完成的请求
+            done, pending = await asyncio.wait(pending, timeout=hedge_after)
+            if done:
+                return primary.result()
+
+            self.counters["hedged"] += 1
+            hedge = asyncio.create_task(call())
+            pending = {primary, hedge}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.counters["hedge_wins"] += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+            # 等待被取消的请求结束，使其用量在返回前记录
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    def stats(self) -> Dict:
+        """重试、对冲与各接口熔断状态"""
+        return {
+            **self.counters,
+            "breakers": {
+                endpoint: breaker.state for endpoint, breaker in self.breakers.items()
+            }
+        }
 
-api_manager = APIManager()  # 创建全局实例 
\ No newline at end of file
+api_manager = APIManager()  # 创建全局实例
@@ -1,25 +1,137 @@
 import asyncio
-from typing import Callable
+from typing import Any, Callable, Dict, List, Optional
 import time
 
+class ChangeTracker:
+    """记录自上次保存以来被修改的实体
+
+    实体按类别（如"themes"、"turns"）和键记录，可附带需要保存的值；同一实体多次修改只记一次，
+    保持首次标记的顺序。有新的修改时通知订阅者（如AutoSaver）。
+    """
+
+    def __init__(self):
+        self._dirty: Dict[str, Dict[Any, Any]] = {}
+        self._listeners: List[Callable[[], None]] = []
+
+    def subscribe(self, listener: Callable[[], None]):
+        self._listeners.append(listener)
+
+    def mark(self, category: str, key: Any, value: Any = None):
+        """标记实体已修改"""
+        self._dirty.setdefault(category, {})[key] = value
+        for listener in self._listeners:
+            listener()
+
+    def is_dirty(self, category: str, key: Any) -> bool:
+        return key in self._dirty.get(category, {})
+
+    def discard(self, category: str, key: Any):
+        """实体已通过其他途径保存（如缓存淘汰时回写）"""
+        self._dirty.get(category, {}).pop(key, None)
+
+    def has_changes(self) -> bool:
+        return any(self._dirty.values())
+
+    def drain(self) -> Dict[str, Dict[Any, Any]]:
+        """取出并清空全部修改记录"""
+        changes = {category: items for category, items in self._dirty.items() if items}
+        self._dirty = {}
+        return changes
+
+    def restore(self, changes: Dict[str, Dict[Any, Any]]):
+        """保存失败时放回修改记录（不覆盖期间产生的新修改）"""
+        for category, items in changes.items():
+            self._dirty[category] = {**items, **self._dirty.get(category, {})}
+
 class AutoSaver:
-    def __init__(self, 
-                 save_function: Callable, 
-                 interval: int = 300):  # 默认5分钟
+    def __init__(self,
+                 save_function: Callable,
+                 interval: int = 300,  # 默认5分钟
+                 tracker: Optional[ChangeTracker] = None,
+                 debounce: float = 2.0,
+                 max_failures: int = 5):
+        """自动保存
+
+        未提供tracker时每隔interval秒调用一次save_function()；提供tracker时按修改触发：
+        最后一次修改后安静debounce秒（或距首个未保存修改已达interval秒）时，
+        调用save_function(changes)只保存这期间修改过的实体，没有修改时不做任何I/O。
+        保存失败时按指数退避重试，连续失败max_failures次后不再自动重试，之后每次新的修改只再尝试一次。
+        """
         self.save_function = save_function
         self.interval = interval
+        self.tracker = tracker
+        self.debounce = debounce
         self.last_save_time = time.time()
+        self.save_count = 0
+        self.max_failures = max_failures
+        self.failures = 0  # 连续保存失败的次数
         self.running = False
-        
+        self._first_change: Optional[float] = None
+        self._last_change: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+        if tracker is not None:
+            tracker.subscribe(self.notify)
+
     async def start(self):
-        """启动自动保存"""
+        """启动自动保存（按修改触发时立即返回）"""
         self.running = True
+        if self.tracker is not None:
+            return
         while self.running:
             await asyncio.sleep(self.interval)
             if self.running:  # 再次检查，避免在sleep期间被停止
                 await self.save_function()
                 self.last_save_time = time.time()
-                
+
+    def notify(self):
+        """有新的修改时安排一次防抖保存"""
+        if not self.running:
+            return
+        now = time.monotonic()
+        if self._first_change is None:
+            self._first_change = now
+        self._last_change = now
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._save_when_quiet())
+
+    async def _save_when_quiet(self):
+        while self.running and self.tracker.has_changes():
+            if self._first_change is None:
+                # 保存失败后放回的修改，按新修改重新计时
+                self._first_change = self._last_change = time.monotonic()
+            wait = min(
+                self._last_change + self.debounce,
+                self._first_change + self.interval
+            ) - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            await self.flush()
+            if not self.failures:
+                continue
+            if self.failures >= self.max_failures:
+                print(f"自动保存连续失败 {self.failures} 次，暂停重试，有新的修改时再尝试")
+                return
+            await asyncio.sleep(min(self.debounce * 2 ** self.failures, self.interval))
+
+    async def flush(self):
+        """立即保存全部未保存的修改"""
+        async with self._lock:
+            self._first_change = None
+            changes = self.tracker.drain()
+            if not changes:
+                return
+            try:
+                await self.save_function(changes)
+                self.last_save_time = time.time()
+                self.save_count += 1
+                self.failures = 0
+            except Exception as e:
+                print(f"自动保存失败: {e}")
+                self.failures += 1
+                self.tracker.restore(changes)
+
     def stop(self):
         """停止自动保存"""
-        self.running = False 
\ No newline at end of file
+        self.running = False
@@ -0,0 +1,91 @@
+import json
+import struct
+from typing import Any, BinaryIO, Dict, Optional
+
+class JsonCodec:
+    """JSON编解码：记录表每行一条记录，单独的文档带缩进便于查看"""
+
+    name = "json"
+    document_extension = ".json"
+    table_extension = ".jsonl"
+    frame_overhead = 0  # 行尾换行符计入记录内容
+
+    def dumps(self, obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+    def loads(self, data: bytes) -> Any:
+        return json.loads(data)
+
+    def dump_document(self, obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, indent=2).encode('utf-8')
+
+    def frame(self, obj: Any) -> bytes:
+        return self.dumps(obj) + b"\n"
+
+    def read_frame(self, f: BinaryIO) -> Optional[bytes]:
+        """读取一条记录的原始字节，文件结束时返回None"""
+        return f.readline() or None
+
+class MsgpackCodec:
+    """msgpack二进制编解码：记录表中每条记录前带4字节长度"""
+
+    name = "msgpack"
+    document_extension = ".msgpack"
+    table_extension = ".msgpack"
+    _HEADER = struct.Struct("<I")
+    frame_overhead = _HEADER.size
+
+    def __init__(self):
+        import ormsgpack
+        self._packb = ormsgpack.packb
+        self._unpackb = ormsgpack.unpackb
+
+    def dumps(self, obj: Any) -> bytes:
+        return self._packb(obj)
+
+    def loads(self, data: bytes) -> Any:
+        return self._unpackb(data)
+
+    def dump_document(self, obj: Any) -> bytes:
+        return self._packb(obj)
+
+    def frame(self, obj: Any) -> bytes:
+        payload = self._packb(obj)
+        return self._HEADER.pack(len(payload)) + payload
+
+    def read_frame(self, f: BinaryIO) -> Optional[bytes]:
+        """读取一条记录的原始字节，文件结束或末尾记录不完整时返回None"""
+        header = f.read(self._HEADER.size)
+        if len(header) < self._HEADER.size:
+            return None
+        size, = self._HEADER.unpack(header)
+        payload = f.read(size)
+        if len(payload) < size:
+            return None
+        return payload
+
+def construct_unvalidated(model_cls, fields: Dict[str, Any]):
+    """跳过pydantic校验直接构建模型实例，仅用于本程序当前版本写入的可信数据
+
+    调用方须提供全部字段且类型正确（如datetime字段已解析）。pydantic自带的
+    model_construct逐字段处理默认值，比校验本身还慢，因此这里直接设置实例字典。
+    """
+    instance = model_cls.__new__(model_cls)
+    object.__setattr__(instance, '__dict__', fields)
+    object.__setattr__(instance, '__pydantic_fields_set__', set(fields))
+    object.__setattr__(instance, '__pydantic_extra__', None)
+    object.__setattr__(instance, '__pydantic_private__', None)
+    return instance
+
+CODECS = {
+    "json": JsonCodec,
+    "msgpack": MsgpackCodec,
+}
+
+def get_codec(name: str):
+    """按名称创建编解码器，依赖缺失时退回JSON"""
+    try:
+        return CODECS[name]()
+    except ImportError as e:
+        print(f"{name}编解码不可用，改用JSON: {e}")
+        return JsonCodec()
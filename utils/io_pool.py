@@ -0,0 +1,16 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+from config.config import Config
+
+# 磁盘读写和序列化专用的有界线程池：不阻塞事件循环，也不与asyncio.to_thread共用默认线程池
+io_executor = ThreadPoolExecutor(
+    max_workers=Config.STORAGE["IO_WORKERS"],
+    thread_name_prefix="storage-io"
+)
+
+async def run_io(func: Callable, *args, **kwargs) -> Any:
+    """在I/O线程池中执行同步函数"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(io_executor, functools.partial(func, *args, **kwargs))
@@ -1,25 +1,183 @@
 import json
-from typing import Dict, List, Union
+from collections import Counter
+from typing import Any, Dict, Iterator, List, Union
+
+_OPENERS = {'{': '}', '[': ']'}
+_CLOSERS = {'}', ']'}
+# _loads解析失败的标记（与合法的JSON null区分）
+_INVALID = object()
 
 class ResponseParser:
+    # 按提示词统计的解析次数、修复次数和失败次数（进程内共享，新会话开始时由reset_stats清空）
+    attempts: Counter = Counter()
+    repairs: Counter = Counter()
+    failures: Counter = Counter()
+
+    @classmethod
+    def parse_llm_response(cls,
+                           response_text: str,
+                           schema: Any = None,
+                           prompt: str = "default",
+                           default: Any = None) -> Union[Dict, List]:
+        """解析LLM的JSON响应
+
+        依次尝试文本中每个JSON对象/数组候选（可夹杂说明文字或代码块），
+        原样解析失败时做一次低成本修复（尾逗号、单引号、Python字面量、未闭合括号），
+        返回第一个符合schema的结果；全部失败时计入该提示词的失败次数并返回default。
+        schema写法见 matches_schema。
+        """
+        cls.attempts[prompt] += 1
+        for candidate in cls.iter_candidates(response_text or ""):
+            value = cls._loads(candidate)
+            if value is _INVALID:
+                value = cls._loads(cls.repair(candidate))
+                if value is not _INVALID and cls.matches_schema(value, schema):
+                    cls.repairs[prompt] += 1
+                    return value
+            elif cls.matches_schema(value, schema):
+                return value
+        cls.failures[prompt] += 1
+        if default is None:
+            return {
+                "entities": {},
+                "keywords": []
+            }
+        return default
+
+    @staticmethod
+    def iter_candidates(text: str) -> Iterator[str]:
+        """单遍扫描文本，按出现顺序产出最外层括号配对完整的片段
+
+        字符串内的括号不计入配对；括号不匹配时丢弃当前片段；文本结束时仍未闭合的片段
+        （输出被截断）原样作为最后一个候选，由repair补齐。
+        """
+        stack: List[str] = []
+        start = 0
+        in_string = False
+        escaped = False
+        for i, ch in enumerate(text):
+            if not stack:
+                if ch in _OPENERS:
+                    stack.append(_OPENERS[ch])
+                    start = i
+                continue
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif ch == '\\':
+                    escaped = True
+                elif ch == '"':
+                    in_string = False
+            elif ch == '"':
+                in_string = True
+            elif ch in _OPENERS:
+                stack.append(_OPENERS[ch])
+            elif ch in _CLOSERS:
+                if ch != stack.pop():
+                    stack = []
+                    continue
+                if not stack:
+                    yield text[start:i + 1]
+        if stack:
+            yield text[start:]
+
+    @staticmethod
+    def repair(candidate: str) -> str:
+        """修复常见的格式问题：尾逗号、单引号字符串、Python的True/False/None、未闭合的字符串和括号"""
+        if '"' not in candidate:
+            candidate = candidate.replace("'", '"')
+        out = []
+        stack: List[str] = []
+        in_string = False
+        escaped = False
+        i = 0
+        while i < len(candidate):
+            ch = candidate[i]
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif ch == '\\':
+                    escaped = True
+                elif ch == '"':
+                    in_string = False
+            elif ch == '"':
+                in_string = True
+            elif ch in _OPENERS:
+                stack.append(_OPENERS[ch])
+            elif ch in _CLOSERS:
+                if stack:
+                    stack.pop()
+            elif ch == ',':
+                rest = candidate[i + 1:].lstrip()
+                if not rest or rest[0] in _CLOSERS:
+                    i += 1
+                    continue
+            else:
+                for literal, replacement in (("True", "true"), ("False", "false"), ("None", "null")):
+                    if candidate.startswith(literal, i):
+                        out.append(replacement)
+                        i += len(literal)
+                        break
+                else:
+                    out.append(ch)
+                    i += 1
+                continue
+            out.append(ch)
+            i += 1
+        if in_string:
+            out.append('"')
+        while out and out[-1].isspace():
+            out.pop()
+        if stack and out and out[-1] == ',':
+            out.pop()
+        out.extend(reversed(stack))
+        return ''.join(out)
+
+    @staticmethod
+    def matches_schema(value: Any, schema: Any) -> bool:
+        """检查解析结果的结构
+
+        schema为None时不检查；为类型时检查isinstance；为[T]时检查列表每个元素；
+        为{键: T}时检查这些键都存在且各自符合T。
+        """
+        if schema is None:
+            return True
+        if isinstance(schema, type):
+            return isinstance(value, schema)
+        if isinstance(schema, list):
+            return isinstance(value, list) and all(
+                ResponseParser.matches_schema(item, schema[0]) for item in value
+            )
+        if isinstance(schema, dict):
+            return isinstance(value, dict) and all(
+                key in value and ResponseParser.matches_schema(value[key], sub_schema)
+                for key, sub_schema in schema.items()
+            )
+        return False
+
+    @classmethod
+    def stats(cls) -> Dict[str, Dict[str, int]]:
+        """各提示词的解析次数、修复成功次数和失败次数"""
+        return {
+            prompt: {
+                "attempts": cls.attempts[prompt],
+                "repairs": cls.repairs[prompt],
+                "failures": cls.failures[prompt]
+            }
+            for prompt in cls.attempts
+        }
+
+    @classmethod
+    def reset_stats(cls):
+        """清空统计（新会话开始时）"""
+        cls.attempts.clear()
+        cls.repairs.clear()
+        cls.failures.clear()
+
     @staticmethod
-    def parse_llm_response(response_text: str) -> Dict:
-        """解析LLM的JSON响应"""
+    def _loads(candidate: str) -> Any:
+        """解析失败时返回_INVALID"""
         try:
-            # 尝试直接解析
-            return json.loads(response_text)
-        except json.JSONDecodeError:
-            # 如果直接解析失败，尝试提取JSON部分
-            try:
-                # 查找第一个 { 和最后一个 }
-                start = response_text.find('{')
-                end = response_text.rfind('}') + 1
-                if start >= 0 and end > start:
-                    json_str = response_text[start:end]
-                    return json.loads(json_str)
-            except (json.JSONDecodeError, ValueError):
-                # 如果还是失败，返回默认值
-                return {
-                    "entities": {},
-                    "keywords": []
-                } 
\ No newline at end of file
+            return json.loads(candidate)
+        except (json.JSONDecodeError, ValueError):
+            return _INVALID
@@ -0,0 +1,47 @@
+import json
+import os
+import threading
+from typing import Any, Callable, Optional
+
+class JsonFileStore:
+    """整体写入单个JSON文件的数据存储
+
+    所有者在lock下修改数据并置dirty；save在lock下取快照，不持有lock写临时文件再替换，
+    写文件期间不阻塞修改，可在I/O线程中调用。_save_lock使快照按顺序写入。
+    """
+
+    def __init__(self, storage_path: str, name: str, indent: Optional[int] = 2):
+        self.storage_path = storage_path
+        # 加载失败时提示用的名称
+        self.name = name
+        self.indent = indent
+        self.dirty = False
+        self.lock = threading.Lock()
+        self._save_lock = threading.Lock()
+
+    def save(self, snapshot: Callable[[], Any]):
+        """有修改时写入磁盘；snapshot在lock下调用，返回可序列化的数据副本"""
+        with self._save_lock:
+            with self.lock:
+                if not self.dirty:
+                    return
+                self.dirty = False
+                data = snapshot()
+            directory = os.path.dirname(self.storage_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            temp_path = f"{self.storage_path}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=self.indent)
+            os.replace(temp_path, self.storage_path)
+
+    def load(self) -> Optional[Any]:
+        """读取已保存的数据，文件不存在或读取失败时返回None"""
+        if not os.path.exists(self.storage_path):
+            return None
+        try:
+            with open(self.storage_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            print(f"{self.name}加载失败: {e}")
+            return None
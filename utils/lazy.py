@@ -0,0 +1,31 @@
+import threading
+from typing import Any, Callable
+
+class LazyObject:
+    """延迟构建的对象代理：首次访问属性时才调用工厂函数构建真实对象
+
+    代理自身的方法和属性都以下划线开头，避免遮蔽真实对象的同名公开方法（如缓存的get）。
+    """
+
+    def __init__(self, factory: Callable[[], Any]):
+        self._factory = factory
+        self._instance = None
+        self._lock = threading.Lock()
+
+    @property
+    def _is_built(self) -> bool:
+        return self._instance is not None
+
+    def _resolve(self) -> Any:
+        """返回真实对象，必要时构建（线程安全）"""
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    self._instance = self._factory()
+        return self._instance
+
+    def __getattr__(self, name: str) -> Any:
+        # 仅在代理自身没有该属性时调用，转发给真实对象
+        if name.startswith('__') or name in ('_factory', '_instance', '_lock'):
+            raise AttributeError(name)
+        return getattr(self._resolve(), name)
@@ -0,0 +1,88 @@
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from typing import Any, Callable, Iterable, Iterator, Optional
+from utils.io_pool import run_io
+
+class LazyLRUDict(MutableMapping):
+    """键集合常驻内存、值按需加载的字典
+
+    首次访问某个键时通过loader加载其值，最多在内存中保留capacity个值，
+    超出时按最近最少使用淘汰。pinned(键)为真的值（如尚未保存的修改）不淘汰，
+    由调用方保存后再参与淘汰；可淘汰的值不足时暂时超出capacity。
+    在事件循环中使用load加载，loader在I/O线程中执行。
+    """
+
+    def __init__(self,
+                 loader: Callable[[str], Any],
+                 capacity: int,
+                 keys: Iterable[str] = (),
+                 pinned: Optional[Callable[[str], bool]] = None):
+        self.loader = loader
+        self.capacity = max(1, capacity)
+        self.pinned = pinned
+        self._keys = dict.fromkeys(keys)
+        self._values: "OrderedDict[str, Any]" = OrderedDict()
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in self._keys:
+            raise KeyError(key)
+        if key in self._values:
+            self._values.move_to_end(key)
+            return self._values[key]
+        value = self.loader(key)
+        if value is None:
+            raise KeyError(key)
+        self._values[key] = value
+        self._evict()
+        return value
+
+    async def load(self, key: str) -> Optional[Any]:
+        """取出键的值，未加载时在I/O线程中调用loader；键不存在或加载不到时返回None"""
+        if key not in self._keys:
+            return None
+        if key not in self._values:
+            value = await run_io(self.loader, key)
+            if value is None:
+                return None
+            # 等待期间可能已被加载或写入，以内存中的值为准
+            self._values.setdefault(key, value)
+        self._values.move_to_end(key)
+        value = self._values[key]
+        self._evict()
+        return value
+
+    def __setitem__(self, key: str, value: Any):
+        self._keys[key] = None
+        self._values[key] = value
+        self._values.move_to_end(key)
+        self._evict()
+
+    def __delitem__(self, key: str):
+        del self._keys[key]
+        self._values.pop(key, None)
+
+    def __contains__(self, key: object) -> bool:
+        # 只检查键，不触发加载
+        return key in self._keys
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self._keys))
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def is_loaded(self, key: str) -> bool:
+        return key in self._values
+
+    def _evict(self):
+        excess = len(self._values) - self.capacity
+        if excess <= 0:
+            return
+        # 最近访问的值（最后一个）不淘汰
+        for key in list(self._values)[:-1]:
+            if excess <= 0:
+                break
+            if self.pinned and self.pinned(key):
+                continue
+            del self._values[key]
+            excess -= 1
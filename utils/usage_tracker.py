@@ -0,0 +1,184 @@
+import math
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+from config.config import Config
+
+class BudgetExceededError(Exception):
+    """会话预算接近上限，可选调用被跳过"""
+
+def _empty_usage() -> Dict[str, Any]:
+    return {"calls": 0, "input_tokens": 0, "output_tokens": 0, "cost": 0.0}
+
+class UsageTracker:
+    """按调用角色、模型、主题统计当前会话的token用量和费用，并按会话预算决定是否降级
+
+    用量优先取自模型响应（usage_metadata或response_metadata中的token_usage），
+    响应未提供时（如嵌入接口）按字符数估算。已用比例达到DEGRADE_AT后，
+    可选调用（如预生成问题、后台补全抽取）被跳过，其余调用改用配置的低价模型。
+    """
+
+    def __init__(self, config: Optional[Dict] = None):
+        self.config = config or Config.USAGE
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self,
+              session_id: Optional[str] = None,
+              usage: Optional[Dict] = None,
+              budget: Optional[Dict] = None):
+        """开始新会话的统计，或从保存的用量恢复
+        
+        budget为本会话的预算（{"TOKENS": ..., "COST": ...}），未指定时沿用保存的预算或配置中的默认值。
+        """
+        usage = usage or {}
+        with self._lock:
+            self.session_id = session_id
+            self.budget: Dict = budget or usage.get("budget") or dict(self.config["SESSION_BUDGET"])
+            self.total: Dict[str, Any] = usage.get("total", _empty_usage())
+            self.roles: Dict[str, Dict] = usage.get("roles", {})
+            self.models: Dict[str, Dict] = usage.get("models", {})
+            self.themes: Dict[str, Dict] = usage.get("themes", {})
+            self.degraded: Dict[str, int] = usage.get("degraded", {"skipped": 0, "fallback": 0})
+            self._warned = self.status()
+
+    def estimate_tokens(self, text: str) -> int:
+        return math.ceil(len(text) / self.config["CHARS_PER_TOKEN"])
+
+    def price(self, model: str) -> Dict[str, float]:
+        """模型的每千token价格"""
+        return self.config["PRICES"].get(model, self.config["DEFAULT_PRICE"])
+
+    def record(self,
+               role: str,
+               model: str,
+               input_tokens: int,
+               output_tokens: int = 0,
+               theme: Optional[str] = None):
+        """记录一次调用的用量（可在I/O线程中调用）"""
+        price = self.price(model)
+        cost = (input_tokens * price["INPUT"] + output_tokens * price["OUTPUT"]) / 1000
+        with self._lock:
+            buckets = [
+                self.total,
+                self.roles.setdefault(role, _empty_usage()),
+                self.models.setdefault(model, _empty_usage())
+            ]
+            if theme:
+                buckets.append(self.themes.setdefault(theme, _empty_usage()))
+            for bucket in buckets:
+                bucket["calls"] += 1
+                bucket["input_tokens"] += input_tokens
+                bucket["output_tokens"] += output_tokens
+                bucket["cost"] += cost
+        self._warn_on_change()
+
+    def record_response(self,
+                        role: str,
+                        model: str,
+                        response: Any,
+                        messages: Any = None,
+                        theme: Optional[str] = None):
+        """从模型响应中读取用量并记录，响应未提供用量时按提示词和回复长度估算"""
+        tokens = self.usage_of(response)
+        if tokens is None:
+            prompt = "".join(
+                getattr(message, "content", "") or "" for message in messages or []
+                if isinstance(getattr(message, "content", None), str)
+            )
+            content = getattr(response, "content", None)
+            tokens = (
+                self.estimate_tokens(prompt),
+                self.estimate_tokens(content) if isinstance(content, str) else 0
+            )
+        self.record(role, model, tokens[0], tokens[1], theme=theme)
+
+    def record_embedding(self, model: str, texts: List[str]):
+        """嵌入接口不返回用量，按文本长度估算"""
+        self.record("embedding", model, sum(self.estimate_tokens(text) for text in texts))
+
+    @staticmethod
+    def usage_of(response: Any) -> Optional[Tuple[int, int]]:
+        """响应中的(输入token数, 输出token数)，未提供时返回None"""
+        usage = getattr(response, "usage_metadata", None)
+        if usage:
+            return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+        metadata = getattr(response, "response_metadata", None)
+        token_usage = metadata.get("token_usage") if isinstance(metadata, dict) else None
+        if token_usage:
+            return token_usage.get("prompt_tokens", 0), token_usage.get("completion_tokens", 0)
+        return None
+
+    def fraction_used(self) -> float:
+        """按token和费用预算中较紧的一项计算的已用比例，未设置预算时为0"""
+        budget = self.budget
+        fractions = [0.0]
+        if budget["TOKENS"]:
+            fractions.append((self.total["input_tokens"] + self.total["output_tokens"]) / budget["TOKENS"])
+        if budget["COST"]:
+            fractions.append(self.total["cost"] / budget["COST"])
+        return max(fractions)
+
+    def status(self) -> str:
+        """normal：正常；degraded：接近预算上限；exhausted：已超出预算"""
+        fraction = self.fraction_used()
+        if fraction >= 1.0:
+            return "exhausted"
+        if fraction >= self.config["DEGRADE_AT"]:
+            return "degraded"
+        return "normal"
+
+    def allows_optional(self) -> bool:
+        """是否还可以发起可选调用"""
+        return self.status() == "normal"
+
+    def admit(self, role: str, has_fallback: bool = True) -> str:
+        """决定本次调用的处理方式：normal照常调用；skip跳过可选调用；fallback改用低价模型
+
+        没有登记低价模型的角色在接近预算时仍使用原模型，超出预算后跳过。
+        """
+        status = self.status()
+        if status == "normal":
+            return "normal"
+        if role in self.config["OPTIONAL_ROLES"] or (not has_fallback and status == "exhausted"):
+            decision = "skip"
+        elif has_fallback:
+            decision = "fallback"
+        else:
+            return "normal"
+        with self._lock:
+            self.degraded["skipped" if decision == "skip" else "fallback"] += 1
+        return decision
+
+    def _warn_on_change(self):
+        status = self.status()
+        if status != self._warned:
+            self._warned = status
+            if status == "degraded":
+                print(f"本次会话已用去 {self.fraction_used():.0%} 的预算，跳过可选调用并改用低价模型")
+            elif status == "exhausted":
+                print("本次会话已超出预算，仅保留必要的调用（使用低价模型）")
+
+    def snapshot(self) -> Dict[str, Any]:
+        """可保存的用量数据"""
+        with self._lock:
+            return {
+                "session_id": self.session_id,
+                "budget": dict(self.budget),
+                "total": dict(self.total),
+                "roles": {role: dict(usage) for role, usage in self.roles.items()},
+                "models": {model: dict(usage) for model, usage in self.models.items()},
+                "themes": {theme: dict(usage) for theme, usage in self.themes.items()},
+                "degraded": dict(self.degraded)
+            }
+
+    def summary(self) -> List[str]:
+        """各角色用量的可读摘要"""
+        lines = [
+            f"{role}: {usage['calls']} 次，输入 {usage['input_tokens']} / 输出 {usage['output_tokens']} tokens，"
+            f"约 {usage['cost']:.4f} 元"
+            for role, usage in sorted(self.roles.items())
+        ]
+        lines.append(f"合计约 {self.total['cost']:.4f} 元，预算已用 {self.fraction_used():.0%}")
+        return lines
+
+usage_tracker = UsageTracker()  # 创建全局实例